@@ -0,0 +1,145 @@
+"""change_notifications.py
+Notifies server workers when the downloader has saved new menu data, so that they can
+invalidate or reload exactly the affected entries right away instead of waiting for
+their periodic checks.
+
+Every server worker listens on its own Unix datagram socket in the notifications directory.
+After a menu has been saved, a notification naming the menu and week is sent to all sockets in
+that directory. If no worker is listening (or the sockets can't be used), nothing happens and
+workers fall back to detecting changes themselves.
+"""
+import os, logging, json, socket, threading, atexit, typing
+
+from shared_code import NOTIFICATIONS_DIRECTORY
+
+logger = logging.getLogger(__name__)
+
+MAXIMUM_NOTIFICATION_SIZE = 65536
+
+listeners = []  # Functions to call with every received notification
+listener_process_id = None  # The process ID that the listener was started in
+listener_socket_path = None
+listener_lock = threading.Lock()
+
+
+def publish_change(menu_id: str, week_number: int, year_number: int, **extra) -> None:
+    """Notifies all listening server workers that a menu has changed.
+
+    :param menu_id: The (string) menu ID that changed.
+
+    :param week_number: The week number that changed.
+
+    :param year_number: The year that changed.
+
+    :param extra: Additional information to include in the notification."""
+    if not os.path.isdir(NOTIFICATIONS_DIRECTORY):
+        logger.debug("No notifications directory. Not notifying about changes.")
+        return
+    notification = json.dumps(
+        {
+            "menu_id": menu_id.strip("/"),
+            "week_number": week_number,
+            "year_number": year_number,
+            **extra,
+        }
+    ).encode("utf-8")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as notification_socket:
+        # Don't block the downloader if a worker is not keeping up with its notifications
+        notification_socket.setblocking(False)
+        for socket_filename in os.listdir(NOTIFICATIONS_DIRECTORY):
+            if not socket_filename.endswith(".sock"):
+                continue
+            socket_path = os.path.join(NOTIFICATIONS_DIRECTORY, socket_filename)
+            try:
+                notification_socket.sendto(notification, socket_path)
+                logger.debug(f"Notified {socket_path} about change.")
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The worker is gone. Clean up after it.
+                logger.info(f"Removing stale notification socket {socket_path}...")
+                try:
+                    os.remove(socket_path)
+                except FileNotFoundError:
+                    pass
+            except OSError as e:
+                logger.warning(f"Failed to notify {socket_path} about change: {e}")
+
+
+def add_listener(listener: typing.Callable[[dict], None]) -> None:
+    """Adds a function to call with every received notification.
+
+    :param listener: The function to call. It gets the notification as a dictionary."""
+    listeners.append(listener)
+
+
+def receive_notifications(notification_socket: socket.socket) -> None:
+    """Receives notifications and passes them to the listeners. Runs in a background thread."""
+    while True:
+        try:
+            notification = json.loads(
+                notification_socket.recv(MAXIMUM_NOTIFICATION_SIZE)
+            )
+        except Exception as e:
+            logger.warning(f"Failed to receive change notification: {e}")
+            continue
+        logger.info(f"Received change notification: {notification}")
+        for listener in listeners:
+            try:
+                listener(notification)
+            except Exception as e:
+                logger.warning(
+                    f"Change notification listener failed: {e}", exc_info=True
+                )
+
+
+def remove_listener_socket() -> None:
+    """Removes the listener socket of this process (called on exit)."""
+    if listener_socket_path is not None and listener_process_id == os.getpid():
+        try:
+            os.remove(listener_socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def ensure_listening() -> bool:
+    """Starts listening for notifications in this process if not already listening.
+    Safe to call often: it only does work the first time it is called in a process
+    (including in processes forked after the listener was started).
+
+    :returns: True if listening, False if listening failed (changes will then not be pushed).
+    """
+    if listener_process_id == os.getpid():
+        return listener_socket_path is not None
+    with listener_lock:
+        if listener_process_id == os.getpid():
+            return listener_socket_path is not None
+        return start_listening()
+
+
+def start_listening() -> bool:
+    """Binds this process' notification socket and starts receiving notifications
+    in a background thread. Use ensure_listening instead of calling this directly."""
+    global listener_process_id, listener_socket_path
+    listener_socket_path = os.path.join(NOTIFICATIONS_DIRECTORY, f"{os.getpid()}.sock")
+    try:
+        os.makedirs(NOTIFICATIONS_DIRECTORY, exist_ok=True)
+        if os.path.exists(listener_socket_path):
+            os.remove(listener_socket_path)
+        notification_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        notification_socket.bind(listener_socket_path)
+    except OSError as e:
+        logger.warning(
+            f"Failed to listen for change notifications: {e}. Changes will be detected by polling instead."
+        )
+        listener_socket_path = None
+        listener_process_id = os.getpid()
+        return False
+    listener_process_id = os.getpid()
+    atexit.register(remove_listener_socket)
+    threading.Thread(
+        target=receive_notifications,
+        args=(notification_socket,),
+        name="change-notifications",
+        daemon=True,
+    ).start()
+    logger.info(f"Listening for change notifications on {listener_socket_path}.")
+    return True
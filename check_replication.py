@@ -0,0 +1,187 @@
+"""check_replication.py
+Checks replication (see replication.py) end to end: generates a synthetic cache for a leader in a
+temporary data directory, serves it with a local server, pulls it into a follower in another
+temporary data directory and checks that the follower ends up with exactly the leader's weeks.
+Then a week is changed and another one removed on the leader, and the check is repeated for an
+incremental pull. Exits with status code 1 if the follower doesn't match the leader.
+
+Every step runs in a separate process, since EateryCacher modules read the data directory on import.
+
+Example usage:
+python check_replication.py
+python check_replication.py --locations 5 --years 3
+"""
+import argparse, json, logging, os, shutil, socket, subprocess, sys, tempfile, time
+import typing
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+
+# Prints the SHA-256 hash of every week in the data directory as JSON
+PRINT_WEEK_HASHES_CODE = """
+import json, replication
+replication.publish_manifest()
+weeks = replication.read_manifest()["weeks"]
+print(json.dumps({week_key: entry["sha256"] for week_key, entry in weeks.items() if entry["sha256"] is not None}))
+"""
+# Changes the first week and removes the last week of the first menu in the data directory
+CHANGE_LEADER_WEEKS_CODE = """
+import os, shutil
+from shared_code import CACHED_MENUS_DIRECTORY, read_json_from_file, write_json_to_file
+menu_path = os.path.join(CACHED_MENUS_DIRECTORY, sorted(os.listdir(CACHED_MENUS_DIRECTORY))[0])
+cached_weeks = sorted(os.listdir(menu_path))
+menu_data_file_path = os.path.join(menu_path, cached_weeks[0], "data.json")
+menu_data = read_json_from_file(menu_data_file_path)
+menu_data["menu"]["title"] = "Changed by check_replication.py"
+write_json_to_file(menu_data, menu_data_file_path)
+shutil.rmtree(os.path.join(menu_path, cached_weeks[-1]))
+"""
+# Serves the API using the development server (without debug mode)
+SERVE_CODE = """
+import sys
+from werkzeug.serving import run_simple
+from create_server import app
+run_simple("127.0.0.1", int(sys.argv[1]), app, threaded=True)
+"""
+
+
+def run_in_data_directory(
+    data_directory: str, arguments: typing.List[str]
+) -> subprocess.CompletedProcess:
+    """Runs a Python process using a data directory and fails if it exits with an error.
+
+    :param data_directory: The data directory to use.
+
+    :param arguments: The arguments to pass to the Python interpreter.
+
+    :returns: The completed process (with the output captured)."""
+    completed_process = subprocess.run(
+        [sys.executable, *arguments],
+        cwd=SCRIPT_DIRECTORY,
+        env=dict(os.environ, EATERY_CACHER_DATA_DIRECTORY=data_directory),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    if completed_process.returncode != 0:
+        raise RuntimeError(
+            f"{' '.join(arguments[:2])} exited with status code {completed_process.returncode}."
+        )
+    return completed_process
+
+
+def get_week_hashes(data_directory: str) -> typing.Dict[str, str]:
+    """Gets the SHA-256 hash of every week in a data directory.
+
+    :param data_directory: The data directory."""
+    return json.loads(
+        run_in_data_directory(data_directory, ["-c", PRINT_WEEK_HASHES_CODE]).stdout
+    )
+
+
+def start_server(data_directory: str) -> typing.Tuple[subprocess.Popen, str]:
+    """Starts a local server and waits for it to accept connections.
+    Returns the process and the base URL of the server.
+
+    :param data_directory: The data directory the server should use."""
+    # Grab a free port
+    with socket.socket() as free_port_socket:
+        free_port_socket.bind(("127.0.0.1", 0))
+        port = free_port_socket.getsockname()[1]
+    server_process = subprocess.Popen(
+        [sys.executable, "-c", SERVE_CODE, str(port)],
+        cwd=SCRIPT_DIRECTORY,
+        env=dict(os.environ, EATERY_CACHER_DATA_DIRECTORY=data_directory),
+    )
+    for _ in range(300):
+        if server_process.poll() is not None:
+            raise RuntimeError(
+                "The server exited before it started accepting requests."
+            )
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return server_process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    server_process.terminate()
+    raise RuntimeError("Timed out waiting for the server to start.")
+
+
+def check_follower(leader_directory: str, follower_directory: str) -> bool:
+    """Checks that the follower has exactly the weeks of the leader.
+
+    :param leader_directory: The data directory of the leader.
+
+    :param follower_directory: The data directory of the follower.
+
+    :returns: True if the follower matches the leader."""
+    leader_week_hashes = get_week_hashes(leader_directory)
+    follower_week_hashes = get_week_hashes(follower_directory)
+    if leader_week_hashes == follower_week_hashes:
+        logger.info(
+            f"The follower matches the leader ({len(leader_week_hashes)} weeks)."
+        )
+        return True
+    for week_key in sorted(set(leader_week_hashes) | set(follower_week_hashes)):
+        if leader_week_hashes.get(week_key) != follower_week_hashes.get(week_key):
+            logger.error(
+                f"{week_key}: leader {leader_week_hashes.get(week_key)}, follower {follower_week_hashes.get(week_key)}"
+            )
+    return False
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Checks that a follower replicates a leader (using temporary data directories)."
+    )
+    argument_parser.add_argument(
+        "--locations", type=int, default=3, help="Amount of locations to generate."
+    )
+    argument_parser.add_argument(
+        "--years", type=int, default=2, help="Amount of years to generate."
+    )
+    arguments = argument_parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    leader_directory = tempfile.mkdtemp(prefix="eatery_replication_leader_")
+    follower_directory = tempfile.mkdtemp(prefix="eatery_replication_follower_")
+    server_process = None
+    try:
+        logger.info("Generating synthetic cache for the leader...")
+        run_in_data_directory(
+            leader_directory,
+            [
+                "-c",
+                f"import load_test; load_test.generate_synthetic_cache({arguments.locations}, {arguments.years}, 1)",
+            ],
+        )
+        run_in_data_directory(leader_directory, ["replication.py", "publish"])
+        server_process, leader_url = start_server(leader_directory)
+        logger.info("Pulling everything into the follower...")
+        run_in_data_directory(
+            follower_directory, ["replication.py", "pull", "--leader", leader_url]
+        )
+        follower_matches = check_follower(leader_directory, follower_directory)
+        logger.info("Changing and removing a week on the leader...")
+        run_in_data_directory(leader_directory, ["-c", CHANGE_LEADER_WEEKS_CODE])
+        run_in_data_directory(leader_directory, ["replication.py", "publish"])
+        logger.info("Pulling the changes into the follower...")
+        run_in_data_directory(
+            follower_directory, ["replication.py", "pull", "--leader", leader_url]
+        )
+        follower_matches = (
+            check_follower(leader_directory, follower_directory) and follower_matches
+        )
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+        shutil.rmtree(leader_directory, ignore_errors=True)
+        shutil.rmtree(follower_directory, ignore_errors=True)
+    if not follower_matches:
+        logger.error("The follower does not match the leader.")
+        exit(1)
+    logger.info("Replication works.")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,11 @@ As in, this file loads the server.py file, sets some configuration variables, an
 that can be accessed with a WSGI server.
 """
 
-import logging
+import logging, json_codec
 from configparser import ConfigParser
 from shared_code import CONFIG_FILEPATH
 from flask import Flask
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 
 # Logging
@@ -37,6 +38,36 @@ logger.info("Config read.")
 logging.basicConfig(level=logging_level)
 
 
+class FastJSONProvider(DefaultJSONProvider):
+    """A Flask JSON provider that encodes and decodes JSON using json_codec (orjson if it is installed)."""
+
+    sort_keys = False  # JSON keys are sorted by the code, so we don't want the server to sort them
+
+    def dumps(self, obj, **kwargs):
+        """Encodes data as a JSON string. Arguments that json_codec doesn't support
+        are handled by the default provider."""
+        if set(kwargs) - {"indent", "separators"}:
+            return super().dumps(obj, **kwargs)
+        return json_codec.dumps(
+            obj, indent=bool(kwargs.get("indent")), default=self.default
+        ).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        """Decodes JSON. Arguments that json_codec doesn't support are handled by the default provider."""
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return json_codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Creates a JSON response, encoding the data straight to bytes."""
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            json_codec.dumps(obj, indent=indent, default=self.default) + b"\n",
+            mimetype=self.mimetype,
+        )
+
+
 def create_app():
     """Function for creating an app that can be ran
     using the Flask server (or any other WSGI server)."""
@@ -44,9 +75,10 @@ def create_app():
     # Create a basic app
     app = Flask(__name__)
     CORS(app)  # Enable CORS
-    """JSON keys are sorted by the code, so we don't want the server to
-    sort them."""
-    app.config["JSON_SORT_KEYS"] = False  # Turn off key sorting
+    # Encode responses using the fast JSON codec (which doesn't sort keys, since
+    # JSON keys are sorted by the code)
+    app.json = FastJSONProvider(app)
+    logger.info(f"Using JSON backend {json_codec.BACKEND}.")
     # Register the server blueprint
     logger.info("Registering blueprint...")
     from server import app as server_blueprint
@@ -58,7 +90,9 @@ def create_app():
 
 
 app = create_app()
-if run_server is True:
+# Only run the default server when this file is executed directly, so that other tools (like
+# WSGI servers or the load tester) can import the app without starting a server.
+if run_server is True and __name__ == "__main__":
     logger.info("Server should be ran. Running...")
     logger.warning(
         """WARNING!
@@ -0,0 +1,345 @@
+"""export_static_api.py
+Exports the API as static files, so that a web server like nginx can serve menus without
+Python and only pass other requests (like requests with fields=) on to the API server.
+
+The export contains the exact responses (as rendered by the API server) for:
+* /api/<menu_id>/<week_number> and the day endpoints /api/<menu_id>/<week_number>/<day_number>/ for every cached week
+* /api/available_menus
+* The aliases for the current week: /api/, /api/<menu_id>/now/<day_number>/, /api/<menu_id>/now/today/,
+  /api/<menu_id>/latest and /api/<menu_id>/nearest
+
+Every response is stored as <URL path>/index.json, next to a gzip-compressed index.json.gz (and a
+Brotli-compressed index.json.br if the brotli module is installed). Responses for requests with
+?year=<year> are stored under year/<year>/. Only successful responses are exported, so anything
+else is left to the API server.
+
+Exports are written as generations. A new generation starts as hard links to the files of the
+previous one, and only the files affected by weeks that changed since the previous export are
+rendered again (the aliases for the current week are always rendered again, since they depend on
+the date). The "current" symbolic link is then switched to the new generation in a single rename,
+so readers never see a half-written export.
+
+Example usage:
+python export_static_api.py (exports to the directory configured in the [export] section)
+python export_static_api.py --directory /var/www/eatery-export --full
+"""
+import os, logging, gzip, shutil, time, argparse, typing
+from configparser import ConfigParser
+
+import json_codec, menu_caching
+from shared_code import CONFIG_FILEPATH, DATA_DIRECTORY, get_now
+
+try:
+    import brotli
+except ImportError:  # Brotli compression is optional
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Bump when the exported responses change format, so that the next export is a full export
+EXPORT_FORMAT_VERSION = 1
+MANIFEST_FILE_NAME = "export_manifest.json"
+DAY_NUMBERS = range(1, 8)
+
+
+def get_week_paths(
+    menu_id: str, year_number: int, week_number: int, current_year: int
+) -> typing.List[typing.Tuple[str, str]]:
+    """Gets the URLs of the responses for a week and the files they are stored in.
+
+    :param menu_id: The (string) menu ID.
+
+    :param year_number: The year of the week.
+
+    :param week_number: The week number.
+
+    :param current_year: The current ISO week-year. Weeks of the current year are also exported
+    without the year parameter.
+
+    :returns: A list of (URL, export path) tuples."""
+    week_paths = []
+    urls = [f"/api/{menu_id}/{week_number}"] + [
+        f"/api/{menu_id}/{week_number}/{day_number}/" for day_number in DAY_NUMBERS
+    ]
+    for url in urls:
+        week_paths.append(
+            (f"{url}?year={year_number}", get_export_path(url, year_number))
+        )
+        if year_number == current_year:
+            week_paths.append((url, get_export_path(url)))
+    return week_paths
+
+
+def get_export_path(url_path: str, year_number: typing.Optional[int] = None) -> str:
+    """Gets the path (relative to the export generation) that the response for a URL is stored at.
+
+    :param url_path: The path of the URL, without query parameters.
+
+    :param year_number: The value of the year parameter, or None if there is none."""
+    export_path = os.path.join(*url_path.strip("/").split("/"), "index.json")
+    if year_number is not None:
+        export_path = os.path.join("year", str(year_number), export_path)
+    return export_path
+
+
+def render_response(app, url: str) -> typing.Optional[bytes]:
+    """Renders the response for a URL using the API server, without counting it in the statistics
+    and without applying rate limiting.
+
+    :param app: The Flask app.
+
+    :param url: The URL (path and query string) to render.
+
+    :returns: The response body, or None if the response was not successful."""
+    with app.test_request_context(url):
+        try:
+            response = app.make_response(app.dispatch_request())
+        except Exception as e:
+            logger.warning(f"Failed to render {url}: {e}", exc_info=True)
+            return None
+        try:
+            if response.status_code != 200:
+                return None
+            response.direct_passthrough = False  # Read responses sent from files too
+            return response.get_data()
+        finally:
+            response.close()
+
+
+def write_export_file(generation_directory: str, export_path: str, body: bytes) -> None:
+    """Writes a response and its compressed variants to an export generation. Files are replaced
+    (never written to in place), since they might be hard links to files of the previous generation.
+
+    :param generation_directory: The directory of the generation.
+
+    :param export_path: The path of the file, relative to the generation.
+
+    :param body: The response body."""
+    file_path = os.path.join(generation_directory, export_path)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    variants = {file_path: body, f"{file_path}.gz": gzip.compress(body, 9, mtime=0)}
+    if brotli is not None:
+        variants[f"{file_path}.br"] = brotli.compress(body)
+    for variant_path, variant_body in variants.items():
+        temporary_file_path = f"{variant_path}.{os.getpid()}.tmp"
+        with open(temporary_file_path, "wb") as variant_file:
+            variant_file.write(variant_body)
+        os.replace(temporary_file_path, variant_path)
+
+
+def remove_export_file(generation_directory: str, export_path: str) -> bool:
+    """Removes a response and its compressed variants from an export generation.
+
+    :param generation_directory: The directory of the generation.
+
+    :param export_path: The path of the file, relative to the generation.
+
+    :returns: True if the response was exported before and has been removed."""
+    file_path = os.path.join(generation_directory, export_path)
+    was_exported = os.path.exists(file_path)
+    for variant_path in [file_path, f"{file_path}.gz", f"{file_path}.br"]:
+        if os.path.exists(variant_path):
+            os.remove(variant_path)
+    return was_exported
+
+
+def link_generation(previous_generation_directory: str, generation_directory: str):
+    """Creates a new generation as hard links to the files of the previous generation.
+
+    :param previous_generation_directory: The directory of the previous generation.
+
+    :param generation_directory: The directory of the new generation."""
+    for directory_path, _, file_names in os.walk(previous_generation_directory):
+        relative_directory_path = os.path.relpath(
+            directory_path, previous_generation_directory
+        )
+        os.makedirs(
+            os.path.join(generation_directory, relative_directory_path), exist_ok=True
+        )
+        for file_name in file_names:
+            os.link(
+                os.path.join(directory_path, file_name),
+                os.path.join(generation_directory, relative_directory_path, file_name),
+            )
+
+
+def export(
+    export_directory: str, full: bool = False, keep_generations: int = 2
+) -> typing.Dict[str, int]:
+    """Exports the API to static files.
+
+    :param export_directory: The directory to export to. The export is served from <export directory>/current.
+
+    :param full: Render every response again, even if the week has not changed.
+
+    :param keep_generations: How many generations to keep (the current one included). Readers
+    that are still reading from a previous generation can finish while it is kept.
+
+    :returns: Statistics about the export (the amount of changed weeks and written and removed files).
+    """
+    from create_server import app
+
+    import server
+
+    # Exporting should not count as API requests
+    server.STATISTICS_FILE_ENABLED = False
+    generations_directory = os.path.join(export_directory, "generations")
+    current_link_path = os.path.join(export_directory, "current")
+    os.makedirs(generations_directory, exist_ok=True)
+    previous_generation_directory = (
+        os.path.realpath(current_link_path)
+        if os.path.islink(current_link_path)
+        else None
+    )
+    previous_manifest = None
+    if previous_generation_directory is not None:
+        previous_manifest_path = os.path.join(
+            previous_generation_directory, MANIFEST_FILE_NAME
+        )
+        if os.path.exists(previous_manifest_path):
+            with open(previous_manifest_path, "rb") as previous_manifest_file:
+                previous_manifest = json_codec.loads(previous_manifest_file.read())
+    current_year = get_now().isocalendar()[0]
+    if (
+        previous_manifest is None
+        or previous_manifest["format_version"] != EXPORT_FORMAT_VERSION
+        or previous_manifest["current_year"] != current_year
+    ):
+        logger.info("Can't build on the previous export. Doing a full export...")
+        full = True
+    week_fingerprints = menu_caching.get_week_fingerprints()
+    previous_week_fingerprints = (
+        previous_manifest["weeks"] if not full else {}
+    )  # A full export treats every week as changed
+    changed_weeks = [
+        week
+        for week, fingerprint in week_fingerprints.items()
+        if previous_week_fingerprints.get(week) != fingerprint
+    ]
+    removed_weeks = [
+        week for week in previous_week_fingerprints if week not in week_fingerprints
+    ]
+    logger.info(
+        f"Exporting {len(changed_weeks)} changed weeks and removing {len(removed_weeks)} weeks..."
+    )
+    generation_directory = os.path.join(generations_directory, str(time.time_ns()))
+    if not full:
+        link_generation(previous_generation_directory, generation_directory)
+    os.makedirs(generation_directory, exist_ok=True)
+    statistics = {
+        "changed_weeks": len(changed_weeks),
+        "removed_weeks": len(removed_weeks),
+        "written_files": 0,
+        "removed_files": 0,
+    }
+    # Collect the URLs to render
+    urls_to_render = []
+    affected_years = set()
+    for week in changed_weeks + removed_weeks:
+        menu_id, year_number, week_number = week.split("/")
+        affected_years.add(int(year_number))
+        week_paths = get_week_paths(
+            menu_id, int(year_number), int(week_number), current_year
+        )
+        if week in removed_weeks:
+            for _, export_path in week_paths:
+                if remove_export_file(generation_directory, export_path):
+                    statistics["removed_files"] += 1
+        else:
+            urls_to_render.extend(week_paths)
+    for year_number in sorted(affected_years):
+        urls_to_render.append(
+            (
+                f"/api/available_menus?year={year_number}",
+                get_export_path("/api/available_menus", year_number),
+            )
+        )
+    if len(affected_years) > 0:
+        urls_to_render.append(
+            ("/api/available_menus", get_export_path("/api/available_menus"))
+        )
+    # The aliases for the current week depend on the date, so they are always rendered again
+    urls_to_render.append(("/api/", get_export_path("/api/")))
+    menu_ids = sorted({week.split("/")[0] for week in week_fingerprints})
+    for menu_id in menu_ids:
+        alias_urls = [
+            f"/api/{menu_id}/latest",
+            f"/api/{menu_id}/nearest",
+            f"/api/{menu_id}/now/today/",
+        ] + [f"/api/{menu_id}/now/{day_number}/" for day_number in DAY_NUMBERS]
+        urls_to_render.extend(
+            (alias_url, get_export_path(alias_url)) for alias_url in alias_urls
+        )
+    # Render
+    for url, export_path in urls_to_render:
+        body = render_response(app, url)
+        if body is not None:
+            write_export_file(generation_directory, export_path, body)
+            statistics["written_files"] += 1
+        elif remove_export_file(generation_directory, export_path):
+            statistics["removed_files"] += 1
+    with open(
+        os.path.join(generation_directory, MANIFEST_FILE_NAME), "wb"
+    ) as manifest_file:
+        manifest_file.write(
+            json_codec.dumps(
+                {
+                    "format_version": EXPORT_FORMAT_VERSION,
+                    "current_year": current_year,
+                    "generated_at": get_now().timestamp(),
+                    "weeks": week_fingerprints,
+                }
+            )
+        )
+    # Switch to the new generation
+    temporary_link_path = f"{current_link_path}.{os.getpid()}.tmp"
+    os.symlink(
+        os.path.relpath(generation_directory, export_directory), temporary_link_path
+    )
+    os.replace(temporary_link_path, current_link_path)
+    logger.info(f"Switched the export to generation {generation_directory}.")
+    # Remove old generations
+    generation_names = sorted(os.listdir(generations_directory), key=int)
+    for generation_name in generation_names[: -max(keep_generations, 1)]:
+        logger.debug(f"Removing old export generation {generation_name}...")
+        shutil.rmtree(os.path.join(generations_directory, generation_name))
+    logger.info(f"Export done: {statistics}.")
+    return statistics
+
+
+def get_export_settings() -> typing.Tuple[bool, str, int]:
+    """Reads the export settings from the [export] section of the configuration.
+
+    :returns: A tuple of whether exporting after downloads is enabled, the export directory
+    and how many generations to keep."""
+    config = ConfigParser()
+    config.read(CONFIG_FILEPATH)
+    export_enabled = config.getboolean("export", "enabled", fallback=False)
+    export_directory = config.get("export", "directory", fallback="") or os.path.join(
+        DATA_DIRECTORY, "export"
+    )
+    keep_generations = config.getint("export", "keep_generations", fallback=2)
+    return export_enabled, export_directory, keep_generations
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Exports the API as static files that can be served by a web server."
+    )
+    argument_parser.add_argument(
+        "--directory",
+        help="Directory to export to. Defaults to the directory in the [export] section of the configuration.",
+    )
+    argument_parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Render every response again, even for weeks that have not changed.",
+    )
+    arguments = argument_parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    _, export_directory, keep_generations = get_export_settings()
+    export(arguments.directory or export_directory, arguments.full, keep_generations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""field_projection.py
+Selects a subset of the fields of a JSON-like document, so that clients can request only the
+parts of a menu that they need (for example fields=days.*.dishes,title).
+
+Fields are paths of keys separated by dots. The wildcard "*" matches every key of an object (or
+every item of a list). The projected document is built from new containers that reference the
+selected values of the original document, so the original is never copied or modified.
+"""
+import typing
+
+WILDCARD = "*"
+MAX_FIELDS = 50  # The maximum amount of fields that can be requested at once
+SELECTED = True  # Marks a path whose whole value is selected in a field tree
+
+
+def parse_fields(fields: str) -> dict:
+    """Parses a comma-separated list of fields into a field tree, a nested dictionary where
+    every key is a key of the document and every leaf is SELECTED.
+
+    :param fields: The fields, for example "days.*.dishes,title".
+
+    :raises ValueError: If the fields are invalid."""
+    field_paths = [field.strip() for field in fields.split(",") if field.strip() != ""]
+    if len(field_paths) == 0:
+        raise ValueError("No fields were passed.")
+    if len(field_paths) > MAX_FIELDS:
+        raise ValueError(f"Too many fields (at most {MAX_FIELDS} are allowed).")
+    field_tree = {}
+    for field_path in field_paths:
+        keys = field_path.split(".")
+        if any(key == "" for key in keys):
+            raise ValueError(f"Invalid field {field_path}.")
+        field_tree = merge_field_trees(field_tree, build_field_tree(keys))
+    return field_tree
+
+
+def build_field_tree(keys: typing.List[str]) -> dict:
+    """Builds a field tree for a single field.
+
+    :param keys: The keys of the field path."""
+    field_tree = SELECTED
+    for key in reversed(keys):
+        field_tree = {key: field_tree}
+    return field_tree
+
+
+def merge_field_trees(
+    first_tree: typing.Union[dict, bool], second_tree: typing.Union[dict, bool, None]
+) -> typing.Union[dict, bool]:
+    """Merges two field trees, so that everything selected in either tree is selected.
+
+    :param first_tree: The first tree.
+
+    :param second_tree: The second tree (or None, which selects nothing)."""
+    if second_tree is None:
+        return first_tree
+    if first_tree is SELECTED or second_tree is SELECTED:
+        return SELECTED
+    merged_tree = dict(first_tree)
+    for key, subtree in second_tree.items():
+        merged_tree[key] = merge_field_trees(subtree, merged_tree.get(key))
+    return merged_tree
+
+
+def project(document: typing.Any, field_tree: typing.Union[dict, bool]) -> typing.Any:
+    """Projects a document using a field tree. Keys keep the order they have in the document,
+    and keys that are selected but don't exist in the document are left out.
+
+    :param document: The document (decoded JSON).
+
+    :param field_tree: The field tree (see parse_fields).
+
+    :returns: The projected document. If the document is neither an object nor a list (so
+    that nested fields can't be selected from it), None is returned."""
+    if field_tree is SELECTED:
+        return document
+    if isinstance(document, dict):
+        projected_document = {}
+        wildcard_tree = field_tree.get(WILDCARD)
+        for key, value in document.items():
+            key_tree = field_tree.get(key)
+            if wildcard_tree is not None:
+                key_tree = merge_field_trees(wildcard_tree, key_tree)
+            if key_tree is None:
+                continue
+            projected_value = project(value, key_tree)
+            if projected_value is not None or key_tree is SELECTED:
+                projected_document[key] = projected_value
+        return projected_document
+    if isinstance(document, list) and WILDCARD in field_tree:
+        return [project(item, field_tree[WILDCARD]) for item in document]
+    return None
@@ -0,0 +1,59 @@
+"""json_codec.py
+Encodes and decodes JSON for cache files and API responses. Uses orjson if it is installed
+(pip install orjson), which is several times faster than the json module in the standard library,
+and falls back to the standard library otherwise.
+
+Both backends produce the same compact output: no whitespace, keys in insertion order and
+non-ASCII characters written as UTF-8 instead of being escaped.
+"""
+import json, logging, typing
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def dumps(
+    data: typing.Any,
+    indent: bool = False,
+    default: typing.Optional[typing.Callable[[typing.Any], typing.Any]] = None,
+) -> bytes:
+    """Encodes data as JSON.
+
+    :param data: The data to encode.
+
+    :param indent: Whether to indent the output (two spaces) to make it easier to read.
+
+    :param default: A function that converts objects that can't be encoded into objects that can.
+
+    :returns: The JSON as UTF-8 encoded bytes."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                data, default=default, option=orjson.OPT_INDENT_2 if indent else 0
+            )
+        except orjson.JSONEncodeError:
+            # orjson is stricter than the standard library (for example about non-string keys
+            # and very large integers), so let the standard library have a go at it
+            logger.debug("orjson could not encode data. Using the json module...")
+    return json.dumps(
+        data,
+        default=default,
+        ensure_ascii=False,
+        indent=2 if indent else None,
+        separators=(",", ": ") if indent else (",", ":"),
+    ).encode("utf-8")
+
+
+def loads(data: typing.Union[bytes, str]) -> typing.Any:
+    """Decodes JSON.
+
+    :param data: The JSON to decode, as bytes (UTF-8) or a string."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,124 @@
+"""json_codec_benchmark.py
+Measures how fast menu payloads are encoded and decoded using the previous storage format
+(the json module with indent=True) compared to json_codec (orjson if it is installed), and how
+much smaller the compact storage format is.
+
+The payloads are the cached menus (data.json files) and the archived raw payloads from Eatery
+(see raw_payload_archive.py) in the data directory. If there are none, synthetic menus are used.
+
+Example usage:
+python json_codec_benchmark.py
+python json_codec_benchmark.py --repeat 20
+"""
+import argparse, json, logging, os, time, typing
+
+import json_codec, raw_payload_archive
+from shared_code import CACHED_MENUS_DIRECTORY
+
+logger = logging.getLogger(__name__)
+
+
+def read_payloads() -> typing.List[typing.Any]:
+    """Reads the cached menus and archived raw payloads in the data directory."""
+    payloads = []
+    if os.path.exists(CACHED_MENUS_DIRECTORY):
+        for menu_id in sorted(os.listdir(CACHED_MENUS_DIRECTORY)):
+            menu_path = os.path.join(CACHED_MENUS_DIRECTORY, menu_id)
+            if not os.path.isdir(menu_path):
+                continue
+            for cached_week in sorted(os.listdir(menu_path)):
+                menu_data_file_path = os.path.join(menu_path, cached_week, "data.json")
+                if os.path.isfile(menu_data_file_path):
+                    with open(menu_data_file_path, "rb") as menu_data_file:
+                        payloads.append(json.loads(menu_data_file.read()))
+    payload_hashes = {download["hash"] for download in raw_payload_archive.read_index()}
+    for payload_hash in sorted(payload_hashes):
+        payloads.append(raw_payload_archive.read_raw_payload(payload_hash))
+    return payloads
+
+
+def time_function(
+    function: typing.Callable[[typing.Any], typing.Any],
+    inputs: typing.List[typing.Any],
+    repeat: int,
+) -> float:
+    """Times a function over all inputs and returns the best time (in seconds) out of a number of rounds.
+
+    :param function: The function to time.
+
+    :param inputs: The inputs to call the function with.
+
+    :param repeat: The amount of rounds."""
+    best_time = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for function_input in inputs:
+            function(function_input)
+        elapsed = time.perf_counter() - start
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+    return best_time
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Benchmarks the JSON codec against the previous storage format on menu payloads."
+    )
+    argument_parser.add_argument(
+        "--repeat", type=int, default=5, help="Amount of rounds to time."
+    )
+    argument_parser.add_argument(
+        "--synthetic-weeks",
+        type=int,
+        default=500,
+        help="Amount of synthetic weeks to use if there are no payloads in the data directory.",
+    )
+    arguments = argument_parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    payloads = read_payloads()
+    if len(payloads) == 0:
+        from menu_model_benchmark import generate_encoded_menus
+
+        logger.info("No payloads in the data directory. Using synthetic menus...")
+        payloads = [
+            json.loads(encoded_menu)
+            for encoded_menu in generate_encoded_menus(arguments.synthetic_weeks, 2)
+        ]
+    logger.info(f"Benchmarking using {len(payloads)} payloads...")
+    previous_encoded = [
+        json.dumps(payload, indent=True).encode("utf-8") for payload in payloads
+    ]
+    codec_encoded = [json_codec.dumps(payload) for payload in payloads]
+    for payload, encoded_payload in zip(payloads, codec_encoded):
+        if json.loads(encoded_payload) != payload:
+            raise RuntimeError("json_codec did not encode a payload correctly.")
+    results = {
+        "encode": (
+            time_function(
+                lambda payload: json.dumps(payload, indent=True),
+                payloads,
+                arguments.repeat,
+            ),
+            time_function(json_codec.dumps, payloads, arguments.repeat),
+        ),
+        "decode": (
+            time_function(json.loads, previous_encoded, arguments.repeat),
+            time_function(json_codec.loads, codec_encoded, arguments.repeat),
+        ),
+    }
+    print(f"Payloads: {len(payloads)}, JSON backend: {json_codec.BACKEND}")
+    for operation, (previous_time, codec_time) in results.items():
+        print(
+            f"{operation}: json (indent=True) {previous_time / len(payloads) * 1e6:.1f} µs, "
+            f"json_codec {codec_time / len(payloads) * 1e6:.1f} µs per payload "
+            f"({previous_time / codec_time:.1f}x faster)"
+        )
+    previous_size = sum(len(encoded_payload) for encoded_payload in previous_encoded)
+    codec_size = sum(len(encoded_payload) for encoded_payload in codec_encoded)
+    print(
+        f"Size: {previous_size} bytes before, {codec_size} bytes compact ({(1 - codec_size / previous_size) * 100:.1f}% smaller)"
+    )
+
+
+if __name__ == "__main__":
+    main()
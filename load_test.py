@@ -0,0 +1,457 @@
+"""load_test.py
+A load tester for the API. Generates a synthetic cache of menus (a configurable amount of
+locations times a configurable amount of years), drives the server with a configurable
+concurrency and writes a latency report (p50/p95/p99 and throughput per endpoint).
+
+The server can either be driven in-process (using Flask's test client) or over HTTP, against
+a Gunicorn server started by this script or against any other running server.
+
+Example usage:
+python load_test.py --locations 20 --years 5 --requests 5000 --concurrency 8
+python load_test.py --gunicorn-workers 4 --requests 5000 --concurrency 32
+python load_test.py --locations 3 --years 2 --requests 500 --fail-on-errors (as run in CI)
+"""
+import argparse, datetime, json, logging, os, random, shutil, socket, subprocess, sys
+import tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+# Logging
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_MENU_SLUG = "kista-nod"  # Matches the default menu used by /api/
+ENDPOINT_WEIGHTS = {
+    "current_week": 4,
+    "specific_week": 3,
+    "specific_day": 3,
+    "available_menus": 1,
+    "index": 1,
+}  # How often each endpoint is requested relative to the others
+SYNTHETIC_DISHES = [
+    "Kycklinggryta serveras med ris",
+    "Fiskgratäng med sparris, vitvinssås & ris",
+    "Köttfärslimpa med champinjonsås & kokt potatis",
+    "Stekt panerad sejfilé serveras med skirat smör & klyftpotatis",
+    "Libanesisk mujadara – grön linsgryta med ris & rostad lök",
+    "Senapsgriljerad falukorv serveras med hemlagat potatismos",
+    "Ugnskokt torskrygg med gräddig pepparrotssås & hemlagat potatismos",
+    "Moussaka på aubergine, zucchini, potatis serveras med tomat- & ostsås",
+]
+SYNTHETIC_DAYS = [
+    ("Måndag", "monday"),
+    ("Tisdag", "tuesday"),
+    ("Onsdag", "wednesday"),
+    ("Torsdag", "thursday"),
+    ("Fredag", "friday"),
+]
+
+
+def generate_synthetic_menu(week_number: int, randomizer: random.Random) -> dict:
+    """Generates a menu in the same format as the one that MenuParser.parse returns.
+
+    :param week_number: The week number of the menu.
+
+    :param randomizer: The random number generator to pick dishes with."""
+    days = {}
+    for swedish_day_name, day_id in SYNTHETIC_DAYS:
+        days[day_id] = {
+            "day_name": {"swedish": swedish_day_name, "english": day_id.capitalize()},
+            "dishes": randomizer.sample(SYNTHETIC_DISHES, 4),
+            "special_features": {
+                "sweet_tuesday": day_id == "tuesday",
+                "fruity_wednesday": day_id == "wednesday",
+                "pancake_thursday": day_id == "thursday",
+                "burger_friday": day_id == "friday",
+            },
+        }
+    return {
+        "title": f"Lunch v {week_number}",
+        "week_number": week_number,
+        "url": "https://eatery.se/",
+        "days": days,
+        "footer": "L = Laktos\nG = Gluten",
+    }
+
+
+def generate_synthetic_cache(
+    locations: int, years: int, max_revisions: int, seed: int = 0
+) -> List[str]:
+    """Generates a synthetic cache in the cached menus directory. Each location gets one
+    menu per week for every year requested, and every menu gets a random amount of previous revisions.
+    Returns a list of the generated menu slugs.
+
+    :param locations: The amount of locations to generate.
+
+    :param years: The amount of years to generate (counting backwards from the current year).
+
+    :param max_revisions: The maximum amount of previous revisions for a generated menu.
+
+    :param seed: Seed for the random number generator."""
+    import menu_caching
+    from shared_code import get_now, write_json_to_file
+
+    randomizer = random.Random(seed)
+    current_year = get_now().year
+    menu_slugs = [DEFAULT_MENU_SLUG] + [
+        f"load-test-{location_number}" for location_number in range(1, locations)
+    ]
+    logger.info(
+        f"Generating synthetic cache with {len(menu_slugs)} locations and {years} years..."
+    )
+    for location_number, menu_slug in enumerate(menu_slugs):
+        for year in range(current_year - years + 1, current_year + 1):
+            for week_number in range(1, 53):
+                menu = generate_synthetic_menu(week_number, randomizer)
+                menu_data = {
+                    "menu": menu,
+                    "menu_id": 1000 + location_number,
+                    "last_retrieved_at": get_now().timestamp(),
+                }
+                revision_count = randomizer.randint(0, max_revisions)
+                if revision_count > 0:
+                    menu_data["previous_revisions"] = [
+                        {
+                            "revision_number": revision_number,
+                            "change_discovered_at": get_now().timestamp(),
+                            "previous_data": generate_synthetic_menu(
+                                week_number, randomizer
+                            ),
+                        }
+                        for revision_number in range(1, revision_count + 1)
+                    ]
+                cached_menu_directory = menu_caching.get_cached_menu_directory(
+                    menu_slug, week_number, year
+                )
+                os.makedirs(cached_menu_directory, exist_ok=True)
+                write_json_to_file(
+                    menu_data, os.path.join(cached_menu_directory, "data.json")
+                )
+    logger.info("Synthetic cache generated.")
+    return menu_slugs
+
+
+def generate_request_plan(
+    menu_slugs: List[str], years: int, request_count: int, seed: int = 0
+) -> List[Tuple[str, str]]:
+    """Generates a list of requests to send as (endpoint name, path) tuples.
+
+    :param menu_slugs: The menu slugs available in the synthetic cache.
+
+    :param years: The amount of years available in the synthetic cache.
+
+    :param request_count: The amount of requests to generate."""
+    from shared_code import get_now
+
+    randomizer = random.Random(seed)
+    current_year = get_now().year
+    endpoint_names = list(ENDPOINT_WEIGHTS.keys())
+    endpoint_weights = list(ENDPOINT_WEIGHTS.values())
+    request_plan = []
+    for endpoint_name in randomizer.choices(
+        endpoint_names, weights=endpoint_weights, k=request_count
+    ):
+        menu_slug = randomizer.choice(menu_slugs)
+        week_number = randomizer.randint(1, 52)
+        year = randomizer.randint(current_year - years + 1, current_year)
+        if endpoint_name == "current_week":
+            path = "/api/"
+        elif endpoint_name == "specific_week":
+            path = f"/api/{menu_slug}/{week_number}?year={year}"
+        elif endpoint_name == "specific_day":
+            path = f"/api/{menu_slug}/{week_number}/{randomizer.randint(1, 5)}/?year={year}"
+        elif endpoint_name == "available_menus":
+            path = f"/api/available_menus?year={year}"
+        else:
+            path = "/"
+        request_plan.append((endpoint_name, path))
+    return request_plan
+
+
+def start_gunicorn(workers: int, data_directory: str) -> Tuple[subprocess.Popen, str]:
+    """Starts a local Gunicorn server serving the synthetic cache and waits for it to accept connections.
+    Returns the process and the base URL of the server.
+
+    :param workers: The amount of Gunicorn workers to start.
+
+    :param data_directory: The data directory the server should use."""
+    # Grab a free port
+    with socket.socket() as free_port_socket:
+        free_port_socket.bind(("127.0.0.1", 0))
+        port = free_port_socket.getsockname()[1]
+    environment = dict(os.environ, EATERY_CACHER_DATA_DIRECTORY=data_directory)
+    logger.info(f"Starting Gunicorn with {workers} workers on port {port}...")
+    gunicorn_process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "create_server:app",
+            f"--bind=127.0.0.1:{port}",
+            f"--workers={workers}",
+        ],
+        cwd=SCRIPT_DIRECTORY,
+        env=environment,
+    )
+    # Wait for the server to start
+    for _ in range(300):
+        if gunicorn_process.poll() is not None:
+            raise RuntimeError("Gunicorn exited before it started accepting requests.")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                logger.info("Gunicorn is accepting connections.")
+                return gunicorn_process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    gunicorn_process.terminate()
+    raise RuntimeError("Timed out waiting for Gunicorn to start.")
+
+
+def run_requests(
+    request_plan: List[Tuple[str, str]], concurrency: int, target: Optional[str]
+) -> Tuple[Dict[str, List[float]], Dict[str, int], float]:
+    """Sends all requests in the request plan and measures their latencies.
+    Returns the latencies (in seconds) per endpoint, the error count per endpoint and
+    the total elapsed time.
+
+    :param request_plan: The requests to send, generated by generate_request_plan.
+
+    :param concurrency: The amount of requests to have in flight at once.
+
+    :param target: The base URL of the server to test, or None to test in-process."""
+    thread_data = threading.local()
+    if target is None:
+        from create_server import app as flask_app
+
+        def send_request(path):
+            if not hasattr(thread_data, "client"):
+                thread_data.client = flask_app.test_client()
+            response = thread_data.client.get(path)
+            response.get_data()  # Make sure that the full response has been generated
+            return response.status_code
+
+    else:
+        import requests
+
+        def send_request(path):
+            if not hasattr(thread_data, "session"):
+                thread_data.session = requests.Session()
+            return thread_data.session.get(target + path).status_code
+
+    latencies = {endpoint_name: [] for endpoint_name in ENDPOINT_WEIGHTS}
+    errors = {endpoint_name: 0 for endpoint_name in ENDPOINT_WEIGHTS}
+    results_lock = threading.Lock()
+
+    def timed_request(planned_request):
+        endpoint_name, path = planned_request
+        request_start = time.perf_counter()
+        try:
+            status_code = send_request(path)
+        except Exception as e:
+            logger.warning(f"Request to {path} failed: {e}")
+            status_code = None
+        request_time = time.perf_counter() - request_start
+        with results_lock:
+            latencies[endpoint_name].append(request_time)
+            if status_code != 200:
+                errors[endpoint_name] += 1
+
+    logger.info(
+        f"Sending {len(request_plan)} requests with a concurrency of {concurrency}..."
+    )
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in executor.map(timed_request, request_plan):
+            pass
+    elapsed = time.perf_counter() - start
+    logger.info(f"All requests sent in {round(elapsed, 2)} seconds.")
+    return latencies, errors, elapsed
+
+
+def percentile(sorted_values: List[float], percentage: float) -> float:
+    """Gets a percentile (using the nearest-rank method) from a sorted list.
+
+    :param sorted_values: The values to get the percentile from, sorted in ascending order.
+
+    :param percentage: The percentile to get, for example 95."""
+    if len(sorted_values) == 0:
+        return 0.0
+    rank = max(int(round(percentage / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def generate_report(
+    latencies: Dict[str, List[float]],
+    errors: Dict[str, int],
+    elapsed: float,
+    settings: dict,
+) -> dict:
+    """Generates a latency report from measured latencies.
+
+    :param latencies: The latencies (in seconds) per endpoint.
+
+    :param errors: The error count per endpoint.
+
+    :param elapsed: The total elapsed time in seconds.
+
+    :param settings: The settings used for the load test, included in the report."""
+    report = {
+        "generated_at": datetime.datetime.now().isoformat(),
+        "settings": settings,
+        "total_requests": sum(len(values) for values in latencies.values()),
+        "total_seconds": round(elapsed, 3),
+        "requests_per_second": round(
+            sum(len(values) for values in latencies.values()) / elapsed, 1
+        )
+        if elapsed > 0
+        else None,
+        "endpoints": {},
+    }
+    for endpoint_name, endpoint_latencies in latencies.items():
+        sorted_latencies = sorted(endpoint_latencies)
+        report["endpoints"][endpoint_name] = {
+            "requests": len(sorted_latencies),
+            "errors": errors[endpoint_name],
+            "mean_ms": round(sum(sorted_latencies) / len(sorted_latencies) * 1000, 3)
+            if len(sorted_latencies) > 0
+            else None,
+            "p50_ms": round(percentile(sorted_latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(sorted_latencies, 95) * 1000, 3),
+            "p99_ms": round(percentile(sorted_latencies, 99) * 1000, 3),
+            "max_ms": round(sorted_latencies[-1] * 1000, 3)
+            if len(sorted_latencies) > 0
+            else None,
+        }
+    return report
+
+
+def format_report(report: dict) -> str:
+    """Formats a report as a human-readable table.
+
+    :param report: The report generated by generate_report."""
+    lines = [
+        f"{report['total_requests']} requests in {report['total_seconds']} s ({report['requests_per_second']} requests/s)",
+        f"{'endpoint':<18}{'requests':>10}{'errors':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+    ]
+    for endpoint_name, endpoint_report in report["endpoints"].items():
+        lines.append(
+            f"{endpoint_name:<18}{endpoint_report['requests']:>10}{endpoint_report['errors']:>8}"
+            f"{str(endpoint_report['mean_ms']):>10}{endpoint_report['p50_ms']:>10}"
+            f"{endpoint_report['p95_ms']:>10}{endpoint_report['p99_ms']:>10}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Load tests the EateryCacher API against a synthetic cache."
+    )
+    argument_parser.add_argument(
+        "--locations", type=int, default=10, help="Amount of locations to generate."
+    )
+    argument_parser.add_argument(
+        "--years", type=int, default=3, help="Amount of years to generate."
+    )
+    argument_parser.add_argument(
+        "--max-revisions",
+        type=int,
+        default=2,
+        help="Maximum amount of previous revisions per generated menu.",
+    )
+    argument_parser.add_argument(
+        "--requests", type=int, default=2000, help="Amount of requests to send."
+    )
+    argument_parser.add_argument(
+        "--concurrency", type=int, default=8, help="Amount of concurrent requests."
+    )
+    argument_parser.add_argument(
+        "--data-directory",
+        help="Directory to generate the synthetic cache in. Defaults to a temporary directory that is removed afterwards.",
+    )
+    argument_parser.add_argument(
+        "--reuse-data",
+        action="store_true",
+        help="Reuse an already generated cache in --data-directory instead of generating a new one.",
+    )
+    target_arguments = argument_parser.add_mutually_exclusive_group()
+    target_arguments.add_argument(
+        "--gunicorn-workers",
+        type=int,
+        help="Start a local Gunicorn server with this amount of workers and test it over HTTP.",
+    )
+    target_arguments.add_argument(
+        "--target",
+        help="Base URL of an already running server to test over HTTP (it must serve --data-directory).",
+    )
+    argument_parser.add_argument(
+        "--report",
+        default="load_test_report.json",
+        help="File to write the JSON latency report to.",
+    )
+    argument_parser.add_argument(
+        "--fail-on-errors",
+        action="store_true",
+        help="Exit with status code 1 if any request failed (used in CI).",
+    )
+    arguments = argument_parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    # Point everything to the synthetic data directory. This must be done before the
+    # EateryCacher modules are imported, since they read the data directory on import.
+    remove_data_directory = arguments.data_directory is None
+    data_directory = arguments.data_directory or tempfile.mkdtemp(
+        prefix="eatery_load_test_"
+    )
+    data_directory = os.path.realpath(data_directory)
+    os.makedirs(data_directory, exist_ok=True)
+    os.environ["EATERY_CACHER_DATA_DIRECTORY"] = data_directory
+    sys.path.insert(0, SCRIPT_DIRECTORY)
+    gunicorn_process = None
+    try:
+        if arguments.reuse_data:
+            import menu_caching
+
+            menu_slugs = sorted(os.listdir(menu_caching.CACHED_MENUS_DIRECTORY))
+        else:
+            menu_slugs = generate_synthetic_cache(
+                arguments.locations, arguments.years, arguments.max_revisions
+            )
+        request_plan = generate_request_plan(
+            menu_slugs, arguments.years, arguments.requests
+        )
+        target = arguments.target.rstrip("/") if arguments.target else None
+        if arguments.gunicorn_workers is not None:
+            gunicorn_process, target = start_gunicorn(
+                arguments.gunicorn_workers, data_directory
+            )
+        latencies, errors, elapsed = run_requests(
+            request_plan, arguments.concurrency, target
+        )
+    finally:
+        if gunicorn_process is not None:
+            logger.info("Stopping Gunicorn...")
+            gunicorn_process.terminate()
+            gunicorn_process.wait()
+        if remove_data_directory:
+            shutil.rmtree(data_directory, ignore_errors=True)
+    settings = {
+        "locations": len(menu_slugs),
+        "years": arguments.years,
+        "max_revisions": arguments.max_revisions,
+        "concurrency": arguments.concurrency,
+        "mode": "in-process" if target is None else "http",
+        "target": target,
+        "gunicorn_workers": arguments.gunicorn_workers,
+    }
+    report = generate_report(latencies, errors, elapsed, settings)
+    write_report_to = os.path.abspath(arguments.report)
+    with open(write_report_to, "w") as report_file:
+        report_file.write(json.dumps(report, indent=True))
+    print(format_report(report))
+    logger.info(f"Report written to {write_report_to}.")
+    if arguments.fail_on_errors and sum(errors.values()) > 0:
+        logger.error(f"{sum(errors.values())} requests failed.")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
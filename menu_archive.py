@@ -0,0 +1,249 @@
+"""menu_archive.py
+Compacts the cached menus of a finished year into a single archive file per menu.
+
+Past years are never modified again, but every cached week costs a directory and a data file.
+Compacting a year packs all of its weeks for a menu into cached/<menu id>/<year>.archive and
+removes the week directories. Archived menus are still served by the server: every week is
+compressed separately and the archive starts with an offset table, so a single week can be
+read without decompressing the whole year.
+
+Archive file format:
+* The magic bytes b"EATERYA1"
+* The length of the index (unsigned, little-endian, 8 bytes)
+* The index: JSON mapping week numbers to [offset, length] of the compressed menu data
+* The menu data (the zlib-compressed contents of each data.json file, one after another)
+
+Example usage:
+python menu_archive.py 2023 (compacts 2023 for all menus)
+python menu_archive.py --all-finished --menu kista-nod (compacts all finished years for a menu)
+"""
+import os, logging, json, struct, zlib, shutil, threading, argparse, typing, re
+
+from shared_code import CACHED_MENUS_DIRECTORY, get_now
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_MAGIC = b"EATERYA1"
+ARCHIVE_HEADER = struct.Struct("<8sQ")  # Magic and index length
+CACHED_WEEK_DIRECTORY_REGEX = re.compile("^([0-9]{1,2})-([0-9]{4})$")
+
+# Caches archive indexes, mapping archive paths to (file identity, data offset, index)
+archive_indexes = {}
+archive_indexes_lock = threading.Lock()
+
+
+def get_archive_path(menu_id: str, year_number: int) -> str:
+    """Gets the path of the archive file for a menu and year.
+
+    :param menu_id: The (string) menu ID.
+
+    :param year_number: The year of the archive."""
+    return os.path.join(
+        CACHED_MENUS_DIRECTORY, menu_id.strip("/"), f"{year_number}.archive"
+    )
+
+
+def get_archive_index(
+    archive_path: str,
+) -> typing.Optional[typing.Tuple[int, typing.Dict[str, list]]]:
+    """Gets the index of an archive, reading it from the archive if it has not been read before
+    (or if the archive has changed since).
+
+    :param archive_path: The path of the archive.
+
+    :returns: A tuple of the data offset and the index, or None if the archive does not exist.
+    """
+    try:
+        file_status = os.stat(archive_path)
+    except FileNotFoundError:
+        return None
+    file_identity = (file_status.st_ino, file_status.st_mtime_ns)
+    cached_index = archive_indexes.get(archive_path)
+    if cached_index is not None and cached_index[0] == file_identity:
+        return cached_index[1], cached_index[2]
+    logger.debug(f"Reading index of archive {archive_path}...")
+    with open(archive_path, "rb") as archive_file:
+        magic, index_length = ARCHIVE_HEADER.unpack(
+            archive_file.read(ARCHIVE_HEADER.size)
+        )
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError(f"{archive_path} is not a menu archive.")
+        index = json.loads(archive_file.read(index_length))
+    data_offset = ARCHIVE_HEADER.size + index_length
+    with archive_indexes_lock:
+        archive_indexes[archive_path] = (file_identity, data_offset, index)
+    return data_offset, index
+
+
+def get_archived_weeks(menu_id: str, year_number: int) -> typing.List[int]:
+    """Gets the weeks that are available in the archive for a menu and year.
+
+    :param menu_id: The (string) menu ID.
+
+    :param year_number: The year to get the weeks for.
+
+    :returns: A sorted list of week numbers (empty if there is no archive)."""
+    archive_index = get_archive_index(get_archive_path(menu_id, year_number))
+    if archive_index is None:
+        return []
+    return sorted(int(week_number) for week_number in archive_index[1])
+
+
+def read_archived_menu(
+    menu_id: str, week_number: int, year_number: int
+) -> typing.Optional[bytes]:
+    """Reads the menu data for a week from an archive.
+
+    :param menu_id: The (string) menu ID.
+
+    :param week_number: The week number to read.
+
+    :param year_number: The year to read.
+
+    :returns: The menu data (the content of what was data.json) as bytes, or None if it is not archived.
+    """
+    archive_path = get_archive_path(menu_id, year_number)
+    archive_index = get_archive_index(archive_path)
+    if archive_index is None:
+        return None
+    data_offset, index = archive_index
+    if str(week_number) not in index:
+        return None
+    offset, length = index[str(week_number)]
+    with open(archive_path, "rb") as archive_file:
+        archive_file.seek(data_offset + offset)
+        return zlib.decompress(archive_file.read(length))
+
+
+def compact_year(menu_id: str, year_number: int) -> int:
+    """Compacts all cached weeks of a menu for a year into an archive. Weeks that are already
+    in an existing archive for the year are kept. The week directories are removed once the
+    archive has been written and verified.
+
+    :param menu_id: The (string) menu ID.
+
+    :param year_number: The year to compact. Must be a finished year.
+
+    :returns: The amount of weeks that were compacted."""
+    # Years are ISO week-years, which can end a few days into the next calendar year
+    if year_number >= get_now().isocalendar()[0]:
+        raise ValueError(f"{year_number} is not finished yet and can't be compacted.")
+    menu_path = os.path.join(CACHED_MENUS_DIRECTORY, menu_id.strip("/"))
+    archive_path = get_archive_path(menu_id, year_number)
+    week_directories = {}
+    for cached_week in os.listdir(menu_path):
+        cached_week_match = CACHED_WEEK_DIRECTORY_REGEX.fullmatch(cached_week)
+        if cached_week_match is None or int(cached_week_match.group(2)) != year_number:
+            continue
+        week_directory = os.path.join(menu_path, cached_week)
+        if os.path.isfile(os.path.join(week_directory, "data.json")):
+            week_directories[int(cached_week_match.group(1))] = week_directory
+    if len(week_directories) == 0:
+        logger.info(f"Nothing to compact for {menu_id}, {year_number}.")
+        return 0
+    logger.info(
+        f"Compacting {len(week_directories)} weeks of {menu_id}, {year_number}..."
+    )
+    # Collect menu data. Weeks in an existing archive are kept unless there is a newer data file for them.
+    compressed_menus = {}
+    for week_number in get_archived_weeks(menu_id, year_number):
+        compressed_menus[week_number] = zlib.compress(
+            read_archived_menu(menu_id, week_number, year_number), 9
+        )
+    uncompressed_menus = {}
+    for week_number, week_directory in week_directories.items():
+        with open(os.path.join(week_directory, "data.json"), "rb") as menu_data_file:
+            uncompressed_menus[week_number] = menu_data_file.read()
+        compressed_menus[week_number] = zlib.compress(
+            uncompressed_menus[week_number], 9
+        )
+    # Write the archive
+    index = {}
+    offset = 0
+    for week_number in sorted(compressed_menus):
+        index[str(week_number)] = [offset, len(compressed_menus[week_number])]
+        offset += len(compressed_menus[week_number])
+    encoded_index = json.dumps(index).encode("utf-8")
+    temporary_file_path = f"{archive_path}.{os.getpid()}.tmp"
+    with open(temporary_file_path, "wb") as archive_file:
+        archive_file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, len(encoded_index)))
+        archive_file.write(encoded_index)
+        for week_number in sorted(compressed_menus):
+            archive_file.write(compressed_menus[week_number])
+        archive_file.flush()
+        os.fsync(archive_file.fileno())
+    os.replace(temporary_file_path, archive_path)
+    # Verify the archive before removing anything
+    for week_number, menu_data in uncompressed_menus.items():
+        if read_archived_menu(menu_id, week_number, year_number) != menu_data:
+            raise RuntimeError(
+                f"Verification of {archive_path} failed for week {week_number}. Nothing was removed."
+            )
+    for week_directory in week_directories.values():
+        logger.debug(f"Removing {week_directory}...")
+        shutil.rmtree(week_directory)
+    logger.info(
+        f"Compacted {len(week_directories)} weeks of {menu_id}, {year_number} into {archive_path}."
+    )
+    return len(week_directories)
+
+
+def get_cached_years(menu_id: str) -> typing.List[int]:
+    """Gets the years that have cached week directories for a menu.
+
+    :param menu_id: The (string) menu ID."""
+    years = set()
+    for cached_week in os.listdir(os.path.join(CACHED_MENUS_DIRECTORY, menu_id)):
+        cached_week_match = CACHED_WEEK_DIRECTORY_REGEX.fullmatch(cached_week)
+        if cached_week_match is not None:
+            years.add(int(cached_week_match.group(2)))
+    return sorted(years)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Compacts the cached menus of finished years into archive files."
+    )
+    argument_parser.add_argument(
+        "year", type=int, nargs="?", help="The year to compact."
+    )
+    argument_parser.add_argument(
+        "--all-finished",
+        action="store_true",
+        help="Compact all finished years instead of a single year.",
+    )
+    argument_parser.add_argument(
+        "--menu",
+        action="append",
+        help="Menu ID to compact (can be passed multiple times). Defaults to all menus.",
+    )
+    arguments = argument_parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if arguments.year is None and not arguments.all_finished:
+        argument_parser.error("Pass a year or --all-finished.")
+    menu_ids = (
+        [menu_id.strip("/") for menu_id in arguments.menu]
+        if arguments.menu
+        else sorted(
+            menu_id
+            for menu_id in os.listdir(CACHED_MENUS_DIRECTORY)
+            if os.path.isdir(os.path.join(CACHED_MENUS_DIRECTORY, menu_id))
+        )
+    )
+    current_year = get_now().isocalendar()[0]
+    if arguments.year is not None and arguments.year >= current_year:
+        argument_parser.error(f"{arguments.year} is not finished yet.")
+    compacted_weeks = 0
+    for menu_id in menu_ids:
+        years = (
+            [year for year in get_cached_years(menu_id) if year < current_year]
+            if arguments.all_finished
+            else [arguments.year]
+        )
+        for year in years:
+            compacted_weeks += compact_year(menu_id, year)
+    logger.info(f"Done. Compacted {compacted_weeks} weeks in total.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 """menu_caching.py
 Contains helper functions related to caching menus."""
-import os, logging, typing, re, shutil
+import os, logging, typing, re, shutil, threading, datetime, copy, menu_snapshot
+import change_notifications, menu_events, menu_archive, json_codec
 
 from shared_code import (
     write_json_to_file,
@@ -11,6 +12,11 @@ from shared_code import (
 
 logger = logging.getLogger(__name__)
 
+# Start of the names of the response files stored next to data files, which are named
+# <prefix>.<fingerprint of the data file>.json. Changed whenever the default response changes.
+MENU_RESPONSE_FILE_PREFIX = "week_response"
+ARCHIVE_FILE_REGEX = re.compile("^([0-9]{4})\\.archive$")
+
 if not os.path.exists(CACHED_MENUS_DIRECTORY):
     logger.info("Creating directory for cached menus...")
     os.mkdir(CACHED_MENUS_DIRECTORY)
@@ -74,11 +80,59 @@ def get_cached_menu_directory(menu_id: str, week: int, year: int) -> str:
     return os.path.join(CACHED_MENUS_DIRECTORY, f"{menu_id}/{week}-{year}")
 
 
+def get_week_ordinal(year_number: int, week_number: int) -> int:
+    """Gets a number for an ISO week that counts weeks continuously across years, so that the
+    distance between two weeks is the difference between their ordinals.
+
+    :param year_number: The ISO week-year.
+
+    :param week_number: The ISO week number.
+
+    :raises ValueError: If the week does not exist in the year (for example week 53 of most years).
+    """
+    # Day 1 (a Monday) has ordinal 1, so all Mondays have an ordinal of 1 + a multiple of 7
+    return (
+        datetime.date.fromisocalendar(year_number, week_number, 1).toordinal() - 1
+    ) // 7
+
+
+def get_menu_year(week_number: int, retrieved_at: datetime.datetime) -> int:
+    """Gets the year that a menu is stored under, which is the ISO week-year of the menu's week.
+    Around New Year, a menu retrieved in late December might be for week 1 of the next year and
+    a menu retrieved in early January might be for week 52 or 53 of the previous year, so the
+    week-year closest to when the menu was retrieved is used.
+
+    :param week_number: The week number of the menu.
+
+    :param retrieved_at: When the menu was retrieved from Eatery."""
+    retrieved_at_year, retrieved_at_week = retrieved_at.isocalendar()[:2]
+    if week_number is None:  # The parser could not find the week number
+        return retrieved_at_year
+    retrieved_at_ordinal = get_week_ordinal(retrieved_at_year, retrieved_at_week)
+    closest_year = None
+    closest_distance = None
+    for year_number in (
+        retrieved_at_year - 1,
+        retrieved_at_year,
+        retrieved_at_year + 1,
+    ):
+        try:
+            distance = abs(
+                get_week_ordinal(year_number, week_number) - retrieved_at_ordinal
+            )
+        except ValueError:  # The year does not have that week
+            continue
+        if closest_distance is None or distance < closest_distance:
+            closest_year = year_number
+            closest_distance = distance
+    return closest_year if closest_year is not None else retrieved_at_year
+
+
 def save_cached_menu(menu_id: str, data: dict) -> None:
     """Saves cached menu data for a week."""
     logger.info(f"Saving menu for {menu_id}...")
     week_number = data["menu"]["week_number"]
-    year_number = get_now().year
+    year_number = get_menu_year(week_number, get_now())
     # Get path for menu
     cached_menu_directory = get_cached_menu_directory(menu_id, week_number, year_number)
     root_directory_id = os.path.dirname(cached_menu_directory)
@@ -91,6 +145,10 @@ def save_cached_menu(menu_id: str, data: dict) -> None:
         logger.info(f"Creating directory for menu {menu_id}, week {week_number}...")
         os.mkdir(cached_menu_directory)
     # Compare old menu data to save if Eatery saves their menu. It's cool to track changes!
+    changed_revision_number = (
+        None  # Set to the new revision number if the menu is new or has changed
+    )
+    event_type = None  # "new_week" or "revision" if the change should be logged
     if os.path.exists(menu_data_file_path):
         logger.info("Menu data already exists. Comparing for differences...")
         menu_data = read_json_from_file(menu_data_file_path)
@@ -105,10 +163,14 @@ def save_cached_menu(menu_id: str, data: dict) -> None:
                     "previous_data": menu_data["menu"],
                 }
             )
+            changed_revision_number = len(menu_data["previous_revisions"]) + 1
+            event_type = "revision"
             logger.info("Added information about differences.")
     else:
         logger.info("Menu data will be new.")
         menu_data = {}
+        changed_revision_number = 1
+        event_type = "new_week"
     # Update menu data
     menu_data["menu"] = data["menu"]
     menu_data["menu_id"] = data["menu_id"]
@@ -117,12 +179,178 @@ def save_cached_menu(menu_id: str, data: dict) -> None:
     logger.info(f"Writing menu data for week {week_number} to file...")
     write_json_to_file(menu_data, menu_data_file_path)
     logger.info(f"Menu data written to {menu_data_file_path}.")
+    # Log the change so that clients can be told about it
+    event_id = None
+    if event_type is not None:
+        event_id = menu_events.append_event(
+            {
+                "type": event_type,
+                "menu_id": menu_id.strip("/"),
+                "week_number": week_number,
+                "year_number": year_number,
+                "revision_number": changed_revision_number,
+                "changed_at": get_now().timestamp(),
+                "menu": data["menu"],
+            }
+        )
+    # Let server workers know that the menu has changed
+    change_notifications.publish_change(
+        menu_id, week_number, year_number, event_id=event_id
+    )
+
+
+def get_cached_menu_response_file(
+    menu_id: str,
+    week_number: int,
+    year_number: int,
+    render_response: typing.Callable[[dict], bytes],
+) -> typing.Optional[str]:
+    """Gets the path to a file containing the full API response for a cached menu, so that it
+    can be sent to clients without being loaded into Python. The response file lives next to the
+    menu's data file and is (re)generated from it using render_response whenever the data file changes.
+    The name of the response file holds a fingerprint of the data file it was generated from (its inode,
+    size and modification time), which is how stale response files are detected. Data files are always
+    replaced by a new file, so the inode changes even if two writes happen within the same timestamp tick.
+
+    :param menu_id: The menu ID to retrieve. Must be a string ID (numeric menu IDs are not supported).
+
+    :param week_number: The week number to retrieve.
+
+    :param year_number: The year number to retrieve data from.
+
+    :param render_response: A function that takes the menu data and returns the response as bytes.
+
+    :returns: The path to the response file if the menu was found, None if it can't be found.
+    """
+    cached_menu_directory = get_cached_menu_directory(menu_id, week_number, year_number)
+    menu_data_file_path = os.path.join(cached_menu_directory, "data.json")
+    try:
+        menu_data_file_status = os.stat(menu_data_file_path)
+    except FileNotFoundError:
+        return None
+    menu_data_file_modified_at = menu_data_file_status.st_mtime_ns
+    menu_response_file_name = f"{MENU_RESPONSE_FILE_PREFIX}.{menu_data_file_status.st_ino}-{menu_data_file_status.st_size}-{menu_data_file_modified_at}.json"
+    menu_response_file_path = os.path.join(
+        cached_menu_directory, menu_response_file_name
+    )
+    if os.path.exists(menu_response_file_path):
+        return menu_response_file_path
+    logger.info(f"Generating response file {menu_response_file_path}...")
+    menu_response = render_response(read_json_from_file(menu_data_file_path))
+    # Write to a temporary file and move it into place so that a half-written response is never sent
+    temporary_file_path = (
+        f"{menu_response_file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    with open(temporary_file_path, "wb") as menu_response_file:
+        menu_response_file.write(menu_response)
+    os.utime(
+        temporary_file_path, ns=(menu_data_file_modified_at, menu_data_file_modified_at)
+    )
+    os.replace(temporary_file_path, menu_response_file_path)
+    # Remove response files generated from previous versions of the data file
+    for file_name in os.listdir(cached_menu_directory):
+        if (
+            file_name.startswith(f"{MENU_RESPONSE_FILE_PREFIX}.")
+            and file_name.endswith(".json")
+            and file_name != menu_response_file_name
+        ):
+            try:
+                os.remove(os.path.join(cached_menu_directory, file_name))
+            except FileNotFoundError:  # Removed by another worker
+                pass
+    return menu_response_file_path
+
+
+class SingleFlight:
+    """Makes sure that only one thread at a time loads the value for a key. Threads that request
+    a key that is already being loaded wait for the loading thread and get its result (or a RuntimeError
+    caused by its exception) instead of loading the same value again."""
+
+    class Call:
+        """A load in progress."""
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.exception = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}  # Maps keys to the Call loading them
+
+    def do(
+        self, key: typing.Hashable, load: typing.Callable[[], typing.Any]
+    ) -> typing.Tuple[typing.Any, bool]:
+        """Loads the value for a key, or waits for another thread that is already loading it.
+
+        :param key: The key to load.
+
+        :param load: A function that loads the value.
+
+        :returns: A tuple of the value and whether it was loaded by another thread (and is therefore shared).
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            is_loader = call is None
+            if is_loader:
+                call = self.calls[key] = SingleFlight.Call()
+        if not is_loader:
+            logger.debug(f"Waiting for another thread to load {key}...")
+            call.done.wait()
+            if call.exception is not None:
+                # Raise a new exception in every waiting thread, so that the tracebacks of the threads
+                # are not all appended to the same exception object
+                raise RuntimeError(
+                    f"Loading {key} failed in another thread."
+                ) from call.exception
+            return call.result, True
+        try:
+            call.result = load()
+        except BaseException as e:
+            call.exception = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+
+cached_menu_loads = SingleFlight()
 
 
 def get_cached_menu(
+    menu_id: str, week_number: int, year_number: int, read_only: bool = False
+) -> typing.Optional[dict]:
+    """Gets the cached menu for a certain ID and week. Concurrent requests for the same
+    menu are coalesced, so that the menu is only loaded once.
+
+    :param menu_id: The menu ID to retrieve.
+
+    :param week_number: The week number to retrieve.
+
+    :param year_number: The year number to retrieve data from.
+
+    :param read_only: Pass True if the menu data will not be modified, so that data shared
+    with other threads doesn't have to be copied.
+
+    :returns: The menu data if the menu was found, None if it
+    can't be found."""
+    menu_data, is_shared = cached_menu_loads.do(
+        (menu_id.strip("/"), week_number, year_number),
+        lambda: load_cached_menu(menu_id, week_number, year_number),
+    )
+    # Callers are allowed to modify the menu data, so threads that got the data from
+    # another thread get their own copy
+    if is_shared and menu_data is not None and not read_only:
+        menu_data = copy.deepcopy(menu_data)
+    return menu_data
+
+
+def load_cached_menu(
     menu_id: str, week_number: int, year_number: int
 ) -> typing.Optional[dict]:
-    """Gets the cached menu for a certain ID and week.
+    """Loads the cached menu for a certain ID and week. Use get_cached_menu instead of calling this directly.
 
     :param menu_id: The menu ID to retrieve.
 
@@ -132,7 +360,6 @@ def get_cached_menu(
 
     :returns: The menu data if the menu was found, None if it
     can't be found."""
-    cached_menu_directory = get_cached_menu_directory(menu_id, week_number, year_number)
     # Check if menu ID is digit.
     # If the requested menu ID is a string, we can simply retrieve it right away.
     # If not, we have to try to find the menu string that belongs to the menu ID.
@@ -140,26 +367,291 @@ def get_cached_menu(
     logger.info(f"Getting menu for ID {menu_id}, week {week_number}")
     if not menu_id_is_digit:  # Is string - return menu right away
         logger.debug("Is not digit - returning right away if exists.")
-        # Validate that files exist and then save them
-        if os.path.exists(cached_menu_directory):
-            menu_data_file_path = os.path.join(cached_menu_directory, "data.json")
-            if os.path.exists(menu_data_file_path):
-                return read_json_from_file(menu_data_file_path)
+        return read_cached_menu(menu_id, week_number, year_number)
     else:  # Is digit - iterate over all menus until an appropriate one is found for the week
         logger.debug("Is digit - iterating over all menus...")
         for menu in os.listdir(CACHED_MENUS_DIRECTORY):
-            if str(week_number) in os.listdir(
-                os.path.join(CACHED_MENUS_DIRECTORY, menu)
+            if menu.isdigit() and menu != menu_id:
+                continue
+            if not os.path.isdir(os.path.join(CACHED_MENUS_DIRECTORY, menu)):
+                continue
+            menu_content = read_cached_menu(menu, week_number, year_number)
+            if menu_content is None:
+                continue
+            if menu.isdigit():
+                return menu_content
+            elif "menu_id" in menu_content and menu_content["menu_id"] == int(menu_id):
+                return menu_content
+    return None
+
+
+def read_cached_menu(
+    menu_directory_name: str, week_number: int, year_number: int
+) -> typing.Optional[dict]:
+    """Reads the cached menu stored in a certain menu directory for a week, from the shared snapshot,
+    the data file or an archive.
+
+    :param menu_directory_name: The name of the menu directory (the string menu ID).
+
+    :param week_number: The week number to read.
+
+    :param year_number: The year number to read data from.
+
+    :returns: The menu data if the menu was found, None if it
+    can't be found."""
+    cached_menu_directory = get_cached_menu_directory(
+        menu_directory_name, week_number, year_number
+    )
+    # Validate that files exist and then save them
+    menu_data_file_path = os.path.join(cached_menu_directory, "data.json")
+    try:
+        menu_data_file_status = os.stat(menu_data_file_path)
+    except FileNotFoundError:
+        # The week might have been compacted into an archive
+        archived_menu_data = menu_archive.read_archived_menu(
+            menu_directory_name, week_number, year_number
+        )
+        if archived_menu_data is not None:
+            logger.debug("Returning menu from archive.")
+            return json_codec.loads(archived_menu_data)
+        return None
+    # Use the shared snapshot if it is up to date with the data file
+    snapshot_menu_data = menu_snapshot.get_menu_data(
+        menu_directory_name, week_number, year_number, menu_data_file_status
+    )
+    if snapshot_menu_data is not None:
+        logger.debug("Returning menu from snapshot.")
+        return snapshot_menu_data
+    return read_json_from_file(menu_data_file_path)
+
+
+class WeekIndex:
+    """An in-memory index of the weeks that are cached for a menu (including archived weeks),
+    keyed on the ISO (year, week) pair. Resolves the latest week and the week nearest to any
+    other week in constant time.
+
+    The index is valid as long as the menu directory is unchanged: adding or removing a week
+    directory or an archive changes the modification time of the directory."""
+
+    __slots__ = (
+        "weeks",
+        "weeks_by_year",
+        "first_week_ordinal",
+        "nearest_weeks",
+        "menu_directory_modified_at",
+    )
+
+    def __init__(
+        self,
+        weeks: typing.Iterable[typing.Tuple[int, int]],
+        menu_directory_modified_at: int,
+    ):
+        """Creates the index.
+
+        :param weeks: The cached weeks as (year, week) pairs.
+
+        :param menu_directory_modified_at: The modification time of the menu directory, in nanoseconds.
+        """
+        self.weeks = sorted(set(weeks))
+        self.weeks_by_year = {}
+        for year_number, week_number in self.weeks:
+            self.weeks_by_year.setdefault(year_number, []).append(week_number)
+        self.menu_directory_modified_at = menu_directory_modified_at
+        # Weeks that don't exist in the ISO calendar (only possible in old caches) can't be "near" anything
+        week_ordinals = []
+        for year_number, week_number in self.weeks:
+            try:
+                week_ordinals.append(
+                    (
+                        get_week_ordinal(year_number, week_number),
+                        (year_number, week_number),
+                    )
+                )
+            except ValueError:
+                pass
+        # Precompute the nearest cached week for every week between the first and the last cached week
+        self.first_week_ordinal = week_ordinals[0][0] if len(week_ordinals) > 0 else 0
+        self.nearest_weeks = []
+        position = 0
+        for week_ordinal in range(
+            self.first_week_ordinal,
+            week_ordinals[-1][0] + 1 if len(week_ordinals) > 0 else 0,
+        ):
+            # Move on to the next cached week once it is at least as near (so ties go to the later week)
+            while (
+                position + 1 < len(week_ordinals)
+                and week_ordinals[position + 1][0] - week_ordinal
+                <= week_ordinal - week_ordinals[position][0]
             ):
-                menu_data_file_path = os.path.join(
-                    f"{CACHED_MENUS_DIRECTORY}/{menu}/{week_number}", "data.json"
+                position += 1
+            self.nearest_weeks.append(week_ordinals[position][1])
+
+    def get_latest_week(self) -> typing.Optional[typing.Tuple[int, int]]:
+        """Gets the latest cached week as a (year, week) pair, or None if no weeks are cached."""
+        return self.weeks[-1] if len(self.weeks) > 0 else None
+
+    def get_nearest_week(
+        self, year_number: int, week_number: int
+    ) -> typing.Optional[typing.Tuple[int, int]]:
+        """Gets the cached week nearest to a week as a (year, week) pair. If two weeks are
+        equally near, the later one is returned.
+
+        :param year_number: The ISO week-year.
+
+        :param week_number: The ISO week number.
+
+        :returns: The nearest week, or None if no weeks are cached."""
+        if len(self.nearest_weeks) == 0:
+            return self.get_latest_week()
+        offset = get_week_ordinal(year_number, week_number) - self.first_week_ordinal
+        return self.nearest_weeks[max(0, min(offset, len(self.nearest_weeks) - 1))]
+
+
+week_indexes = {}  # Maps menu directory names to their WeekIndex
+week_index_builds = SingleFlight()
+
+
+def build_week_index(menu_directory_name: str) -> typing.Optional[WeekIndex]:
+    """Builds the week index for a menu by listing its directory. Use get_week_index instead of calling this directly.
+
+    :param menu_directory_name: The name of the menu directory (the string menu ID)."""
+    menu_path = os.path.join(CACHED_MENUS_DIRECTORY, menu_directory_name)
+    try:
+        menu_directory_modified_at = os.stat(menu_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    logger.debug(f"Building week index for {menu_directory_name}...")
+    weeks = []
+    is_complete = True
+    for content in os.listdir(menu_path):
+        archive_match = ARCHIVE_FILE_REGEX.fullmatch(content)
+        if archive_match is not None:
+            year_number = int(archive_match.group(1))
+            weeks.extend(
+                (year_number, week_number)
+                for week_number in menu_archive.get_archived_weeks(
+                    menu_directory_name, year_number
                 )
-                if os.path.exists(menu_data_file_path):
-                    menu_content = read_json_from_file(menu_data_file_path)
-                    if menu.isdigit() and menu == menu_id:
-                        return menu_content
-                    elif "menu_id" in menu_content and menu_content["menu_id"] == int(
-                        menu_id
-                    ):
-                        return menu_content
-    return None
+            )
+            continue
+        cached_week_match = menu_archive.CACHED_WEEK_DIRECTORY_REGEX.fullmatch(content)
+        if cached_week_match is None:
+            continue
+        # Validate that menu data file exists
+        if os.path.exists(os.path.join(menu_path, content, "data.json")):
+            weeks.append(
+                (int(cached_week_match.group(2)), int(cached_week_match.group(1)))
+            )
+        else:
+            logger.warning(
+                f"Directory but no data file available for menu {menu_directory_name}, week {content}."
+            )
+            # The data file might be about to be written. Writing it does not change the
+            # menu directory, so the index has to be built again next time.
+            is_complete = False
+    week_index = WeekIndex(weeks, menu_directory_modified_at)
+    if is_complete:
+        week_indexes[menu_directory_name] = week_index
+    return week_index
+
+
+def get_week_index(menu_id: str) -> typing.Optional[WeekIndex]:
+    """Gets the week index for a menu, building it if it has not been built or if the menu has changed since.
+
+    :param menu_id: The (string) menu ID.
+
+    :returns: The week index, or None if the menu does not exist."""
+    menu_directory_name = menu_id.strip("/")
+    week_index = week_indexes.get(menu_directory_name)
+    if week_index is not None:
+        try:
+            menu_directory_modified_at = os.stat(
+                os.path.join(CACHED_MENUS_DIRECTORY, menu_directory_name)
+            ).st_mtime_ns
+        except FileNotFoundError:
+            menu_directory_modified_at = None
+        if menu_directory_modified_at == week_index.menu_directory_modified_at:
+            return week_index
+    return week_index_builds.do(
+        menu_directory_name, lambda: build_week_index(menu_directory_name)
+    )[0]
+
+
+def get_latest_week(menu_id: str) -> typing.Optional[typing.Tuple[int, int]]:
+    """Gets the latest cached week for a menu.
+
+    :param menu_id: The (string) menu ID.
+
+    :returns: The latest week as a (year, week) pair, or None if the menu has no cached weeks.
+    """
+    week_index = get_week_index(menu_id)
+    return week_index.get_latest_week() if week_index is not None else None
+
+
+def get_nearest_week(
+    menu_id: str, year_number: int, week_number: int
+) -> typing.Optional[typing.Tuple[int, int]]:
+    """Gets the cached week for a menu that is nearest to a week (the later one if two are equally near).
+
+    :param menu_id: The (string) menu ID.
+
+    :param year_number: The ISO week-year.
+
+    :param week_number: The ISO week number.
+
+    :returns: The nearest week as a (year, week) pair, or None if the menu has no cached weeks.
+    """
+    week_index = get_week_index(menu_id)
+    return (
+        week_index.get_nearest_week(year_number, week_number)
+        if week_index is not None
+        else None
+    )
+
+
+def get_available_weeks(menu_id: str, year_number: int) -> typing.List[int]:
+    """Gets the weeks that are cached for a menu in a certain year, including
+    weeks that have been compacted into an archive.
+
+    :param menu_id: The (string) menu ID.
+
+    :param year_number: The year to get the weeks for.
+
+    :returns: A sorted list of week numbers."""
+    week_index = get_week_index(menu_id)
+    if week_index is None:
+        return []
+    return list(week_index.weeks_by_year.get(year_number, []))
+
+
+def get_week_fingerprints() -> typing.Dict[str, str]:
+    """Gets a fingerprint for every cached week, which changes whenever the menu data of the week changes.
+
+    :returns: A dictionary mapping "<menu id>/<year>/<week>" to the fingerprint of the week.
+    """
+    week_fingerprints = {}
+    for menu_id in sorted(os.listdir(CACHED_MENUS_DIRECTORY)):
+        # Numeric menu directories are from old caches and are left out
+        if menu_id.isdigit() or not os.path.isdir(
+            os.path.join(CACHED_MENUS_DIRECTORY, menu_id)
+        ):
+            continue
+        week_index = get_week_index(menu_id)
+        if week_index is None:
+            continue
+        for year_number, week_number in week_index.weeks:
+            try:
+                file_status = os.stat(
+                    os.path.join(
+                        get_cached_menu_directory(menu_id, week_number, year_number),
+                        "data.json",
+                    )
+                )
+                fingerprint = f"{file_status.st_mtime_ns}-{file_status.st_size}"
+            except FileNotFoundError:  # The week is archived
+                file_status = os.stat(
+                    menu_archive.get_archive_path(menu_id, year_number)
+                )
+                fingerprint = f"archive-{file_status.st_mtime_ns}-{file_status.st_size}"
+            week_fingerprints[f"{menu_id}/{year_number}/{week_number}"] = fingerprint
+    return week_fingerprints
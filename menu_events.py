@@ -0,0 +1,80 @@
+"""menu_events.py
+An append-only log of menu changes. Every event gets an ID that is one higher than the
+previous event's, which clients can use to resume from where they left off.
+
+Events are stored as JSON lines in the events file. Next to it, an index file stores the
+position of every event in the events file (8 bytes per event), so that reading the events
+after a certain ID does not require reading the events before it.
+"""
+import os, logging, struct, fcntl, typing, json_codec
+
+from shared_code import EVENTS_FILEPATH, EVENTS_INDEX_FILEPATH
+
+logger = logging.getLogger(__name__)
+
+EVENT_POSITION = struct.Struct("<Q")
+
+
+def append_event(event: dict) -> int:
+    """Appends an event to the log.
+
+    :param event: The event to append (must be JSON-serializable). Its ID is added to it.
+
+    :returns: The ID of the appended event."""
+    with open(EVENTS_INDEX_FILEPATH, "ab") as events_index_file:
+        # Lock the index so that events appended by different processes get different IDs
+        fcntl.flock(events_index_file.fileno(), fcntl.LOCK_EX)
+        try:
+            event_id = (
+                os.fstat(events_index_file.fileno()).st_size // EVENT_POSITION.size + 1
+            )
+            event["id"] = event_id
+            with open(EVENTS_FILEPATH, "ab") as events_file:
+                event_position = events_file.tell()
+                events_file.write(json_codec.dumps(event) + b"\n")
+            # The index is written after the event, so that readers only see complete events
+            events_index_file.write(EVENT_POSITION.pack(event_position))
+            events_index_file.flush()
+        finally:
+            fcntl.flock(events_index_file.fileno(), fcntl.LOCK_UN)
+    logger.info(f"Appended event {event_id} to the event log.")
+    return event_id
+
+
+def get_last_event_id() -> int:
+    """Gets the ID of the latest event, or 0 if there are no events."""
+    try:
+        return os.stat(EVENTS_INDEX_FILEPATH).st_size // EVENT_POSITION.size
+    except FileNotFoundError:
+        return 0
+
+
+def read_events(
+    after_event_id: int, limit: typing.Optional[int] = None
+) -> typing.List[dict]:
+    """Reads the events after a certain event ID.
+
+    :param after_event_id: The ID of the last event that should not be returned (0 to read from the beginning).
+
+    :param limit: The maximum amount of events to return. None returns all events.
+
+    :returns: A list of events, oldest first."""
+    try:
+        with open(EVENTS_INDEX_FILEPATH, "rb") as events_index_file:
+            events_index_file.seek(max(after_event_id, 0) * EVENT_POSITION.size)
+            encoded_positions = events_index_file.read(
+                -1 if limit is None else limit * EVENT_POSITION.size
+            )
+    except FileNotFoundError:
+        return []
+    event_count = len(encoded_positions) // EVENT_POSITION.size
+    if event_count == 0:
+        return []
+    (first_event_position,) = EVENT_POSITION.unpack_from(encoded_positions)
+    events = []
+    with open(EVENTS_FILEPATH, "rb") as events_file:
+        # Events are stored one after another, so only a single seek is needed
+        events_file.seek(first_event_position)
+        for _ in range(event_count):
+            events.append(json_codec.loads(events_file.readline()))
+    return events
@@ -0,0 +1,225 @@
+"""menu_model.py
+A compact in-memory representation of parsed menus, for when many weeks of menus are held in memory
+(for example when parsing the full history again, see reparse_menus.py).
+
+The dictionaries returned by MenuParser.parse repeat the same keys and values in every day of every
+week. The compact model instead uses slotted classes, stores days as an index into the list of
+week days, packs the special features of a day into a bitmask and deduplicates dish strings (and
+other strings that recur week after week, like footers) through an intern table.
+
+Every model serializes back to exactly the same dictionaries (same keys, values and key order) as
+the ones it was created from, so they can be written to JSON files and returned by the API as before.
+"""
+import typing
+
+from menuparser import day_names_to_json_keys, special_features, week_days_id_list
+
+# Day IDs ("monday") and Swedish day names ("Måndag"), indexed by the day index used by the model
+DAY_IDS = tuple(week_days_id_list)
+SWEDISH_DAY_NAMES = tuple(day_names_to_json_keys.keys())
+# Special feature keys ("sweet_tuesday"). Bit n of a special features bitmask is SPECIAL_FEATURE_KEYS[n].
+SPECIAL_FEATURE_KEYS = tuple(special_features.values())
+
+# Intern table for strings that recur across menus. Maps every string to its single shared instance.
+interned_strings = {}
+
+
+def intern_string(value: typing.Any) -> typing.Any:
+    """Gets the shared instance of a string from the intern table, adding it if it is new.
+
+    :param value: The string to intern. Other values (like None) are returned as they are.
+    """
+    if not isinstance(value, str):
+        return value
+    return interned_strings.setdefault(value, value)
+
+
+class Day:
+    """The menu for a single day."""
+
+    __slots__ = ("day_index", "dishes", "special_features")
+
+    def __init__(self, day_index: int, dishes: typing.Tuple[str, ...], features: int):
+        """Creates a day.
+
+        :param day_index: The index of the day in DAY_IDS.
+
+        :param dishes: The dishes for the day (interned strings).
+
+        :param features: The special features of the day as a bitmask (see SPECIAL_FEATURE_KEYS).
+        """
+        self.day_index = day_index
+        self.dishes = dishes
+        self.special_features = features
+
+    @classmethod
+    def from_dict(cls, day_id: str, day: dict) -> "Day":
+        """Creates a day from the format returned by MenuParser.parse.
+
+        :param day_id: The day ID, for example "monday".
+
+        :param day: The day data."""
+        day_index = DAY_IDS.index(day_id)
+        if tuple(day) != ("day_name", "dishes", "special_features"):
+            raise ValueError(f"Unexpected day keys for {day_id}: {list(day)}.")
+        if day["day_name"] != {
+            "swedish": SWEDISH_DAY_NAMES[day_index],
+            "english": day_id.capitalize(),
+        }:
+            raise ValueError(f"Unexpected day name for {day_id}: {day['day_name']}.")
+        if tuple(day["special_features"]) != SPECIAL_FEATURE_KEYS:
+            raise ValueError(
+                f"Unexpected special features for {day_id}: {day['special_features']}."
+            )
+        features = 0
+        for feature_number, feature_key in enumerate(SPECIAL_FEATURE_KEYS):
+            if day["special_features"][feature_key]:
+                features |= 1 << feature_number
+        return cls(
+            day_index, tuple(intern_string(dish) for dish in day["dishes"]), features
+        )
+
+    def to_dict(self) -> dict:
+        """Converts the day back to the format returned by MenuParser.parse."""
+        return {
+            "day_name": {
+                "swedish": SWEDISH_DAY_NAMES[self.day_index],
+                "english": DAY_IDS[self.day_index].capitalize(),
+            },
+            "dishes": list(self.dishes),
+            "special_features": {
+                feature_key: bool(self.special_features & (1 << feature_number))
+                for feature_number, feature_key in enumerate(SPECIAL_FEATURE_KEYS)
+            },
+        }
+
+
+class Menu:
+    """A parsed menu for a week."""
+
+    __slots__ = ("title", "week_number", "url", "days", "footer")
+
+    def __init__(
+        self,
+        title: typing.Optional[str],
+        week_number: typing.Optional[int],
+        url: typing.Optional[str],
+        days: typing.Tuple[Day, ...],
+        footer: typing.Optional[str],
+    ):
+        self.title = title
+        self.week_number = week_number
+        self.url = url
+        self.days = days
+        self.footer = footer
+
+    @classmethod
+    def from_dict(cls, menu: dict) -> "Menu":
+        """Creates a menu from the format returned by MenuParser.parse.
+
+        :param menu: The menu data."""
+        if tuple(menu) != cls.__slots__:
+            raise ValueError(f"Unexpected menu keys: {list(menu)}.")
+        return cls(
+            intern_string(menu["title"]),
+            menu["week_number"],
+            intern_string(menu["url"]),
+            tuple(Day.from_dict(day_id, day) for day_id, day in menu["days"].items()),
+            intern_string(menu["footer"]),
+        )
+
+    def to_dict(self) -> dict:
+        """Converts the menu back to the format returned by MenuParser.parse."""
+        return {
+            "title": self.title,
+            "week_number": self.week_number,
+            "url": self.url,
+            "days": {DAY_IDS[day.day_index]: day.to_dict() for day in self.days},
+            "footer": self.footer,
+        }
+
+
+class Revision:
+    """A previous revision of a cached menu."""
+
+    __slots__ = ("revision_number", "change_discovered_at", "previous_data")
+
+    def __init__(
+        self, revision_number: int, change_discovered_at: float, previous_data: Menu
+    ):
+        self.revision_number = revision_number
+        self.change_discovered_at = change_discovered_at
+        self.previous_data = previous_data
+
+    @classmethod
+    def from_dict(cls, revision: dict) -> "Revision":
+        """Creates a revision from the format saved in data.json.
+
+        :param revision: The revision data."""
+        if tuple(revision) != cls.__slots__:
+            raise ValueError(f"Unexpected revision keys: {list(revision)}.")
+        return cls(
+            revision["revision_number"],
+            revision["change_discovered_at"],
+            Menu.from_dict(revision["previous_data"]),
+        )
+
+    def to_dict(self) -> dict:
+        """Converts the revision back to the format saved in data.json."""
+        return {
+            "revision_number": self.revision_number,
+            "change_discovered_at": self.change_discovered_at,
+            "previous_data": self.previous_data.to_dict(),
+        }
+
+
+class CachedMenu:
+    """A cached menu for a week, as saved in data.json (see menu_caching.save_cached_menu)."""
+
+    __slots__ = ("menu", "menu_id", "last_retrieved_at", "previous_revisions")
+
+    def __init__(
+        self,
+        menu: Menu,
+        menu_id: int,
+        last_retrieved_at: float,
+        previous_revisions: typing.Optional[typing.Tuple[Revision, ...]] = None,
+    ):
+        """Creates a cached menu.
+
+        :param previous_revisions: Previous revisions of the menu, or None if the menu
+        has never changed (data.json then has no previous_revisions key)."""
+        self.menu = menu
+        self.menu_id = menu_id
+        self.last_retrieved_at = last_retrieved_at
+        self.previous_revisions = previous_revisions
+
+    @classmethod
+    def from_dict(cls, menu_data: dict) -> "CachedMenu":
+        """Creates a cached menu from the format saved in data.json.
+
+        :param menu_data: The menu data."""
+        if tuple(menu_data) not in (cls.__slots__, cls.__slots__[:3]):
+            raise ValueError(f"Unexpected cached menu keys: {list(menu_data)}.")
+        previous_revisions = menu_data.get("previous_revisions")
+        return cls(
+            Menu.from_dict(menu_data["menu"]),
+            menu_data["menu_id"],
+            menu_data["last_retrieved_at"],
+            tuple(Revision.from_dict(revision) for revision in previous_revisions)
+            if previous_revisions is not None
+            else None,
+        )
+
+    def to_dict(self) -> dict:
+        """Converts the cached menu back to the format saved in data.json."""
+        menu_data = {
+            "menu": self.menu.to_dict(),
+            "menu_id": self.menu_id,
+            "last_retrieved_at": self.last_retrieved_at,
+        }
+        if self.previous_revisions is not None:
+            menu_data["previous_revisions"] = [
+                revision.to_dict() for revision in self.previous_revisions
+            ]
+        return menu_data
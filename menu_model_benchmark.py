@@ -0,0 +1,148 @@
+"""menu_model_benchmark.py
+Measures how much memory cached menus take when held in memory as the dictionaries loaded from
+data.json compared to the compact model in menu_model.py, and verifies that every compact menu
+serializes back to exactly the same JSON.
+
+Memory is measured using tracemalloc. The menus are either synthetic (generated like in load_test.py)
+or the cached menus in the data directory.
+
+Example usage:
+python menu_model_benchmark.py --weeks 2000
+python menu_model_benchmark.py --source cached
+"""
+import argparse, json, logging, os, random, tracemalloc, typing
+
+import menu_model
+from shared_code import CACHED_MENUS_DIRECTORY
+
+logger = logging.getLogger(__name__)
+
+
+def generate_encoded_menus(
+    week_count: int, max_revisions: int, seed: int = 0
+) -> typing.List[bytes]:
+    """Generates synthetic cached menus, encoded like data.json files.
+
+    :param week_count: The amount of weeks to generate.
+
+    :param max_revisions: The maximum amount of previous revisions for a generated menu.
+
+    :param seed: Seed for the random number generator."""
+    from load_test import generate_synthetic_menu
+
+    randomizer = random.Random(seed)
+    encoded_menus = []
+    for week_index in range(week_count):
+        week_number = week_index % 52 + 1
+        menu_data = {
+            "menu": generate_synthetic_menu(week_number, randomizer),
+            "menu_id": 1000 + week_index // 52,
+            "last_retrieved_at": 1672531200.0 + week_index * 604800,
+        }
+        revision_count = randomizer.randint(0, max_revisions)
+        if revision_count > 0:
+            menu_data["previous_revisions"] = [
+                {
+                    "revision_number": revision_number,
+                    "change_discovered_at": 1672531200.0 + week_index * 604800,
+                    "previous_data": generate_synthetic_menu(week_number, randomizer),
+                }
+                for revision_number in range(1, revision_count + 1)
+            ]
+        encoded_menus.append(json.dumps(menu_data, indent=True).encode("utf-8"))
+    return encoded_menus
+
+
+def read_encoded_menus() -> typing.List[bytes]:
+    """Reads all cached menus (the data.json files) in the data directory."""
+    encoded_menus = []
+    for menu_id in sorted(os.listdir(CACHED_MENUS_DIRECTORY)):
+        menu_path = os.path.join(CACHED_MENUS_DIRECTORY, menu_id)
+        if not os.path.isdir(menu_path):
+            continue
+        for cached_week in sorted(os.listdir(menu_path)):
+            menu_data_file_path = os.path.join(menu_path, cached_week, "data.json")
+            if os.path.isfile(menu_data_file_path):
+                with open(menu_data_file_path, "rb") as menu_data_file:
+                    encoded_menus.append(menu_data_file.read())
+    return encoded_menus
+
+
+def measure(load: typing.Callable[[], list]) -> typing.Tuple[list, int]:
+    """Measures how much memory the result of a function takes.
+
+    :param load: The function that loads the menus.
+
+    :returns: A tuple of the loaded menus and the amount of bytes they take."""
+    tracemalloc.start()
+    try:
+        memory_before = tracemalloc.get_traced_memory()[0]
+        loaded_menus = load()
+        memory_after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return loaded_menus, memory_after - memory_before
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Compares the memory footprint of cached menus as dictionaries and as the compact menu model."
+    )
+    argument_parser.add_argument(
+        "--source",
+        choices=["synthetic", "cached"],
+        default="synthetic",
+        help="Use synthetic menus or the cached menus in the data directory.",
+    )
+    argument_parser.add_argument(
+        "--weeks",
+        type=int,
+        default=1000,
+        help="Amount of synthetic weeks to generate.",
+    )
+    argument_parser.add_argument(
+        "--max-revisions",
+        type=int,
+        default=2,
+        help="Maximum amount of previous revisions per synthetic week.",
+    )
+    arguments = argument_parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if arguments.source == "synthetic":
+        logger.info(f"Generating {arguments.weeks} synthetic weeks...")
+        encoded_menus = generate_encoded_menus(arguments.weeks, arguments.max_revisions)
+    else:
+        logger.info("Reading cached menus...")
+        encoded_menus = read_encoded_menus()
+    if len(encoded_menus) == 0:
+        argument_parser.error("No menus to measure.")
+    menu_dictionaries, dictionaries_size = measure(
+        lambda: [json.loads(encoded_menu) for encoded_menu in encoded_menus]
+    )
+    menu_model.interned_strings.clear()  # Count the intern table in the measurement
+    compact_menus, compact_size = measure(
+        lambda: [
+            menu_model.CachedMenu.from_dict(json.loads(encoded_menu))
+            for encoded_menu in encoded_menus
+        ]
+    )
+    logger.info("Verifying that the compact menus serialize to the same JSON...")
+    for menu_dictionary, compact_menu in zip(menu_dictionaries, compact_menus):
+        if json.dumps(compact_menu.to_dict()) != json.dumps(menu_dictionary):
+            raise RuntimeError(
+                f"Compact menu does not serialize to the same JSON: {menu_dictionary}"
+            )
+    week_count = len(encoded_menus)
+    print(f"Weeks: {week_count}")
+    print(
+        f"Dictionaries: {dictionaries_size} bytes ({dictionaries_size / week_count:.0f} bytes per week)"
+    )
+    print(
+        f"Compact model: {compact_size} bytes ({compact_size / week_count:.0f} bytes per week)"
+    )
+    print(f"Interned strings: {len(menu_model.interned_strings)}")
+    print(f"Reduction: {(1 - compact_size / dictionaries_size) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""menu_snapshot.py
+A read-only snapshot of all cached menus in a single file, shared between server workers.
+
+The downloader publishes a new snapshot after every run. Each server worker maps the snapshot
+file into memory using mmap, which means that the operating system keeps a single copy of it in
+memory no matter how many workers are running. Workers pick up new snapshots (generations)
+without restarting.
+
+The snapshot saves work compared to reading data.json files:
+* Menus are stored already decoded (serialized with marshal, which loads faster than JSON), so
+  reading a menu is a slice of the mapped file and a marshal.loads, without opening a file.
+* The index is a sorted array of key hashes (searched in place using bisect) and a table of
+  fixed-size entries, so mapping a new snapshot costs the same no matter how many weeks are cached
+  (nothing is parsed per worker).
+* Publishing only decodes the weeks whose data files changed since the previous snapshot (the data
+  of other weeks is copied from it), and nothing is written if no week changed.
+Run menu_snapshot_benchmark.py to compare reading menus from the snapshot and from the data files.
+
+marshal data can only be read by the Python version that wrote it, so the snapshot records the
+version that published it, and snapshots published by other versions are ignored (and replaced by
+the next publish).
+
+Snapshot file format (little-endian):
+* The header: the magic bytes b"EATERYS2", the snapshot generation (unsigned, 8 bytes), the amount
+  of entries (unsigned, 8 bytes), the marshal version and the Python version (sys.hexversion >> 16)
+  (unsigned, 4 bytes each)
+* The key hashes: the hash of the key of every menu (see get_key_hash) (unsigned, 8 bytes each), sorted
+* The index: one entry per menu, in the same order as the key hashes. Every entry holds the offset
+  (from the start of the menu data) and length of the menu's record, and the inode, size and modification
+  time of the data file the record was made from (unsigned, 8 bytes each, the modification time signed)
+* The menu data: one record per menu, holding the length of the key (unsigned, 2 bytes), the key
+  ("<menu id>/<week>-<year>", UTF-8) and the menu data (the content of data.json) serialized with marshal
+
+Run this file directly to publish a snapshot manually (add --full to decode every week again).
+"""
+import os, logging, mmap, struct, threading, time, typing, hashlib, marshal, sys, bisect
+import json_codec
+
+from shared_code import CACHED_MENUS_DIRECTORY, MENU_SNAPSHOT_FILEPATH
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"EATERYS2"
+# Magic, generation, amount of entries, marshal version and Python version
+SNAPSHOT_HEADER = struct.Struct("<8sQQII")
+SNAPSHOT_KEY_HASH = struct.Struct("<Q")
+# Record offset, record length, data file inode, size and modification time
+SNAPSHOT_INDEX_ENTRY = struct.Struct("<QQQQq")
+SNAPSHOT_KEY_LENGTH = struct.Struct("<H")
+PYTHON_VERSION = sys.hexversion >> 16  # The major and minor version
+CHECK_FOR_NEW_SNAPSHOT_EVERY_SECONDS = 1
+
+
+def get_snapshot_key(menu_id: str, week_number: int, year_number: int) -> str:
+    """Gets the key that a menu is stored under in the snapshot index.
+
+    :param menu_id: The (string) menu ID.
+
+    :param week_number: The week number of the menu.
+
+    :param year_number: The year of the menu."""
+    return f"{menu_id.strip('/')}/{week_number}-{year_number}"
+
+
+def get_key_hash(encoded_key: bytes) -> int:
+    """Gets the hash that a key is sorted and searched by in the snapshot index.
+
+    :param encoded_key: The key (see get_snapshot_key), encoded using UTF-8."""
+    return int.from_bytes(
+        hashlib.blake2b(encoded_key, digest_size=8).digest(), "little"
+    )
+
+
+def get_file_fingerprint(file_status: os.stat_result) -> typing.Tuple[int, int, int]:
+    """Gets the fingerprint of a data file that snapshot records are matched against. Data files
+    are always replaced by a new file, so the inode changes on every write.
+
+    :param file_status: The status (os.stat) of the data file.
+
+    :returns: A tuple of the inode, size and modification time (in nanoseconds)."""
+    return file_status.st_ino, file_status.st_size, file_status.st_mtime_ns
+
+
+def publish_snapshot(full: bool = False) -> int:
+    """Publishes a new snapshot of all cached menus. Only the weeks that have changed since the
+    current snapshot are read and decoded, and if no week has changed (or been added or removed),
+    the current snapshot is kept. The snapshot is written to a temporary file which is then moved
+    into place, so workers never see a half-written snapshot.
+
+    :param full: Pass True to read and decode every week, even if it has not changed.
+
+    :returns: The generation of the published (or kept) snapshot."""
+    global current_snapshot_checked_at
+    current_snapshot_checked_at = None  # Make sure that the latest snapshot is used
+    latest_snapshot = get_snapshot()
+    generation = 1 if latest_snapshot is None else latest_snapshot.generation + 1
+    previous_snapshot = None if full else latest_snapshot
+    logger.info(f"Publishing menu snapshot generation {generation}...")
+    # Tuples of key hash, encoded key, record and data file fingerprint
+    index_entries = []
+    decoded_weeks = 0
+    for menu_id in sorted(os.listdir(CACHED_MENUS_DIRECTORY)):
+        menu_path = os.path.join(CACHED_MENUS_DIRECTORY, menu_id)
+        if not os.path.isdir(menu_path):
+            continue
+        for cached_week in sorted(os.listdir(menu_path)):
+            menu_data_file_path = os.path.join(menu_path, cached_week, "data.json")
+            try:
+                file_fingerprint = get_file_fingerprint(os.stat(menu_data_file_path))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            encoded_key = f"{menu_id}/{cached_week}".encode("utf-8")
+            record = (
+                previous_snapshot.get_record(encoded_key, file_fingerprint)
+                if previous_snapshot is not None
+                else None
+            )
+            if record is None:
+                # The week is new or has changed, so decode it again
+                try:
+                    with open(menu_data_file_path, "rb") as menu_data_file:
+                        file_fingerprint = get_file_fingerprint(
+                            os.fstat(menu_data_file.fileno())
+                        )
+                        menu_data = json_codec.loads(menu_data_file.read())
+                except Exception as e:
+                    logger.warning(
+                        f"Failed to read {menu_data_file_path}: {e}. Leaving it out of the snapshot.",
+                        exc_info=True,
+                    )
+                    continue
+                record = (
+                    SNAPSHOT_KEY_LENGTH.pack(len(encoded_key))
+                    + encoded_key
+                    + marshal.dumps(menu_data)
+                )
+                decoded_weeks += 1
+            index_entries.append(
+                (get_key_hash(encoded_key), encoded_key, record, file_fingerprint)
+            )
+    if (
+        previous_snapshot is not None
+        and decoded_weeks == 0
+        and len(index_entries) == previous_snapshot.entry_count
+    ):
+        logger.info(
+            f"No menus have changed. Keeping menu snapshot generation {previous_snapshot.generation}."
+        )
+        return previous_snapshot.generation
+    index_entries.sort(key=lambda index_entry: index_entry[:2])
+    temporary_file_path = f"{MENU_SNAPSHOT_FILEPATH}.{os.getpid()}.tmp"
+    with open(temporary_file_path, "wb") as snapshot_file:
+        snapshot_file.write(
+            SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC,
+                generation,
+                len(index_entries),
+                marshal.version,
+                PYTHON_VERSION,
+            )
+        )
+        for key_hash, _, _, _ in index_entries:
+            snapshot_file.write(SNAPSHOT_KEY_HASH.pack(key_hash))
+        offset = 0
+        for _, _, record, file_fingerprint in index_entries:
+            snapshot_file.write(
+                SNAPSHOT_INDEX_ENTRY.pack(offset, len(record), *file_fingerprint)
+            )
+            offset += len(record)
+        for _, _, record, _ in index_entries:
+            snapshot_file.write(record)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temporary_file_path, MENU_SNAPSHOT_FILEPATH)
+    # Make sure that this process maps the new snapshot on next access
+    current_snapshot_checked_at = None
+    logger.info(
+        f"Published menu snapshot generation {generation} with {len(index_entries)} menus ({decoded_weeks} decoded, "
+        f"{len(index_entries) - decoded_weeks} copied from the previous snapshot)."
+    )
+    return generation
+
+
+class MenuSnapshot:
+    """A snapshot file mapped into memory."""
+
+    def __init__(self, snapshot_file_path: str):
+        """Maps a snapshot file into memory.
+
+        :param snapshot_file_path: The path to the snapshot file.
+
+        :raises ValueError: If the file is not a snapshot, or was published by another Python version.
+        """
+        with open(snapshot_file_path, "rb") as snapshot_file:
+            file_status = os.fstat(snapshot_file.fileno())
+            self.file_identity = (file_status.st_ino, file_status.st_mtime_ns)
+            self.memory = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            self.generation,
+            self.entry_count,
+            snapshot_marshal_version,
+            snapshot_python_version,
+        ) = SNAPSHOT_HEADER.unpack_from(self.memory)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{snapshot_file_path} is not a menu snapshot.")
+        if (snapshot_marshal_version, snapshot_python_version) != (
+            marshal.version,
+            PYTHON_VERSION,
+        ):
+            raise ValueError(
+                f"{snapshot_file_path} was published by another Python version."
+            )
+        self.index_offset = (
+            SNAPSHOT_HEADER.size + self.entry_count * SNAPSHOT_KEY_HASH.size
+        )
+        self.data_offset = (
+            self.index_offset + self.entry_count * SNAPSHOT_INDEX_ENTRY.size
+        )
+        self.view = memoryview(self.memory)
+        if sys.byteorder == "little":
+            # Search the key hashes where they are, without copying them
+            self.key_hashes = self.view[SNAPSHOT_HEADER.size : self.index_offset].cast(
+                "Q"
+            )
+        else:
+            self.key_hashes = [
+                key_hash
+                for (key_hash,) in SNAPSHOT_KEY_HASH.iter_unpack(
+                    self.view[SNAPSHOT_HEADER.size : self.index_offset]
+                )
+            ]
+
+    def find_index_entry(
+        self, encoded_key: bytes
+    ) -> typing.Optional[typing.Tuple[int, int, int, int, int]]:
+        """Finds the index entry of a key.
+
+        :param encoded_key: The key (see get_snapshot_key), encoded using UTF-8.
+
+        :returns: The index entry (see SNAPSHOT_INDEX_ENTRY), or None if the key is not in the snapshot.
+        """
+        key_hash = get_key_hash(encoded_key)
+        entry_number = bisect.bisect_left(self.key_hashes, key_hash)
+        # Compare the keys of the records, in case several keys have the same hash
+        while (
+            entry_number < self.entry_count
+            and self.key_hashes[entry_number] == key_hash
+        ):
+            index_entry = SNAPSHOT_INDEX_ENTRY.unpack_from(
+                self.memory,
+                self.index_offset + entry_number * SNAPSHOT_INDEX_ENTRY.size,
+            )
+            record_offset = self.data_offset + index_entry[0]
+            (key_length,) = SNAPSHOT_KEY_LENGTH.unpack_from(self.memory, record_offset)
+            key_offset = record_offset + SNAPSHOT_KEY_LENGTH.size
+            if self.view[key_offset : key_offset + key_length] == encoded_key:
+                return index_entry
+            entry_number += 1
+        return None
+
+    def get_record(
+        self, encoded_key: bytes, file_fingerprint: typing.Tuple[int, int, int]
+    ) -> typing.Optional[bytes]:
+        """Gets the record of a menu, if it was made from the current version of the data file.
+
+        :param encoded_key: The key (see get_snapshot_key), encoded using UTF-8.
+
+        :param file_fingerprint: The fingerprint of the data file (see get_file_fingerprint).
+
+        :returns: The record as bytes, or None if the menu is not in the snapshot (or is outdated).
+        """
+        index_entry = self.find_index_entry(encoded_key)
+        if index_entry is None or index_entry[2:] != file_fingerprint:
+            return None
+        record_offset = self.data_offset + index_entry[0]
+        return self.memory[record_offset : record_offset + index_entry[1]]
+
+    def get(
+        self,
+        menu_id: str,
+        week_number: int,
+        year_number: int,
+        file_status: os.stat_result,
+    ) -> typing.Optional[dict]:
+        """Gets the menu data (the content of data.json) for a menu.
+
+        :param file_status: The current status (os.stat) of the menu's data file. If the snapshot
+        was taken from another version of the file, the snapshot data is not returned.
+
+        :returns: The menu data, or None if the menu is not in the snapshot (or is outdated).
+        """
+        encoded_key = get_snapshot_key(menu_id, week_number, year_number).encode(
+            "utf-8"
+        )
+        index_entry = self.find_index_entry(encoded_key)
+        if index_entry is None or index_entry[2:] != get_file_fingerprint(file_status):
+            return None
+        record_offset = self.data_offset + index_entry[0]
+        menu_data_offset = record_offset + SNAPSHOT_KEY_LENGTH.size + len(encoded_key)
+        return marshal.loads(
+            self.view[menu_data_offset : record_offset + index_entry[1]]
+        )
+
+
+current_snapshot = None  # The currently mapped snapshot
+current_snapshot_checked_at = None  # When we last checked for a new snapshot
+unusable_snapshot_file_identity = (
+    None  # A snapshot file that failed to map (so that it isn't retried)
+)
+snapshot_lock = threading.Lock()
+
+
+def get_snapshot() -> typing.Optional[MenuSnapshot]:
+    """Gets the latest snapshot, mapping a new one if the snapshot file has been replaced
+    since the last check. Returns None if no (usable) snapshot has been published."""
+    global current_snapshot, current_snapshot_checked_at, unusable_snapshot_file_identity
+    if (
+        current_snapshot_checked_at is not None
+        and time.monotonic() - current_snapshot_checked_at
+        < CHECK_FOR_NEW_SNAPSHOT_EVERY_SECONDS
+    ):
+        return current_snapshot
+    with snapshot_lock:
+        file_identity = None
+        try:
+            file_status = os.stat(MENU_SNAPSHOT_FILEPATH)
+            file_identity = (file_status.st_ino, file_status.st_mtime_ns)
+            if file_identity == unusable_snapshot_file_identity:
+                current_snapshot = None
+            elif (
+                current_snapshot is None
+                or current_snapshot.file_identity != file_identity
+            ):
+                logger.info("Mapping new menu snapshot...")
+                current_snapshot = MenuSnapshot(MENU_SNAPSHOT_FILEPATH)
+                logger.info(
+                    f"Mapped menu snapshot generation {current_snapshot.generation}."
+                )
+        except FileNotFoundError:
+            current_snapshot = None
+        except Exception as e:
+            logger.warning(
+                f"Failed to map menu snapshot: {e}. Reading menus from disk.",
+                exc_info=True,
+            )
+            current_snapshot = None
+            unusable_snapshot_file_identity = file_identity
+        current_snapshot_checked_at = time.monotonic()
+    return current_snapshot
+
+
+def get_menu_data(
+    menu_id: str, week_number: int, year_number: int, file_status: os.stat_result
+) -> typing.Optional[dict]:
+    """Gets the data for a menu from the latest snapshot.
+
+    :param menu_id: The (string) menu ID.
+
+    :param week_number: The week number of the menu.
+
+    :param year_number: The year of the menu.
+
+    :param file_status: The current status (os.stat) of the menu's data file.
+
+    :returns: The menu data, or None if there is no snapshot or the menu is not in it.
+    """
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    return snapshot.get(menu_id, week_number, year_number, file_status)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    publish_snapshot(full="--full" in sys.argv)
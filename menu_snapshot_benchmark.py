@@ -0,0 +1,178 @@
+"""menu_snapshot_benchmark.py
+Measures what the menu snapshot (see menu_snapshot.py) saves compared to reading the data files:
+how fast cached menus are read from the snapshot and from their data.json files (both including
+the os.stat that checks whether the snapshot is up to date), how long it takes to map a snapshot,
+and how long publishing takes when every week is decoded, when nothing has changed and when
+a single week has changed.
+
+By default, a synthetic cache is generated in a temporary data directory. Pass --data-directory
+to use the cached menus of an existing data directory instead (this publishes a snapshot in it,
+just like the downloader does).
+
+Example usage:
+python menu_snapshot_benchmark.py
+python menu_snapshot_benchmark.py --synthetic-locations 20 --synthetic-years 5
+python menu_snapshot_benchmark.py --data-directory /path/to/data
+"""
+import argparse, logging, os, shutil, sys, tempfile, time, typing
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+
+
+def time_function(function: typing.Callable[[], typing.Any], repeat: int) -> float:
+    """Times a function and returns the best time (in seconds) out of a number of rounds.
+
+    :param function: The function to time.
+
+    :param repeat: The amount of rounds."""
+    best_time = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+    return best_time
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Benchmarks reading menus from the menu snapshot against reading the data files."
+    )
+    argument_parser.add_argument(
+        "--data-directory",
+        help="Data directory with cached menus to use instead of a synthetic cache.",
+    )
+    argument_parser.add_argument(
+        "--synthetic-locations",
+        type=int,
+        default=10,
+        help="Amount of locations in the synthetic cache.",
+    )
+    argument_parser.add_argument(
+        "--synthetic-years",
+        type=int,
+        default=3,
+        help="Amount of years in the synthetic cache.",
+    )
+    argument_parser.add_argument(
+        "--repeat", type=int, default=5, help="Amount of rounds to time."
+    )
+    arguments = argument_parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    # Point everything to the data directory. This must be done before the
+    # EateryCacher modules are imported, since they read the data directory on import.
+    remove_data_directory = arguments.data_directory is None
+    data_directory = arguments.data_directory or tempfile.mkdtemp(
+        prefix="eatery_snapshot_benchmark_"
+    )
+    os.environ["EATERY_CACHER_DATA_DIRECTORY"] = os.path.realpath(data_directory)
+    sys.path.insert(0, SCRIPT_DIRECTORY)
+    try:
+        import menu_caching, menu_snapshot
+        from shared_code import (
+            CACHED_MENUS_DIRECTORY,
+            MENU_SNAPSHOT_FILEPATH,
+            read_json_from_file,
+            write_json_to_file,
+        )
+
+        if remove_data_directory:
+            from load_test import generate_synthetic_cache
+
+            print("Generating synthetic cache...")
+            generate_synthetic_cache(
+                arguments.synthetic_locations, arguments.synthetic_years, 2
+            )
+        # Tuples of menu ID, week number, year number and data file path
+        weeks = []
+        for menu_id in sorted(os.listdir(CACHED_MENUS_DIRECTORY)):
+            menu_path = os.path.join(CACHED_MENUS_DIRECTORY, menu_id)
+            if not os.path.isdir(menu_path):
+                continue
+            for cached_week in sorted(os.listdir(menu_path)):
+                menu_data_file_path = os.path.join(menu_path, cached_week, "data.json")
+                week_match = (
+                    menu_caching.menu_archive.CACHED_WEEK_DIRECTORY_REGEX.fullmatch(
+                        cached_week
+                    )
+                )
+                if week_match is not None and os.path.isfile(menu_data_file_path):
+                    weeks.append(
+                        (
+                            menu_id,
+                            int(week_match.group(1)),
+                            int(week_match.group(2)),
+                            menu_data_file_path,
+                        )
+                    )
+        if len(weeks) == 0:
+            print("There are no cached menus to benchmark with.")
+            exit(1)
+        publish_times = {
+            "full": time_function(
+                lambda: menu_snapshot.publish_snapshot(full=True), arguments.repeat
+            ),
+            "unchanged": time_function(
+                menu_snapshot.publish_snapshot, arguments.repeat
+            ),
+        }
+
+        def publish_with_changed_week():
+            # Rewriting a data file replaces it, which is what the downloader does when a menu changes
+            write_json_to_file(read_json_from_file(weeks[0][3]), weeks[0][3])
+            menu_snapshot.publish_snapshot()
+
+        publish_times["one_changed"] = time_function(
+            publish_with_changed_week, arguments.repeat
+        )
+        snapshot = menu_snapshot.get_snapshot()
+        for menu_id, week_number, year_number, menu_data_file_path in weeks:
+            if menu_snapshot.get_menu_data(
+                menu_id, week_number, year_number, os.stat(menu_data_file_path)
+            ) != read_json_from_file(menu_data_file_path):
+                raise RuntimeError(
+                    f"The snapshot does not match {menu_data_file_path}."
+                )
+
+        def read_from_files():
+            for _, _, _, menu_data_file_path in weeks:
+                os.stat(menu_data_file_path)
+                read_json_from_file(menu_data_file_path)
+
+        def read_from_snapshot():
+            for menu_id, week_number, year_number, menu_data_file_path in weeks:
+                snapshot.get(
+                    menu_id, week_number, year_number, os.stat(menu_data_file_path)
+                )
+
+        file_read_time = time_function(read_from_files, arguments.repeat)
+        snapshot_read_time = time_function(read_from_snapshot, arguments.repeat)
+        map_time = time_function(
+            lambda: menu_snapshot.MenuSnapshot(MENU_SNAPSHOT_FILEPATH),
+            arguments.repeat,
+        )
+        print(
+            f"Weeks: {len(weeks)}, snapshot size: {os.path.getsize(MENU_SNAPSHOT_FILEPATH)} bytes, "
+            f"JSON backend: {menu_snapshot.json_codec.BACKEND}"
+        )
+        print(
+            f"read: data files {file_read_time / len(weeks) * 1e6:.1f} µs, "
+            f"snapshot {snapshot_read_time / len(weeks) * 1e6:.1f} µs per week "
+            f"({file_read_time / snapshot_read_time:.1f}x faster)"
+        )
+        print(f"map snapshot: {map_time * 1e6:.1f} µs")
+        print(
+            f"publish: every week decoded {publish_times['full'] * 1e3:.1f} ms, "
+            f"nothing changed {publish_times['unchanged'] * 1e3:.1f} ms, "
+            f"one week changed {publish_times['one_changed'] * 1e3:.1f} ms"
+        )
+    finally:
+        if remove_data_directory:
+            shutil.rmtree(data_directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
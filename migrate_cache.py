@@ -0,0 +1,199 @@
+"""migrate_cache.py
+One-off migrations of the cached menus directory, for deployments upgrading from older versions.
+The server and the downloader never run these by themselves, so run them once after upgrading.
+Every migration takes --dry-run to only print what it would do.
+
+Example usage:
+python migrate_cache.py remove-old-response-files (remove response files that are no longer used)
+python migrate_cache.py refile-weeks --dry-run (list weeks stored under the wrong year)
+"""
+import os, logging, argparse, datetime, shutil, typing
+
+import menu_caching, menu_archive, menu_snapshot, change_notifications, json_codec
+from shared_code import CACHED_MENUS_DIRECTORY, read_json_from_file, get_now
+
+logger = logging.getLogger(__name__)
+
+# Names of response files written by older versions. They are never read again, since response
+# files are now named by the fingerprint of their data file (see menu_caching.get_cached_menu_response_file).
+OLD_RESPONSE_FILE_NAMES = ["response.json", "week_response.json"]
+
+
+def remove_old_response_files(dry_run: bool = False) -> int:
+    """Removes the response files written by older versions from every cached week.
+
+    :param dry_run: Pass True to only log the files that would be removed.
+
+    :returns: The amount of files removed (or that would be removed)."""
+    removed_files = 0
+    for menu_id in sorted(os.listdir(CACHED_MENUS_DIRECTORY)):
+        menu_path = os.path.join(CACHED_MENUS_DIRECTORY, menu_id)
+        if not os.path.isdir(menu_path):
+            continue
+        for cached_week in sorted(os.listdir(menu_path)):
+            for old_response_file_name in OLD_RESPONSE_FILE_NAMES:
+                old_response_file_path = os.path.join(
+                    menu_path, cached_week, old_response_file_name
+                )
+                if not os.path.isfile(old_response_file_path):
+                    continue
+                logger.info(f"Removing unused response file {old_response_file_path}.")
+                if not dry_run:
+                    try:
+                        os.remove(old_response_file_path)
+                    except FileNotFoundError:
+                        continue
+                removed_files += 1
+    logger.info(
+        f"{'Would remove' if dry_run else 'Removed'} {removed_files} unused response file(s)."
+    )
+    return removed_files
+
+
+def get_expected_year(menu_data: dict, week_number: int) -> int:
+    """Gets the year that a cached week should be stored under: the ISO week-year of the week,
+    as picked by menu_caching.get_menu_year when the menu was retrieved.
+
+    :param menu_data: The cached menu data (the content of data.json).
+
+    :param week_number: The week number that the menu is stored under."""
+    retrieved_at = datetime.datetime.fromtimestamp(
+        menu_data["last_retrieved_at"], tz=get_now().tzinfo
+    )
+    return menu_caching.get_menu_year(week_number, retrieved_at)
+
+
+def refile_weeks(dry_run: bool = False) -> typing.Dict[str, int]:
+    """Moves weeks that older versions stored under the calendar year they were retrieved in to
+    the ISO week-year of the week. For example, week 1 of 2026 retrieved in late December 2025 was
+    stored as 1-2025, and is moved to 1-2026.
+
+    If the week is already stored under the right year too, the misfiled copy is only removed if
+    it is a duplicate (same menu and no previous revisions). Otherwise it is reported as a conflict
+    and left in place. Weeks in archives (see menu_archive) are only reported, since archives are never rewritten.
+
+    :param dry_run: Pass True to only log the weeks that would be moved.
+
+    :returns: Statistics: how many weeks were moved, removed as duplicates, left because of
+    conflicts and found misfiled in archives."""
+    statistics = {"moved": 0, "duplicates_removed": 0, "conflicts": 0, "archived": 0}
+    for menu_id in sorted(os.listdir(CACHED_MENUS_DIRECTORY)):
+        menu_path = os.path.join(CACHED_MENUS_DIRECTORY, menu_id)
+        if not os.path.isdir(menu_path):
+            continue
+        for cached_week in sorted(os.listdir(menu_path)):
+            cached_week_match = menu_archive.CACHED_WEEK_DIRECTORY_REGEX.fullmatch(
+                cached_week
+            )
+            if cached_week_match is None:
+                continue
+            week_number, year_number = int(cached_week_match.group(1)), int(
+                cached_week_match.group(2)
+            )
+            menu_data_file_path = os.path.join(menu_path, cached_week, "data.json")
+            if not os.path.isfile(menu_data_file_path):
+                continue
+            menu_data = read_json_from_file(menu_data_file_path)
+            expected_year_number = get_expected_year(menu_data, week_number)
+            if expected_year_number == year_number:
+                continue
+            source_directory = os.path.join(menu_path, cached_week)
+            target_directory = menu_caching.get_cached_menu_directory(
+                menu_id, week_number, expected_year_number
+            )
+            target_menu_data_file_path = os.path.join(target_directory, "data.json")
+            if os.path.exists(target_menu_data_file_path):
+                target_menu_data = read_json_from_file(target_menu_data_file_path)
+                if target_menu_data["menu"] != menu_data["menu"] or (
+                    len(menu_data.get("previous_revisions", [])) > 0
+                ):
+                    logger.warning(
+                        f"Week {week_number} of menu {menu_id} is stored under {year_number} but belongs to {expected_year_number}, "
+                        f"where another version of it is stored. Leaving {source_directory} in place, compare the two and remove one of them."
+                    )
+                    statistics["conflicts"] += 1
+                    continue
+                logger.info(
+                    f"{source_directory} is a duplicate of {target_directory}. Removing it..."
+                )
+                if not dry_run:
+                    shutil.rmtree(source_directory)
+                statistics["duplicates_removed"] += 1
+            else:
+                logger.info(f"Moving {source_directory} to {target_directory}...")
+                if not dry_run:
+                    os.rename(source_directory, target_directory)
+                statistics["moved"] += 1
+            if not dry_run:
+                # Let server workers drop the weeks from memory
+                change_notifications.publish_change(menu_id, week_number, year_number)
+                change_notifications.publish_change(
+                    menu_id, week_number, expected_year_number
+                )
+        # Weeks in archives are only reported
+        for file_name in sorted(os.listdir(menu_path)):
+            archive_file_match = menu_caching.ARCHIVE_FILE_REGEX.fullmatch(file_name)
+            if archive_file_match is None:
+                continue
+            year_number = int(archive_file_match.group(1))
+            for week_number in menu_archive.get_archived_weeks(menu_id, year_number):
+                archived_menu_data = menu_archive.read_archived_menu(
+                    menu_id, week_number, year_number
+                )
+                if archived_menu_data is None:
+                    continue
+                expected_year_number = get_expected_year(
+                    json_codec.loads(archived_menu_data), week_number
+                )
+                if expected_year_number != year_number:
+                    logger.warning(
+                        f"Archived week {week_number} of menu {menu_id} is stored under {year_number} but belongs to {expected_year_number}. "
+                        "Archived weeks are not moved."
+                    )
+                    statistics["archived"] += 1
+    changed_weeks = statistics["moved"] + statistics["duplicates_removed"]
+    if dry_run:
+        logger.info(f"Dry run done. {changed_weeks} week(s) would be refiled.")
+    else:
+        if changed_weeks > 0:
+            menu_snapshot.publish_snapshot()
+        logger.info(f"Done. {changed_weeks} week(s) were refiled.")
+    return statistics
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="One-off migrations of the cached menus directory."
+    )
+    subparsers = argument_parser.add_subparsers(dest="command", required=True)
+    remove_old_response_files_parser = subparsers.add_parser(
+        "remove-old-response-files",
+        help="Remove response files written by older versions (response.json and week_response.json).",
+    )
+    remove_old_response_files_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only print the files that would be removed.",
+    )
+    refile_weeks_parser = subparsers.add_parser(
+        "refile-weeks",
+        help="Move weeks stored under the year they were retrieved in to the ISO week-year of the week.",
+    )
+    refile_weeks_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only print the weeks that are stored under the wrong year.",
+    )
+    arguments = argument_parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if arguments.command == "remove-old-response-files":
+        remove_old_response_files(dry_run=arguments.dry_run)
+    elif arguments.command == "refile-weeks":
+        statistics = refile_weeks(dry_run=arguments.dry_run)
+        print(json_codec.dumps(statistics, indent=True).decode("utf-8"))
+        if statistics["conflicts"] + statistics["archived"] > 0:
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
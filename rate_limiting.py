@@ -0,0 +1,105 @@
+"""rate_limiting.py
+Token bucket rate limiting, shared between all server workers on a machine.
+
+Buckets are stored in a memory-mapped file with a fixed amount of slots. Every client and route
+gets a bucket in a slot picked by hashing the client and route. If two buckets end up in the same
+slot, the newest one takes over the slot (which can only make limits more lenient, never stricter).
+A slot is locked using a byte-range lock on the file while it is updated, so checking a limit costs
+a few microseconds.
+
+Slot format (little-endian): key hash (unsigned, 8 bytes), tokens (double), last updated at (double).
+"""
+import os, logging, mmap, struct, fcntl, hashlib, threading, time, math, typing
+
+from shared_code import RATE_LIMITS_FILEPATH
+
+logger = logging.getLogger(__name__)
+
+SLOT = struct.Struct("<Qdd")
+SLOT_COUNT = 65536
+
+rate_limits_memory = None  # The memory-mapped rate limits file
+rate_limits_file_descriptor = None
+rate_limits_process_id = None  # The process ID that the file was opened in
+# Byte-range locks don't exclude threads in the same process, so threads also take this lock
+rate_limits_lock = threading.Lock()
+
+
+def open_rate_limits_file() -> None:
+    """Opens and maps the rate limits file, creating it if it does not exist."""
+    global rate_limits_memory, rate_limits_file_descriptor, rate_limits_process_id
+    file_descriptor = os.open(RATE_LIMITS_FILEPATH, os.O_RDWR | os.O_CREAT, 0o600)
+    fcntl.lockf(file_descriptor, fcntl.LOCK_EX)
+    try:
+        if os.fstat(file_descriptor).st_size != SLOT_COUNT * SLOT.size:
+            logger.info("Creating rate limits file...")
+            os.ftruncate(file_descriptor, SLOT_COUNT * SLOT.size)
+    finally:
+        fcntl.lockf(file_descriptor, fcntl.LOCK_UN)
+    rate_limits_memory = mmap.mmap(file_descriptor, SLOT_COUNT * SLOT.size)
+    rate_limits_file_descriptor = file_descriptor
+    rate_limits_process_id = os.getpid()
+
+
+def take_token(
+    key: str, requests_per_minute: float, burst: int
+) -> typing.Tuple[bool, int]:
+    """Takes a token from the bucket of a key.
+
+    :param key: The key of the bucket, for example the client IP address and the route.
+
+    :param requests_per_minute: How many tokens are added to the bucket per minute. 0 disables the limit.
+
+    :param burst: The maximum amount of tokens in the bucket.
+
+    :returns: A tuple of whether a token was available (so the request is allowed) and,
+    if not, how many seconds until the next token is available."""
+    if requests_per_minute == 0:
+        return True, 0  # Unlimited
+    with rate_limits_lock:
+        if rate_limits_process_id != os.getpid():
+            open_rate_limits_file()
+        key_hash = int.from_bytes(
+            hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little"
+        )
+        slot_offset = (key_hash % SLOT_COUNT) * SLOT.size
+        tokens_per_second = requests_per_minute / 60
+        fcntl.lockf(rate_limits_file_descriptor, fcntl.LOCK_EX, SLOT.size, slot_offset)
+        try:
+            slot_key_hash, tokens, updated_at = SLOT.unpack_from(
+                rate_limits_memory, slot_offset
+            )
+            now = time.time()
+            if slot_key_hash != key_hash:
+                tokens = burst  # New bucket (or another bucket used the slot before)
+            else:
+                tokens = min(
+                    burst, tokens + max(now - updated_at, 0) * tokens_per_second
+                )
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            SLOT.pack_into(rate_limits_memory, slot_offset, key_hash, tokens, now)
+        finally:
+            fcntl.lockf(
+                rate_limits_file_descriptor, fcntl.LOCK_UN, SLOT.size, slot_offset
+            )
+    if allowed:
+        return True, 0
+    return False, max(math.ceil((1 - tokens) / tokens_per_second), 1)
+
+
+def validate_limit(requests_per_minute: float, burst: int) -> None:
+    """Validates a rate limit from the configuration.
+
+    :param requests_per_minute: How many requests a client can make per minute (0 disables the limit).
+
+    :param burst: How many requests a client can make at once.
+
+    :raises ValueError: If the limit is invalid."""
+    if not requests_per_minute >= 0:
+        raise ValueError(
+            f"Invalid requests per minute: {requests_per_minute} (must be 0 or more)."
+        )
+    if burst < 1:
+        raise ValueError(f"Invalid burst: {burst} (must be 1 or more).")
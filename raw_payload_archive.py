@@ -0,0 +1,83 @@
+"""raw_payload_archive.py
+Archives the raw menu payloads retrieved from Eatery, so that the full history can be parsed
+again when the parser improves (see reparse_menus.py).
+
+Payloads are compressed and stored by the SHA-256 hash of their content, which means that a payload
+that has not changed since the last download is only stored once. Every download is logged in an
+index (one JSON line per download) that tags the payload hash with the menu and the time of the download.
+"""
+import os, logging, json, gzip, hashlib, datetime, typing, json_codec
+
+from shared_code import RAW_PAYLOADS_DIRECTORY
+
+logger = logging.getLogger(__name__)
+
+RAW_PAYLOADS_INDEX_FILEPATH = os.path.join(RAW_PAYLOADS_DIRECTORY, "index.jsonl")
+
+
+def get_raw_payload_path(payload_hash: str) -> str:
+    """Gets the path that a payload is stored at.
+
+    :param payload_hash: The SHA-256 hash of the payload."""
+    return os.path.join(
+        RAW_PAYLOADS_DIRECTORY, "objects", payload_hash[:2], f"{payload_hash}.json.gz"
+    )
+
+
+def archive_raw_payload(
+    menu_name: str, menu_id: int, payload: dict, fetched_at: datetime.datetime
+) -> str:
+    """Archives a raw menu payload and logs the download in the index.
+
+    :param menu_name: The menu name (string menu ID) that the payload was downloaded for.
+
+    :param menu_id: The Eatery menu ID of the payload.
+
+    :param payload: The payload, as returned by Eatery's API.
+
+    :param fetched_at: When the payload was downloaded.
+
+    :returns: The hash of the payload."""
+    encoded_payload = json.dumps(
+        payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    ).encode("utf-8")
+    payload_hash = hashlib.sha256(encoded_payload).hexdigest()
+    payload_path = get_raw_payload_path(payload_hash)
+    os.makedirs(os.path.dirname(payload_path), exist_ok=True)
+    if not os.path.exists(payload_path):
+        logger.info(f"Archiving new raw payload {payload_hash} for {menu_name}...")
+        temporary_file_path = f"{payload_path}.{os.getpid()}.tmp"
+        with open(temporary_file_path, "wb") as payload_file:
+            payload_file.write(gzip.compress(encoded_payload, 9))
+        os.replace(temporary_file_path, payload_path)
+    else:
+        logger.info(f"Raw payload {payload_hash} for {menu_name} is already archived.")
+    with open(RAW_PAYLOADS_INDEX_FILEPATH, "a") as index_file:
+        index_file.write(
+            json.dumps(
+                {
+                    "hash": payload_hash,
+                    "menu_name": menu_name.strip("/"),
+                    "menu_id": menu_id,
+                    "fetched_at": fetched_at.timestamp(),
+                }
+            )
+            + "\n"
+        )
+    return payload_hash
+
+
+def read_raw_payload(payload_hash: str) -> dict:
+    """Reads an archived payload.
+
+    :param payload_hash: The hash of the payload."""
+    with open(get_raw_payload_path(payload_hash), "rb") as payload_file:
+        return json_codec.loads(gzip.decompress(payload_file.read()))
+
+
+def read_index() -> typing.List[dict]:
+    """Reads the index of all archived downloads, oldest first."""
+    if not os.path.exists(RAW_PAYLOADS_INDEX_FILEPATH):
+        return []
+    with open(RAW_PAYLOADS_INDEX_FILEPATH, "r") as index_file:
+        return [json.loads(line) for line in index_file if len(line.strip()) > 0]
@@ -0,0 +1,177 @@
+"""reparse_menus.py
+Parses all archived raw menu payloads (see raw_payload_archive.py) again using the current parser
+and rewrites the cached weeks whose parsed menu has changed. Useful after the parser has been improved.
+
+Payloads are parsed in parallel using a process pool. For every cached week, the latest downloaded
+payload for that week decides the new menu. Previous revisions are kept as they are.
+
+Example usage:
+python reparse_menus.py --dry-run (shows a diff of what would change)
+python reparse_menus.py --menu kista-nod --workers 8
+"""
+import os, logging, json, argparse, datetime, difflib, pytz, typing
+from concurrent.futures import ProcessPoolExecutor
+
+import menu_caching, menu_snapshot, change_notifications, raw_payload_archive, menu_model
+import menu_events
+from menuparser import MenuParser
+from shared_code import write_json_to_file, get_now
+
+logger = logging.getLogger(__name__)
+
+
+def parse_raw_payload(
+    payload_hash: str,
+) -> typing.Tuple[typing.Optional[dict], typing.Optional[str]]:
+    """Parses an archived payload. Runs in a worker process.
+
+    :param payload_hash: The hash of the payload to parse.
+
+    :returns: A tuple of the parsed menu and None, or None and an error message if the payload
+    could not be parsed (so that one bad payload doesn't stop the whole run)."""
+    # The parser logs a lot on the info level, which slows down parsing a lot of payloads
+    logging.getLogger("menuparser").setLevel(logging.WARNING)
+    try:
+        return (
+            MenuParser().parse(raw_payload_archive.read_raw_payload(payload_hash)),
+            None,
+        )
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Parses archived raw menu payloads again and rewrites changed cached weeks."
+    )
+    argument_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only show a diff of the changes, without writing anything.",
+    )
+    argument_parser.add_argument(
+        "--menu",
+        action="append",
+        help="Menu ID to parse again (can be passed multiple times). Defaults to all menus.",
+    )
+    argument_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Amount of parser processes. Defaults to the amount of CPUs.",
+    )
+    arguments = argument_parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    menu_names = (
+        {menu_name.strip("/") for menu_name in arguments.menu}
+        if arguments.menu
+        else None
+    )
+    downloads = [
+        download
+        for download in raw_payload_archive.read_index()
+        if menu_names is None or download["menu_name"] in menu_names
+    ]
+    payload_hashes = sorted({download["hash"] for download in downloads})
+    logger.info(
+        f"Parsing {len(payload_hashes)} unique payloads from {len(downloads)} downloads..."
+    )
+    # The full history can be large, so parsed menus are kept using the compact menu model
+    parsed_menus = {}
+    failed_payload_count = 0
+    with ProcessPoolExecutor(max_workers=arguments.workers) as executor:
+        for parsed_count, (payload_hash, (parsed_menu, error_message)) in enumerate(
+            zip(
+                payload_hashes,
+                executor.map(parse_raw_payload, payload_hashes, chunksize=16),
+            ),
+            start=1,
+        ):
+            if error_message is None:
+                try:
+                    parsed_menus[payload_hash] = menu_model.Menu.from_dict(parsed_menu)
+                except ValueError as e:
+                    error_message = str(e)
+            if error_message is not None:
+                logger.warning(
+                    f"Failed to parse payload {payload_hash}: {error_message}. Skipping..."
+                )
+                failed_payload_count += 1
+            if parsed_count % 100 == 0 or parsed_count == len(payload_hashes):
+                logger.info(f"Parsed {parsed_count}/{len(payload_hashes)} payloads.")
+    # Find the latest parsed menu for every week. Downloads are logged in order, so later ones win.
+    latest_menus = {}
+    for download in downloads:
+        parsed_menu = parsed_menus.get(download["hash"])
+        if parsed_menu is None or parsed_menu.week_number is None:
+            continue
+        retrieved_at = datetime.datetime.fromtimestamp(
+            download["fetched_at"], tz=pytz.timezone("Europe/Stockholm")
+        )
+        year_number = menu_caching.get_menu_year(parsed_menu.week_number, retrieved_at)
+        latest_menus[
+            (download["menu_name"], parsed_menu.week_number, year_number)
+        ] = parsed_menu
+    # Compare with the cached weeks
+    changed_weeks = 0
+    for (menu_name, week_number, year_number), compact_menu in sorted(
+        latest_menus.items()
+    ):
+        parsed_menu = compact_menu.to_dict()
+        menu_data = menu_caching.get_cached_menu(menu_name, week_number, year_number)
+        if menu_data is None:
+            logger.debug(
+                f"{menu_name}, week {week_number} {year_number} is not cached. Skipping."
+            )
+            continue
+        if menu_data["menu"] == parsed_menu:
+            continue
+        changed_weeks += 1
+        if arguments.dry_run:
+            print(
+                "".join(
+                    difflib.unified_diff(
+                        json.dumps(menu_data["menu"], indent=True).splitlines(True),
+                        json.dumps(parsed_menu, indent=True).splitlines(True),
+                        fromfile=f"{menu_name}/{week_number}-{year_number} (cached)",
+                        tofile=f"{menu_name}/{week_number}-{year_number} (parsed again)",
+                    )
+                )
+            )
+            continue
+        logger.info(f"Rewriting {menu_name}, week {week_number} {year_number}...")
+        menu_data["menu"] = parsed_menu
+        cached_menu_directory = menu_caching.get_cached_menu_directory(
+            menu_name, week_number, year_number
+        )
+        # (archived weeks get a directory again, which takes precedence over the archive)
+        os.makedirs(cached_menu_directory, exist_ok=True)
+        write_json_to_file(menu_data, os.path.join(cached_menu_directory, "data.json"))
+        # Log the change so that clients mirroring the menus fetch the week again
+        event_id = menu_events.append_event(
+            {
+                "type": "reparsed",
+                "menu_id": menu_name.strip("/"),
+                "week_number": week_number,
+                "year_number": year_number,
+                "changed_at": get_now().timestamp(),
+                "menu": parsed_menu,
+            }
+        )
+        change_notifications.publish_change(
+            menu_name, week_number, year_number, event_id=event_id
+        )
+    if arguments.dry_run:
+        logger.info(f"Dry run done. {changed_weeks} weeks would be rewritten.")
+    else:
+        if changed_weeks > 0:
+            menu_snapshot.publish_snapshot()
+        logger.info(f"Done. {changed_weeks} weeks were rewritten.")
+    if failed_payload_count > 0:
+        logger.warning(
+            f"{failed_payload_count} payloads could not be parsed and were skipped."
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+"""replication.py
+Replicates the menu cache from the node that runs the downloader (the leader) to other nodes
+that only run the API server (followers), so that only one node has to download from Eatery.
+
+The leader publishes a manifest with the SHA-256 hash of the menu data of every cached week
+(the content of data.json, or of the archived week). Every entry records the manifest generation
+it last changed in, so followers can ask for the entries that changed after the generation they
+last pulled and only download those weeks. Hashes are only computed again for weeks whose data
+file (or archive) has changed since the previous manifest, and removed weeks are kept in the
+manifest (with a hash of None) so that followers remove them too.
+
+Followers pull from the leader's replication endpoints (/api/replication/manifest and
+/api/replication/weeks/<menu_id>/<year>/<week>), verify the hash of every downloaded week and move
+it into place atomically. Server workers on the follower are then notified of the changed weeks and
+a new menu snapshot is published, just like after a downloader run.
+
+Example usage:
+python replication.py publish (publish the manifest of this node)
+python replication.py pull --leader http://leader.example.com (pull the changes from the leader)
+"""
+import os, logging, hashlib, shutil, threading, time, uuid, argparse, re, typing
+import requests
+from configparser import ConfigParser
+
+import menu_caching, menu_archive, menu_snapshot, change_notifications, json_codec
+from shared_code import (
+    CONFIG_FILEPATH,
+    REPLICATION_MANIFEST_FILEPATH,
+    REPLICATION_STATE_FILEPATH,
+    read_json_from_file,
+    write_json_to_file,
+    get_now,
+)
+
+logger = logging.getLogger(__name__)
+
+# Bump when the manifest changes format, so that followers pull everything again
+MANIFEST_FORMAT_VERSION = 1
+WEEK_KEY_REGEX = re.compile("^([A-Za-z0-9_-]+)/([0-9]{4})/([0-9]{1,2})$")
+MAXIMUM_RATE_LIMITED_RETRIES = 5
+
+manifest_cache = None  # A tuple of the identity of the manifest file and the manifest
+manifest_cache_lock = threading.Lock()
+
+
+def get_week_key(menu_id: str, year_number: int, week_number: int) -> str:
+    """Gets the key of a week in the manifest.
+
+    :param menu_id: The (string) menu ID.
+
+    :param year_number: The year of the week.
+
+    :param week_number: The week number."""
+    return f"{menu_id.strip('/')}/{year_number}/{week_number}"
+
+
+def parse_week_key(week_key: str) -> typing.Tuple[str, int, int]:
+    """Parses the key of a week in the manifest.
+
+    :param week_key: The key, for example "kista-nod/2023/12".
+
+    :returns: A tuple of the menu ID, year number and week number.
+
+    :raises ValueError: If the key is invalid."""
+    match = WEEK_KEY_REGEX.fullmatch(week_key)
+    if match is None:
+        raise ValueError(f"Invalid week {week_key}.")
+    return match.group(1), int(match.group(2)), int(match.group(3))
+
+
+def read_raw_week(
+    menu_id: str, year_number: int, week_number: int
+) -> typing.Optional[bytes]:
+    """Reads the menu data of a cached week exactly as it is stored.
+
+    :param menu_id: The (string) menu ID.
+
+    :param year_number: The year of the week.
+
+    :param week_number: The week number.
+
+    :returns: The menu data (the content of data.json) as bytes, or None if the week is not cached.
+    """
+    menu_data_file_path = os.path.join(
+        menu_caching.get_cached_menu_directory(menu_id, week_number, year_number),
+        "data.json",
+    )
+    try:
+        with open(menu_data_file_path, "rb") as menu_data_file:
+            return menu_data_file.read()
+    except FileNotFoundError:
+        return menu_archive.read_archived_menu(menu_id, week_number, year_number)
+
+
+def read_manifest() -> typing.Optional[dict]:
+    """Reads the manifest of this node, reusing the previously read manifest if the file has not changed.
+
+    :returns: The manifest, or None if no manifest has been published."""
+    global manifest_cache
+    try:
+        file_status = os.stat(REPLICATION_MANIFEST_FILEPATH)
+    except FileNotFoundError:
+        return None
+    file_identity = (file_status.st_ino, file_status.st_mtime_ns)
+    cached_manifest = manifest_cache
+    if cached_manifest is not None and cached_manifest[0] == file_identity:
+        return cached_manifest[1]
+    with manifest_cache_lock:
+        logger.debug("Reading replication manifest...")
+        manifest = read_json_from_file(REPLICATION_MANIFEST_FILEPATH)
+        manifest_cache = (file_identity, manifest)
+    return manifest
+
+
+def publish_manifest() -> dict:
+    """Publishes the manifest of this node. Only weeks whose fingerprint (see
+    menu_caching.get_week_fingerprints) has changed since the previous manifest are hashed again.
+
+    :returns: Statistics about the published manifest."""
+    previous_manifest = read_manifest()
+    if (
+        previous_manifest is None
+        or previous_manifest["format_version"] != MANIFEST_FORMAT_VERSION
+    ):
+        logger.info("Creating a new replication manifest...")
+        previous_manifest = {
+            "format_version": MANIFEST_FORMAT_VERSION,
+            "manifest_id": uuid.uuid4().hex,
+            "generation": 0,
+            "weeks": {},
+            "fingerprints": {},
+        }
+    generation = previous_manifest["generation"] + 1
+    weeks = dict(previous_manifest["weeks"])
+    previous_fingerprints = previous_manifest["fingerprints"]
+    week_fingerprints = menu_caching.get_week_fingerprints()
+    changed_weeks = 0
+    removed_weeks = 0
+    for week_key, fingerprint in week_fingerprints.items():
+        if previous_fingerprints.get(week_key) == fingerprint:
+            continue
+        menu_data = read_raw_week(*parse_week_key(week_key))
+        if menu_data is None:  # The week was removed after the fingerprints were taken
+            continue
+        menu_data_hash = hashlib.sha256(menu_data).hexdigest()
+        previous_entry = weeks.get(week_key)
+        # Weeks that were only touched or moved into an archive keep their generation
+        if previous_entry is None or previous_entry["sha256"] != menu_data_hash:
+            weeks[week_key] = {
+                "sha256": menu_data_hash,
+                "size": len(menu_data),
+                "generation": generation,
+            }
+            changed_weeks += 1
+    for week_key, entry in previous_manifest["weeks"].items():
+        if week_key not in week_fingerprints and entry["sha256"] is not None:
+            weeks[week_key] = {"sha256": None, "size": 0, "generation": generation}
+            removed_weeks += 1
+    if (
+        changed_weeks == 0
+        and removed_weeks == 0
+        and previous_manifest["generation"] != 0
+    ):
+        generation = previous_manifest["generation"]
+    logger.info(
+        f"Publishing replication manifest generation {generation} ({changed_weeks} changed and {removed_weeks} removed weeks)..."
+    )
+    write_json_to_file(
+        {
+            "format_version": MANIFEST_FORMAT_VERSION,
+            "manifest_id": previous_manifest["manifest_id"],
+            "generation": generation,
+            "published_at": get_now().timestamp(),
+            "weeks": weeks,
+            "fingerprints": week_fingerprints,
+        },
+        REPLICATION_MANIFEST_FILEPATH,
+    )
+    return {
+        "generation": generation,
+        "changed_weeks": changed_weeks,
+        "removed_weeks": removed_weeks,
+    }
+
+
+def get_manifest_changes(after_generation: int) -> typing.Optional[dict]:
+    """Gets the entries of the manifest of this node that changed after a certain generation.
+
+    :param after_generation: The generation that a follower last pulled (0 to get every entry).
+
+    :returns: The manifest ID and generation and the changed entries, or None if no manifest has been published.
+    """
+    manifest = read_manifest()
+    if manifest is None:
+        return None
+    return {
+        "manifest_id": manifest["manifest_id"],
+        "generation": manifest["generation"],
+        "weeks": {
+            week_key: entry
+            for week_key, entry in manifest["weeks"].items()
+            if entry["generation"] > after_generation
+        },
+    }
+
+
+def write_week(
+    menu_id: str, year_number: int, week_number: int, menu_data: bytes
+) -> None:
+    """Writes the menu data of a week pulled from the leader. The data is written to a temporary
+    file which is then moved into place, so readers never see a half-written week.
+
+    :param menu_id: The (string) menu ID.
+
+    :param year_number: The year of the week.
+
+    :param week_number: The week number.
+
+    :param menu_data: The menu data (the content of data.json)."""
+    cached_menu_directory = menu_caching.get_cached_menu_directory(
+        menu_id, week_number, year_number
+    )
+    os.makedirs(cached_menu_directory, exist_ok=True)
+    menu_data_file_path = os.path.join(cached_menu_directory, "data.json")
+    temporary_file_path = f"{menu_data_file_path}.{os.getpid()}.tmp"
+    with open(temporary_file_path, "wb") as menu_data_file:
+        menu_data_file.write(menu_data)
+    os.replace(temporary_file_path, menu_data_file_path)
+
+
+def remove_week(menu_id: str, year_number: int, week_number: int) -> bool:
+    """Removes a week that was removed on the leader.
+
+    :param menu_id: The (string) menu ID.
+
+    :param year_number: The year of the week.
+
+    :param week_number: The week number.
+
+    :returns: True if the week was removed, False if it did not exist. Archived weeks can't be
+    removed and are kept."""
+    cached_menu_directory = menu_caching.get_cached_menu_directory(
+        menu_id, week_number, year_number
+    )
+    if not os.path.isdir(cached_menu_directory):
+        return False
+    shutil.rmtree(cached_menu_directory)
+    return True
+
+
+def get_from_leader(
+    session: requests.Session, url: str, timeout: int
+) -> requests.Response:
+    """Sends a GET request to the leader, waiting and trying again if the leader rate limits the request.
+
+    :param session: The session to send the request with.
+
+    :param url: The URL to get.
+
+    :param timeout: The request timeout in seconds.
+
+    :raises requests.RequestException: If the request fails."""
+    for _ in range(MAXIMUM_RATE_LIMITED_RETRIES):
+        response = session.get(url, timeout=timeout)
+        if response.status_code != 429:
+            response.raise_for_status()
+            return response
+        retry_after = int(response.headers.get("Retry-After", 1))
+        logger.info(f"Rate limited by the leader. Waiting {retry_after} seconds...")
+        time.sleep(retry_after)
+    response.raise_for_status()
+    return response
+
+
+def pull(leader_url: str, full: bool = False, timeout: int = 30) -> dict:
+    """Pulls the weeks that changed on the leader since the previous pull.
+
+    :param leader_url: The base URL of the leader's API server, for example http://leader.example.com
+
+    :param full: Compare every week of the leader's manifest instead of only the changes since the previous pull.
+
+    :param timeout: The timeout of every request to the leader in seconds.
+
+    :returns: Statistics about the pull."""
+    leader_url = leader_url.rstrip("/")
+    replication_state = (
+        read_json_from_file(REPLICATION_STATE_FILEPATH)
+        if os.path.exists(REPLICATION_STATE_FILEPATH)
+        else {}
+    )
+    after_generation = 0
+    if not full and replication_state.get("leader_url") == leader_url:
+        after_generation = replication_state["generation"]
+    # Hash local changes first, so that weeks that are already up to date are not downloaded again
+    publish_manifest()
+    local_weeks = read_manifest()["weeks"]
+    session = requests.Session()
+    logger.info(
+        f"Getting changes after generation {after_generation} from {leader_url}..."
+    )
+    manifest_changes = get_from_leader(
+        session,
+        f"{leader_url}/api/replication/manifest?since={after_generation}",
+        timeout,
+    ).json()
+    if (
+        after_generation != 0
+        and manifest_changes["manifest_id"] != replication_state.get("manifest_id")
+    ) or manifest_changes["generation"] < after_generation:
+        logger.warning(
+            "The leader has published a new manifest. Comparing every week..."
+        )
+        after_generation = 0
+        manifest_changes = get_from_leader(
+            session, f"{leader_url}/api/replication/manifest?since=0", timeout
+        ).json()
+    statistics = {
+        "generation": manifest_changes["generation"],
+        "checked_weeks": len(manifest_changes["weeks"]),
+        "pulled_weeks": 0,
+        "pulled_bytes": 0,
+        "removed_weeks": 0,
+        "failed_weeks": 0,
+    }
+    changed_weeks = []
+    for week_key, entry in manifest_changes["weeks"].items():
+        local_entry = local_weeks.get(week_key)
+        if local_entry is not None and local_entry["sha256"] == entry["sha256"]:
+            continue
+        try:
+            menu_id, year_number, week_number = parse_week_key(week_key)
+        except ValueError:
+            logger.warning(f"Ignoring invalid week {week_key} from the leader.")
+            statistics["failed_weeks"] += 1
+            continue
+        if entry["sha256"] is None:
+            if remove_week(menu_id, year_number, week_number):
+                logger.info(f"Removed week {week_key}, which the leader removed.")
+                statistics["removed_weeks"] += 1
+                changed_weeks.append((menu_id, year_number, week_number))
+            continue
+        logger.info(f"Pulling week {week_key}...")
+        try:
+            menu_data = get_from_leader(
+                session,
+                f"{leader_url}/api/replication/weeks/{menu_id}/{year_number}/{week_number}",
+                timeout,
+            ).content
+        except requests.RequestException as e:
+            logger.warning(f"Failed to pull week {week_key}: {e}")
+            statistics["failed_weeks"] += 1
+            continue
+        if hashlib.sha256(menu_data).hexdigest() != entry["sha256"]:
+            # The week probably changed on the leader after the manifest was published.
+            # It is pulled on the next run.
+            logger.warning(f"Week {week_key} does not match its hash. Skipping...")
+            statistics["failed_weeks"] += 1
+            continue
+        write_week(menu_id, year_number, week_number, menu_data)
+        statistics["pulled_weeks"] += 1
+        statistics["pulled_bytes"] += len(menu_data)
+        changed_weeks.append((menu_id, year_number, week_number))
+    if len(changed_weeks) > 0:
+        for menu_id, year_number, week_number in changed_weeks:
+            change_notifications.publish_change(menu_id, week_number, year_number)
+        menu_snapshot.publish_snapshot()
+        publish_manifest()
+    # Weeks that failed are compared again on the next pull
+    if statistics["failed_weeks"] == 0:
+        write_json_to_file(
+            {
+                "leader_url": leader_url,
+                "manifest_id": manifest_changes["manifest_id"],
+                "generation": manifest_changes["generation"],
+                "pulled_at": get_now().timestamp(),
+            },
+            REPLICATION_STATE_FILEPATH,
+        )
+    logger.info(f"Pull from {leader_url} completed: {statistics}")
+    return statistics
+
+
+def get_replication_settings() -> typing.Tuple[bool, str, int]:
+    """Reads the replication settings from the [replication] section of the configuration.
+
+    :returns: A tuple of whether the downloader publishes the manifest, the URL of the leader
+    and the request timeout in seconds."""
+    config = ConfigParser()
+    config.read(CONFIG_FILEPATH)
+    publish_manifest_enabled = config.getboolean(
+        "replication", "publish_manifest", fallback=False
+    )
+    leader_url = config.get("replication", "leader_url", fallback="")
+    request_timeout = config.getint("replication", "request_timeout", fallback=30)
+    return publish_manifest_enabled, leader_url, request_timeout
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Replicates the menu cache from a leader node to follower nodes."
+    )
+    subparsers = argument_parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("publish", help="Publish the manifest of this node.")
+    pull_parser = subparsers.add_parser(
+        "pull", help="Pull the weeks that changed on the leader."
+    )
+    pull_parser.add_argument(
+        "--leader",
+        help="Base URL of the leader. Defaults to leader_url in the [replication] section of the configuration.",
+    )
+    pull_parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Compare every week of the leader instead of only the changes since the previous pull.",
+    )
+    arguments = argument_parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    _, leader_url, request_timeout = get_replication_settings()
+    if arguments.command == "publish":
+        print(json_codec.dumps(publish_manifest(), indent=True).decode("utf-8"))
+        return
+    leader_url = arguments.leader or leader_url
+    if leader_url == "":
+        argument_parser.error(
+            "No leader URL. Pass --leader or set leader_url in the [replication] section of the configuration."
+        )
+    statistics = pull(leader_url, full=arguments.full, timeout=request_timeout)
+    print(json_codec.dumps(statistics, indent=True).decode("utf-8"))
+    if statistics["failed_weeks"] > 0:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""run_reports.py
+Records a structured report of a downloader run: how long each phase took, how many bytes were
+downloaded and what happened to every menu. The reports of the latest runs are kept in status.json
+and exposed by the server at /api/status.
+"""
+import logging, time, contextlib, typing
+
+from shared_code import get_now, read_json_from_file, write_json_to_file
+
+logger = logging.getLogger(__name__)
+
+
+class RunReport:
+    """A report of a single downloader run."""
+
+    def __init__(self):
+        self.report = {
+            "started_at": get_now().timestamp(),
+            "finished_at": None,
+            "outcome": None,
+            "total_seconds": None,
+            "phases": [],
+            "menus": {},
+        }
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name: str, **details) -> typing.Iterator[dict]:
+        """Times a phase of the run. Use as a context manager. Details about the phase
+        (like the amount of bytes downloaded) can be added to the yielded dictionary.
+
+        :param name: The name of the phase, for example "fetch_menus".
+
+        :param details: Initial details about the phase, for example the menu the phase is for.
+        """
+        phase = {"name": name, **details}
+        phase_start = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            phase["seconds"] = round(time.perf_counter() - phase_start, 6)
+            self.report["phases"].append(phase)
+            logger.debug(f"Phase {name} took {phase['seconds']} seconds.")
+
+    def set_menu_result(self, menu_name: str, outcome: str, **details) -> None:
+        """Records what happened to a menu during the run.
+
+        :param menu_name: The menu name (string menu ID).
+
+        :param outcome: The outcome, for example "saved" or "not_available".
+
+        :param details: Additional details, for example the menu's payload size."""
+        self.report["menus"][menu_name.strip("/")] = {"outcome": outcome, **details}
+
+    def finish(
+        self, outcome: str, status_data_filepath: str, keep_run_reports: int
+    ) -> None:
+        """Finishes the report and saves it to the status file, keeping only the latest reports.
+
+        :param outcome: The outcome of the run, for example "success" or "http_error".
+
+        :param status_data_filepath: The path of the status file.
+
+        :param keep_run_reports: How many run reports to keep (0 keeps none)."""
+        self.report["outcome"] = outcome
+        self.report["finished_at"] = get_now().timestamp()
+        self.report["total_seconds"] = round(time.perf_counter() - self.start, 6)
+        status_content = read_json_from_file(status_data_filepath)
+        run_reports = status_content.get("runs", []) + [self.report]
+        first_kept_run_report = max(len(run_reports) - keep_run_reports, 0)
+        status_content["runs"] = run_reports[first_kept_run_report:]
+        write_json_to_file(status_content, status_data_filepath)
+        logger.info(
+            f"Run finished with outcome {outcome} in {self.report['total_seconds']} seconds."
+        )
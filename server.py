@@ -2,16 +2,30 @@
 Provides an API interface/server that allows one to retrieve menu data.
 Uses Flask as a backend.
 """
-import logging, datetime, pytz, os, json, menu_caching
+import logging, datetime, pytz, os, json, menu_caching, time, hashlib, threading
+import change_notifications, menu_events, rate_limiting, json_codec, field_projection
+import replication
 import traceback
 
 import werkzeug.exceptions
-from flask import Blueprint, jsonify, send_from_directory, render_template, request
+from flask import (
+    Blueprint,
+    Response,
+    jsonify,
+    send_from_directory,
+    send_file,
+    render_template,
+    request,
+    current_app,
+    make_response,
+    url_for,
+)
 from werkzeug.exceptions import HTTPException
 from shared_code import (
     EATERY_KISTA_NOD_MENU_ID,
     CONFIG_FILEPATH,
     statistics_data_file_path,
+    status_data_filepath,
     write_json_to_file,
     read_json_from_file,
     get_now,
@@ -39,6 +53,9 @@ SHOW_INDEX_FILE = (
 saved_menus = json.loads(
     config["downloader"]["save_menus"]
 )  # This is used for the index file
+MATERIALIZED_MENU_IDS = {
+    menu_name.strip("/") for menu_name in saved_menus
+}  # Only the configured menus get materialized current week and day responses
 HOST_EMAIL_ADDRESS = (
     config["server"]["host_email"] if "host_email" in config["server"] else None
 )  # Load contact email to server host
@@ -52,6 +69,64 @@ CUSTOM_INDEX_FILE = (
     if "custom_index_file" in config["server"]
     else None
 )  # Load a custom index file if configured
+INDEX_CACHE_SECONDS = (
+    int(config["server"]["index_cache_seconds"])
+    if "index_cache_seconds" in config["server"]
+    else 10
+)  # How long a rendered index page can be reused before it is rendered again
+MATERIALIZED_VIEW_CHECK_SECONDS = (
+    int(config["server"]["materialized_view_check_seconds"])
+    if "materialized_view_check_seconds" in config["server"]
+    else 5
+)  # How often to check whether a menu with materialized current week/day responses has been updated
+STREAM_HEARTBEAT_SECONDS = (
+    int(config["server"]["stream_heartbeat_seconds"])
+    if "stream_heartbeat_seconds" in config["server"]
+    else 15
+)  # How often to send keep-alive comments to clients of the menu change stream
+# Rate limiting configuration
+rate_limiting_config = (
+    config["rate_limiting"] if "rate_limiting" in config else {}
+)  # (rate limiting is disabled if the section is missing)
+RATE_LIMITING_ENABLED = (
+    config.getboolean("rate_limiting", "enabled")
+    if "enabled" in rate_limiting_config
+    else False
+)
+RATE_LIMIT_REQUESTS_PER_MINUTE = float(
+    rate_limiting_config.get("requests_per_minute", 60)
+)  # How many requests a client can make per minute and route
+RATE_LIMIT_BURST = int(
+    rate_limiting_config.get("burst", 30)
+)  # How many requests a client can make at once
+RATE_LIMIT_ROUTE_LIMITS = json.loads(
+    rate_limiting_config.get("route_limits", "{}")
+)  # Custom limits per route, mapping a route (like "/api/") to [requests per minute, burst]
+RATE_LIMIT_TRUST_FORWARDED_FOR = (
+    config.getboolean("rate_limiting", "trust_forwarded_for")
+    if "trust_forwarded_for" in rate_limiting_config
+    else False
+)  # Whether to identify clients by the X-Forwarded-For header (only enable behind a reverse proxy)
+# Validate the rate limits on startup rather than failing on requests
+rate_limiting.validate_limit(RATE_LIMIT_REQUESTS_PER_MINUTE, RATE_LIMIT_BURST)
+if not isinstance(RATE_LIMIT_ROUTE_LIMITS, dict):
+    raise ValueError("route_limits must be a JSON object mapping routes to limits.")
+for route, route_limit in RATE_LIMIT_ROUTE_LIMITS.items():
+    if (
+        not isinstance(route_limit, list)
+        or len(route_limit) != 2
+        or not all(isinstance(value, (int, float)) for value in route_limit)
+    ):
+        raise ValueError(
+            f"Invalid limit for route {route}: {route_limit} (must be [requests per minute, burst])."
+        )
+    rate_limiting.validate_limit(*route_limit)
+STATIC_FILES_MAX_AGE = (
+    60 * 60 * 24 * 365
+)  # Versioned static files never change, so they can be cached for a year
+# How many changes the change feed returns per page by default, and at most
+CHANGES_DEFAULT_LIMIT = 100
+CHANGES_MAXIMUM_LIMIT = 1000
 
 if HOST_EMAIL_ADDRESS == None:
     logger.warning(
@@ -108,13 +183,77 @@ def generate_api_error_response(error_message, status_code):
     return generate_api_response("error", {"message": error_message}, status_code)
 
 
+def select_menu_data(menu_data, field_tree=None, include_revisions=False):
+    """Selects the parts of cached menu data to return to a client. The selected data is
+    built from new dictionaries that reference the menu data, so the menu data is never copied or modified.
+
+    :param menu_data: The cached menu data.
+
+    :param field_tree: The fields of the menu to return (see field_projection), or None to return the whole menu.
+
+    :param include_revisions: Whether to include the previous revisions of the menu (projected using the same fields).
+    """
+    selected_menu_data = {}
+    for key, value in menu_data.items():
+        if key == "menu" and field_tree is not None:
+            value = field_projection.project(value, field_tree)
+        elif key == "previous_revisions":
+            if not include_revisions:
+                continue
+            if field_tree is not None:
+                value = [
+                    {
+                        **revision,
+                        "previous_data": field_projection.project(
+                            revision["previous_data"], field_tree
+                        ),
+                    }
+                    for revision in value
+                ]
+        selected_menu_data[key] = value
+    return selected_menu_data
+
+
+def parse_projection_arguments():
+    """Parses the fields and include_revisions query parameters of the current request.
+
+    :returns: A tuple of an error message (None if the parameters are valid), the field tree
+    (None if no fields were requested) and whether previous revisions should be included.
+    """
+    field_tree = None
+    if "fields" in request.args:
+        try:
+            field_tree = field_projection.parse_fields(request.args["fields"])
+        except ValueError as e:
+            return f"Invalid fields ({e})", None, False
+    include_revisions = request.args.get("include_revisions", "false").lower()
+    if include_revisions not in ["true", "false", "1", "0"]:
+        return "Invalid include_revisions (must be true or false)", None, False
+    return None, field_tree, include_revisions in ["true", "1"]
+
+
+def has_projection_arguments():
+    """Checks whether the current request has query parameters that change which parts of a menu are returned."""
+    return "fields" in request.args or "include_revisions" in request.args
+
+
 def generate_api_response_for(
-    menu_name, week_number, day_number=None, year_number=None
+    menu_name,
+    week_number,
+    day_number=None,
+    year_number=None,
+    field_tree=None,
+    include_revisions=False,
 ):
     """Generates an API response for a specific menu ID and a
-    specific week number."""
+    specific week number. Previous revisions of the menu are only included if requested.
+
+    :param field_tree: The fields of the menu to return (see field_projection), or None for the whole menu.
+    For a day, the day is taken from the projected days of the menu.
+
+    :param include_revisions: Whether to include the previous revisions of the menu."""
     if year_number is None:
-        year_number = get_now().year
+        year_number = get_now().isocalendar()[0]
     logger.info(
         f"Generating API response for menu id {menu_name}, week number {week_number}, day name {day_number}, year number {year_number}..."
     )
@@ -125,13 +264,17 @@ def generate_api_response_for(
     ):  # This is done to match the format of the configuration files. It's not smart to have slashes to fill out the ID in a URL :)
         menu_name = f"/{menu_name}"
     # Retrieve menu
-    requested_menu = menu_caching.get_cached_menu(menu_name, week_number, year_number)
+    # The menu data is only read, so it doesn't have to be copied
+    requested_menu = menu_caching.get_cached_menu(
+        menu_name, week_number, year_number, read_only=True
+    )
     if requested_menu is not None:
         logger.info("Menu is available. Returning response...")
         # If a specific day hasn't been requested...
         if day_number is None:
             return generate_api_response(
-                "success", requested_menu
+                "success",
+                select_menu_data(requested_menu, field_tree, include_revisions),
             )  # ...return the full menu
         else:
             logger.debug("Custom day has been specified! Checking and returning...")
@@ -155,12 +298,18 @@ def generate_api_response_for(
                 )
             else:
                 logger.info("Custom day is available!")
-                day_data = requested_menu["menu"]["days"][requested_day_key]
-                del requested_menu["menu"][
-                    "days"
-                ]  # Remove day data but keep everything else for the response
+                menu_info = select_menu_data(
+                    requested_menu, field_tree, include_revisions
+                )
+                day_data = menu_info["menu"].get("days", {}).get(requested_day_key, {})
+                # Remove day data but keep everything else for the response
+                menu_info["menu"] = {
+                    key: value
+                    for key, value in menu_info["menu"].items()
+                    if key != "days"
+                }
                 return generate_api_response(
-                    "success", {"menu_info": requested_menu, "day_menu": day_data}
+                    "success", {"menu_info": menu_info, "day_menu": day_data}
                 )  # Get the menu for that day
     else:
         logger.info("Menu is not available. Returning error response...")
@@ -175,6 +324,240 @@ def generate_api_response_for(
             )
 
 
+def render_full_week_response(menu_data):
+    """Renders the default full week API response (without previous revisions) for menu data
+    into bytes, exactly as jsonify would have returned it.
+
+    :param menu_data: The menu data to render."""
+    return current_app.json.response(
+        generate_api_response("success", select_menu_data(menu_data))
+    ).get_data()
+
+
+def send_full_week_response_file(menu_name, week_number, year_number=None):
+    """Sends the full week API response for a menu straight from a stored response
+    file on disk, letting the WSGI server send the file (using sendfile if supported)
+    without the payload passing through Python. Content-Length, ETag and Last-Modified
+    are taken from the file metadata.
+
+    :returns: A response, or None if the response can't be served from a file
+    (numeric menu IDs or menus that are not available). Use generate_api_response_for in that case.
+    """
+    if year_number is None:
+        year_number = get_now().isocalendar()[0]
+    if menu_name.isdigit():
+        return None
+    response_file_path = menu_caching.get_cached_menu_response_file(
+        menu_name, week_number, year_number, render_full_week_response
+    )
+    if response_file_path is None:
+        return None
+    logger.info(f"Sending response file {response_file_path}...")
+    try:
+        return send_file(
+            response_file_path,
+            mimetype="application/json",
+            conditional=True,
+            etag=True,
+        )
+    except FileNotFoundError:
+        # The data file changed and another worker replaced the response file in the meantime
+        return None
+
+
+class MaterializedView:
+    """Pre-rendered responses for the current week and each day of the current week for a menu.
+    A view is valid until the next midnight in Stockholm (which is also when the week rolls over)
+    or until the menu's data file changes, after which it is rebuilt."""
+
+    __slots__ = (
+        "week_response",
+        "day_responses",
+        "today",
+        "week_number",
+        "year_number",
+        "valid_until",
+        "data_file_path",
+        "data_file_modified_at",
+        "checked_at",
+    )
+
+    def __init__(self, menu_name):
+        """Builds the materialized view.
+
+        :param menu_name: The menu name (string menu ID) to build the view for."""
+        now = get_now()
+        year_number, week_number = now.isocalendar()[:2]
+        logger.info(
+            f"Materializing current week and day responses for {menu_name} (week {week_number}, {year_number})..."
+        )
+        self.data_file_path = os.path.join(
+            menu_caching.get_cached_menu_directory(menu_name, week_number, year_number),
+            "data.json",
+        )
+        # Grab the modification time before the data is read, so that changes made while building are detected
+        self.data_file_modified_at = get_file_modified_at(self.data_file_path)
+        self.week_response = render_materialized_response(
+            generate_api_response_for(menu_name, week_number, year_number=year_number)
+        )
+        self.day_responses = {
+            day_number: render_materialized_response(
+                generate_api_response_for(
+                    menu_name, week_number, day_number, year_number
+                )
+            )
+            for day_number in range(1, len(day_names_to_json_keys) + 1)
+        }
+        self.today = now.isoweekday()
+        self.week_number = week_number
+        self.year_number = year_number
+        next_midnight = datetime.datetime.combine(
+            (now + datetime.timedelta(days=1)).date(), datetime.time()
+        )
+        self.valid_until = (
+            pytz.timezone("Europe/Stockholm").localize(next_midnight).timestamp()
+        )
+        self.checked_at = time.monotonic()
+
+
+materialized_views = {}  # Maps menu names to their MaterializedView
+materialized_views_lock = threading.Lock()
+# Notified when a new menu event has been logged (see menu_events). The notification count is increased
+# under the same lock, so that streams that are busy reading events when notified don't miss the notification.
+menu_events_condition = threading.Condition()
+menu_events_notification_count = 0
+
+
+def get_file_modified_at(file_path):
+    """Gets the modification time of a file in nanoseconds, or None if the file does not exist.
+
+    :param file_path: The path of the file."""
+    try:
+        return os.stat(file_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def render_materialized_response(response):
+    """Renders an API response into a tuple of the response body (as bytes) and the status code,
+    which is what is stored in materialized views.
+
+    :param response: The response generated by generate_api_response."""
+    return current_app.json.response(response).get_data(), response["status_code"]
+
+
+def get_materialized_view(menu_name):
+    """Gets the materialized view for a menu, building it if it does not exist or has expired.
+
+    :param menu_name: The menu name (string menu ID) to get the view for."""
+    menu_name = menu_name.strip("/")
+    materialized_view = materialized_views.get(menu_name)
+    if materialized_view is not None and time.time() < materialized_view.valid_until:
+        if (
+            time.monotonic() - materialized_view.checked_at
+            < MATERIALIZED_VIEW_CHECK_SECONDS
+        ):
+            return materialized_view
+        # Check whether the downloader has stored new menu data
+        if (
+            get_file_modified_at(materialized_view.data_file_path)
+            == materialized_view.data_file_modified_at
+        ):
+            materialized_view.checked_at = time.monotonic()
+            return materialized_view
+    with materialized_views_lock:
+        # Another thread might have rebuilt the view while we waited for the lock, or a change
+        # notification might have dropped it
+        current_materialized_view = materialized_views.get(menu_name)
+        if (
+            current_materialized_view is None
+            or current_materialized_view is materialized_view
+        ):
+            current_materialized_view = MaterializedView(menu_name)
+            materialized_views[menu_name] = current_materialized_view
+        return current_materialized_view
+
+
+def handle_change_notification(notification):
+    """Drops in-memory data affected by a change notification from the downloader,
+    so that it is rebuilt on the next request.
+
+    :param notification: The notification (see change_notifications.publish_change)."""
+    with materialized_views_lock:
+        materialized_view = materialized_views.get(notification["menu_id"])
+        if materialized_view is not None and (
+            materialized_view.week_number,
+            materialized_view.year_number,
+        ) == (notification["week_number"], notification["year_number"]):
+            logger.info(
+                f"Dropping materialized view for {notification['menu_id']} since it changed."
+            )
+            del materialized_views[notification["menu_id"]]
+    # Wake up clients of the menu change stream if a change was logged
+    if notification.get("event_id") is not None:
+        global menu_events_notification_count
+        with menu_events_condition:
+            menu_events_notification_count += 1
+            menu_events_condition.notify_all()
+
+
+change_notifications.add_listener(handle_change_notification)
+
+
+@app.before_app_request
+def apply_rate_limits():
+    """Rate limits clients per IP address and route using token buckets (see rate_limiting)."""
+    if (
+        not RATE_LIMITING_ENABLED
+        or request.url_rule is None
+        or request.endpoint == "static"
+    ):
+        return None
+    if RATE_LIMIT_TRUST_FORWARDED_FOR and "X-Forwarded-For" in request.headers:
+        # Use the address that the reverse proxy appended. The entries before it are sent by
+        # the client, which could otherwise pick a new address for every request.
+        client_address = request.headers["X-Forwarded-For"].split(",")[-1].strip()
+    else:
+        client_address = request.remote_addr
+    route = request.url_rule.rule
+    requests_per_minute, burst = RATE_LIMIT_ROUTE_LIMITS.get(
+        route, (RATE_LIMIT_REQUESTS_PER_MINUTE, RATE_LIMIT_BURST)
+    )
+    allowed, retry_after = rate_limiting.take_token(
+        f"{client_address} {route}", requests_per_minute, burst
+    )
+    if allowed:
+        return None
+    logger.info(f"Rate limiting {client_address} on {route}.")
+    response = generate_api_error_response(
+        "Too many requests. Please slow down and try again later.",
+        HTTPStatus.TOO_MANY_REQUESTS,
+    )
+    return (
+        jsonify(response),
+        HTTPStatus.TOO_MANY_REQUESTS,
+        {"Retry-After": str(retry_after)},
+    )
+
+
+@app.before_app_request
+def listen_for_changes():
+    """Makes sure that this worker listens for change notifications from the downloader.
+    If it can't, changes are still detected by periodic checks."""
+    change_notifications.ensure_listening()
+
+
+def send_materialized_response(materialized_response):
+    """Sends a response stored in a materialized view.
+
+    :param materialized_response: The response as returned by render_materialized_response.
+    """
+    response_body, status_code = materialized_response
+    return current_app.response_class(
+        response_body, status=status_code, mimetype=current_app.json.mimetype
+    )
+
+
 def timestamp_to_local_time(timestamp_str):
     """Converts a timestamp from a timestamp string to local Swedish time."""
     return datetime.datetime.fromisoformat(timestamp_str).astimezone(
@@ -226,24 +609,83 @@ def increase_statistics_file_api_count():
 
 
 # Static endpoints
+static_file_hashes = (
+    {}
+)  # Maps static filenames to a hash of their content (or None if the file does not exist)
+
+
+@app.app_template_global()
+def static_url(filename):
+    """Gets the URL to a static file, including a hash of the file content. Since the URL changes
+    whenever the file does, the file can be cached by clients for a long time.
+
+    :param filename: The filename of the static file, relative to the static directory.
+    """
+    if filename not in static_file_hashes:
+        static_file_path = os.path.join(current_app.static_folder, filename)
+        if os.path.exists(static_file_path):
+            with open(static_file_path, "rb") as static_file:
+                static_file_hashes[filename] = hashlib.md5(
+                    static_file.read()
+                ).hexdigest()[:12]
+        else:
+            logger.info(f"Static file {filename} does not exist. Not versioning it.")
+            static_file_hashes[filename] = None
+    if static_file_hashes[filename] is None:
+        return url_for("static", filename=filename)
+    return url_for("static", filename=filename, v=static_file_hashes[filename])
+
+
+@app.after_app_request
+def add_static_cache_headers(response):
+    """Adds long-lived cache headers to versioned static files (see static_url)."""
+    if request.endpoint == "static" and "v" in request.args:
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_FILES_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
 if SHOW_INDEX_FILE:
+    cached_index_page = (
+        None  # A tuple of the rendered index page, its ETag and when it was rendered
+    )
 
     @app.route("/")
     def index():
-        """Index page."""
+        """Index page. The rendered page is reused for INDEX_CACHE_SECONDS, since statistics
+        that are a few seconds old are fine."""
+        global cached_index_page
         logger.info("Got a request to the index. Returning...")
-        statistics_data = (
-            read_json_from_file(statistics_data_file_path)
-            if STATISTICS_FILE_ENABLED
-            else None
-        )  # Load statistics data
-        return render_template(
-            "index.html" if not CUSTOM_INDEX_FILE else CUSTOM_INDEX_FILE,
-            saved_menus_list=saved_menus,
-            default_menu_id=EATERY_KISTA_NOD_MENU_ID,
-            host_email_address=HOST_EMAIL_ADDRESS,
-            statistics_data=statistics_data,
-        )  # Render index file, passing dynamic content
+        if (
+            cached_index_page is None
+            or time.monotonic() - cached_index_page[2] >= INDEX_CACHE_SECONDS
+        ):
+            logger.info("Rendering index page...")
+            statistics_data = (
+                read_json_from_file(statistics_data_file_path)
+                if STATISTICS_FILE_ENABLED
+                else None
+            )  # Load statistics data
+            index_html = render_template(
+                "index.html" if not CUSTOM_INDEX_FILE else CUSTOM_INDEX_FILE,
+                saved_menus_list=saved_menus,
+                default_menu_id=EATERY_KISTA_NOD_MENU_ID,
+                host_email_address=HOST_EMAIL_ADDRESS,
+                statistics_data=statistics_data,
+            )  # Render index file, passing dynamic content
+            cached_index_page = (
+                index_html,
+                hashlib.md5(index_html.encode("utf-8")).hexdigest(),
+                time.monotonic(),
+            )
+        index_html, index_etag, _ = cached_index_page
+        response = make_response(index_html)
+        response.set_etag(index_etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = INDEX_CACHE_SECONDS
+        return response.make_conditional(request)
 
 else:
     logger.info(
@@ -256,16 +698,26 @@ else:
 def api():
     """General API. Returns the Eatery Kista Nod menu
     for the current week."""
-    logger.info("Got a request to the general API! Generating response...")
+    logger.info("Got a request to the general API! Returning materialized response...")
     increase_statistics_file_api_count()
-    # Get current week
-    now = get_now()
-    current_week = now.isocalendar()[1]
-    logger.info(f"Current week: {current_week}")
-    # Generate response
-    response = generate_api_response_for(EATERY_KISTA_NOD_MENU_ID, current_week)
-    logger.info(f"Response retrieved: {response}. Returning...")
-    return jsonify(response), response["status_code"]  # Return the response
+    if has_projection_arguments():
+        logger.debug("Projection requested. Generating response...")
+        error_message, field_tree, include_revisions = parse_projection_arguments()
+        if error_message is not None:
+            return (
+                generate_api_error_response(error_message, HTTPStatus.BAD_REQUEST),
+                HTTPStatus.BAD_REQUEST,
+            )
+        response = generate_api_response_for(
+            EATERY_KISTA_NOD_MENU_ID,
+            get_now().isocalendar()[1],
+            field_tree=field_tree,
+            include_revisions=include_revisions,
+        )
+        return jsonify(response), response["status_code"]
+    return send_materialized_response(
+        get_materialized_view(EATERY_KISTA_NOD_MENU_ID).week_response
+    )
 
 
 @app.route("/api/<string:menu_id>/<int:week_number>")
@@ -289,18 +741,126 @@ def specific_api(menu_id, week_number):
             )
         logger.debug("Custom year provided. Using...")
         year_number = year_number_int
+    error_message, field_tree, include_revisions = parse_projection_arguments()
+    if error_message is not None:
+        logger.info(f"Invalid projection arguments: {error_message}.")
+        return (
+            generate_api_error_response(error_message, HTTPStatus.BAD_REQUEST),
+            HTTPStatus.BAD_REQUEST,
+        )
+    # Send the stored response file if available (it holds the default response)
+    if not has_projection_arguments():
+        response_file = send_full_week_response_file(menu_id, week_number, year_number)
+        if response_file is not None:
+            return response_file
     # Generate response
-    response = generate_api_response_for(menu_id, week_number, year_number=year_number)
+    response = generate_api_response_for(
+        menu_id,
+        week_number,
+        year_number=year_number,
+        field_tree=field_tree,
+        include_revisions=include_revisions,
+    )
     logger.info(f"Response retrieved: {response}. Returning...")
     return jsonify(response), response["status_code"]  # Return the response
 
 
+def send_resolved_week_response(menu_id, resolved_week):
+    """Sends the full week API response for a week that an alias (like "latest") resolved to.
+    The canonical URL of the week is sent in the Content-Location header.
+
+    :param menu_id: The menu ID.
+
+    :param resolved_week: The resolved week as a (year, week) pair, or None if the menu has no cached weeks.
+    """
+    error_message, field_tree, include_revisions = parse_projection_arguments()
+    if error_message is not None:
+        logger.info(f"Invalid projection arguments: {error_message}.")
+        return (
+            generate_api_error_response(error_message, HTTPStatus.BAD_REQUEST),
+            HTTPStatus.BAD_REQUEST,
+        )
+    if resolved_week is None:
+        logger.info(f"No cached weeks for menu {menu_id}. Returning error...")
+        return (
+            generate_api_error_response(
+                "Menu is not available (no weeks are cached for it).",
+                HTTPStatus.NOT_FOUND,
+            ),
+            HTTPStatus.NOT_FOUND,
+        )
+    year_number, week_number = resolved_week
+    logger.info(f"Resolved to week {week_number}, {year_number}.")
+    response = None
+    if not has_projection_arguments():
+        response = send_full_week_response_file(menu_id, week_number, year_number)
+    if response is None:
+        api_response = generate_api_response_for(
+            menu_id,
+            week_number,
+            year_number=year_number,
+            field_tree=field_tree,
+            include_revisions=include_revisions,
+        )
+        response = make_response(jsonify(api_response), api_response["status_code"])
+    response.headers["Content-Location"] = url_for(
+        ".specific_api", menu_id=menu_id, week_number=week_number, year=year_number
+    )
+    return response
+
+
+@app.route("/api/<string:menu_id>/latest")
+def latest_week_api(menu_id):
+    """Latest week API. Returns the latest cached week for a menu."""
+    logger.info("Got a request to the latest week API! Generating response...")
+    increase_statistics_file_api_count()
+    return send_resolved_week_response(menu_id, menu_caching.get_latest_week(menu_id))
+
+
+@app.route("/api/<string:menu_id>/nearest")
+def nearest_week_api(menu_id):
+    """Nearest week API. Returns the cached week for a menu that is nearest to the current week,
+    or to the week passed using the week (and optionally year) parameters."""
+    logger.info("Got a request to the nearest week API! Generating response...")
+    increase_statistics_file_api_count()
+    year_number, week_number = get_now().isocalendar()[:2]
+    for parameter in ["year", "week"]:
+        if parameter in request.args:
+            parameter_valid_int, parameter_int = validate_integer(
+                request.args[parameter]
+            )
+            if not parameter_valid_int:
+                logger.info(f"Invalid {parameter} number ({request.args[parameter]}).")
+                return (
+                    generate_api_error_response(
+                        f"Invalid {parameter} number (must be an valid integer)",
+                        HTTPStatus.BAD_REQUEST,
+                    ),
+                    HTTPStatus.BAD_REQUEST,
+                )
+            if parameter == "year":
+                year_number = parameter_int
+            else:
+                week_number = parameter_int
+    try:
+        nearest_week = menu_caching.get_nearest_week(menu_id, year_number, week_number)
+    except ValueError:  # The week does not exist in the year
+        logger.info(f"Invalid week {week_number}, {year_number}.")
+        return (
+            generate_api_error_response(
+                f"Invalid week number (week {week_number} does not exist in {year_number})",
+                HTTPStatus.BAD_REQUEST,
+            ),
+            HTTPStatus.BAD_REQUEST,
+        )
+    return send_resolved_week_response(menu_id, nearest_week)
+
+
 @app.route("/api/<string:menu_id>/<string:week_number>/<string:day_number>/")
 def specific_day_api(menu_id, week_number, day_number):
     """Specific day API. Allows one to specify the menu ID, the week number, and the day ID to retrieve."""
     logger.info("Got a request to the specific day API! Generating response...")
     increase_statistics_file_api_count()
-    now = get_now()
     # Check for a custom year
     # Validate custom year number if provided
     year_number = None
@@ -318,6 +878,35 @@ def specific_day_api(menu_id, week_number, day_number):
             )
         logger.debug("Custom year provided. Using...")
         year_number = year_number_int
+    error_message, field_tree, include_revisions = parse_projection_arguments()
+    if error_message is not None:
+        logger.info(f"Invalid projection arguments: {error_message}.")
+        return (
+            generate_api_error_response(error_message, HTTPStatus.BAD_REQUEST),
+            HTTPStatus.BAD_REQUEST,
+        )
+    # Validate the day number
+    day_number_valid_int, day_number_int = validate_integer(day_number)
+    # The current week is materialized for the configured menus, so return it right away if requested.
+    # (other menu IDs take the normal path, so that requests can't fill the memory with views)
+    if (
+        week_number == "now"
+        and year_number is None
+        and field_tree is None
+        and not include_revisions
+        and menu_id.strip("/") in MATERIALIZED_MENU_IDS
+        and (
+            day_number == "today" or (day_number_valid_int and 1 <= day_number_int <= 7)
+        )
+    ):
+        logger.debug("Returning materialized response for the current week...")
+        materialized_view = get_materialized_view(menu_id)
+        return send_materialized_response(
+            materialized_view.day_responses[
+                materialized_view.today if day_number == "today" else day_number_int
+            ]
+        )
+    now = get_now()
     # Validate the week number
     week_number_valid_int, week_number_int = validate_integer(week_number)
     if week_number == "now":  # Special feature: pass "now" to get the current week
@@ -333,8 +922,6 @@ def specific_day_api(menu_id, week_number, day_number):
         )
     else:
         week_number = week_number_int
-    # Validate the day number
-    day_number_valid_int, day_number_int = validate_integer(day_number)
     if day_number == "today":  # Special feature: pass "today" to get the current day
         logger.debug("Applying day for today...")
         day_number = now.isoweekday()
@@ -350,17 +937,165 @@ def specific_day_api(menu_id, week_number, day_number):
         day_number = day_number_int
     logger.debug("Day number is valid. Generating response...")
     # Generate response
-    response = generate_api_response_for(menu_id, week_number, day_number, year_number)
+    response = generate_api_response_for(
+        menu_id,
+        week_number,
+        day_number,
+        year_number,
+        field_tree=field_tree,
+        include_revisions=include_revisions,
+    )
     logger.info(f"Response retrieved: {response}. Returning...")
     return jsonify(response), response["status_code"]  # Return the response
 
 
+@app.route("/api/stream")
+def menu_changes_stream():
+    """Menu change stream. Sends Server-Sent Events whenever a menu that the client has subscribed to
+    (using the "menus" parameter, a comma-separated list of menu IDs) gets a new week or a new revision.
+    Supports resuming using the Last-Event-ID header (or the last_event_id parameter).
+
+    NOTE: every open stream occupies a worker with the default (sync) Gunicorn worker class,
+    so the server should be run with the gevent worker class (see systemd_services/start_menu_api.sh).
+    """
+    logger.info("Got a request to the menu change stream.")
+    # Streams are not counted in the statistics: they are long-lived, and reconnecting clients
+    # would otherwise be counted as many requests.
+    subscribed_menu_ids = {
+        menu_id.strip().strip("/")
+        for menu_id in request.args.get("menus", "").split(",")
+        if len(menu_id.strip().strip("/")) > 0
+    }
+    if len(subscribed_menu_ids) == 0:
+        logger.info("No menus to subscribe to were passed.")
+        return (
+            generate_api_error_response(
+                "Pass the menus to subscribe to (comma-separated) in the menus parameter.",
+                HTTPStatus.BAD_REQUEST,
+            ),
+            HTTPStatus.BAD_REQUEST,
+        )
+    last_event_id = request.headers.get(
+        "Last-Event-ID", request.args.get("last_event_id")
+    )
+    if last_event_id is not None:
+        last_event_id_valid_int, last_event_id = validate_integer(last_event_id)
+        if not last_event_id_valid_int:
+            logger.info("Invalid last event ID.")
+            return (
+                generate_api_error_response(
+                    "Invalid last event ID (must be an valid integer)",
+                    HTTPStatus.BAD_REQUEST,
+                ),
+                HTTPStatus.BAD_REQUEST,
+            )
+    else:
+        last_event_id = menu_events.get_last_event_id()  # Only send new events
+
+    def generate_events(last_event_id):
+        yield "retry: 5000\n\n"  # Tell clients to reconnect after 5 seconds if disconnected
+        while True:
+            with menu_events_condition:
+                seen_notification_count = menu_events_notification_count
+            for event in menu_events.read_events(last_event_id):
+                last_event_id = event["id"]
+                if event["menu_id"] in subscribed_menu_ids:
+                    yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json_codec.dumps(event).decode('utf-8')}\n\n"
+            # Wait for new events. Events are also checked for after every heartbeat, in case
+            # change notifications are not available.
+            # Notifications that arrived while reading are detected through the notification count.
+            with menu_events_condition:
+                notified = menu_events_condition.wait_for(
+                    lambda: menu_events_notification_count != seen_notification_count,
+                    STREAM_HEARTBEAT_SECONDS,
+                )
+            # Yield outside of the lock, so that a slow client doesn't block other streams
+            if not notified:
+                yield ": keep-alive\n\n"
+
+    response = Response(generate_events(last_event_id), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Disable buffering in nginx
+    return response
+
+
+@app.route("/api/changes")
+def menu_changes_api():
+    """Change feed API. Returns the weeks that were added or changed after a cursor (the "since" parameter),
+    oldest first, so that clients mirroring the menus only have to fetch what changed. The feed only covers
+    changes logged since the change log was introduced, so clients first take a full copy of the menus and
+    then continue from the latest_cursor that was returned before the copy was taken.
+    Pass the returned next_cursor as the cursor of the next request. Supports filtering on menus using the
+    "menus" parameter (a comma-separated list of menu IDs) and the page size using the "limit" parameter.
+    """
+    logger.info("Got a request to the change feed API. Generating response...")
+    increase_statistics_file_api_count()
+    integer_parameters = {"since": 0, "limit": CHANGES_DEFAULT_LIMIT}
+    for parameter_name in integer_parameters:
+        if parameter_name not in request.args:
+            continue
+        parameter_valid_int, parameter_int = validate_integer(
+            request.args[parameter_name]
+        )
+        if not parameter_valid_int or parameter_int < 0:
+            logger.info(f"Invalid {parameter_name} ({request.args[parameter_name]}).")
+            return (
+                generate_api_error_response(
+                    f"Invalid {parameter_name} (must be a valid non-negative integer)",
+                    HTTPStatus.BAD_REQUEST,
+                ),
+                HTTPStatus.BAD_REQUEST,
+            )
+        integer_parameters[parameter_name] = parameter_int
+    cursor = integer_parameters["since"]
+    limit = min(max(integer_parameters["limit"], 1), CHANGES_MAXIMUM_LIMIT)
+    last_event_id = menu_events.get_last_event_id()
+    if cursor > last_event_id:
+        # The cursor is from another server or from before the change log was reset
+        logger.info(f"Unknown change feed cursor ({cursor}).")
+        response = generate_api_error_response(
+            "Unknown cursor. Take a new copy of the menus and continue from latest_cursor.",
+            HTTPStatus.GONE,
+        )
+        response["latest_cursor"] = last_event_id
+        return response, HTTPStatus.GONE
+    menu_ids = {
+        menu_id.strip().strip("/")
+        for menu_id in request.args.get("menus", "").split(",")
+        if len(menu_id.strip().strip("/")) > 0
+    }
+    changes = []
+    for event in menu_events.read_events(cursor, limit):
+        cursor = event["id"]
+        if len(menu_ids) > 0 and event["menu_id"] not in menu_ids:
+            continue
+        # The menu is left out to keep pages small. Clients fetch the weeks they care about from the URL.
+        change = {key: value for key, value in event.items() if key != "menu"}
+        change["url"] = url_for(
+            ".specific_api",
+            menu_id=event["menu_id"],
+            week_number=event["week_number"],
+            year=event["year_number"],
+        )
+        changes.append(change)
+    response = generate_api_response(
+        "success",
+        {
+            "changes": changes,
+            "next_cursor": cursor,
+            "has_more": cursor < last_event_id,
+            "latest_cursor": last_event_id,
+        },
+    )
+    return jsonify(response)
+
+
 @app.route("/api/available_menus")
 def available_menus_api():
     """Available menus API. Returns the available menus and their saved weeks."""
     logger.info("Got a request to the available menus API. Generating response...")
     menus_data = {"available_menus": {}}
-    year_number = get_now().year
+    year_number = get_now().isocalendar()[0]
     # Validate custom year number if provided
     if "year" in request.args:
         custom_year = request.args["year"]
@@ -378,30 +1113,92 @@ def available_menus_api():
         year_number = year_number_int
     menus_data["year"] = year_number
     for menu_id in os.listdir(CACHED_MENUS_DIRECTORY):  # For all menus
-        menu_path = os.path.join(CACHED_MENUS_DIRECTORY, menu_id)
-        available_weeks = []
-        for cached_week in os.listdir(menu_path):  # For all cached weeks in each menu
-            week, year = cached_week.split("-")
-            week_number = int(week)
-            if not year == str(year_number):
-                continue
-            week_path = menu_caching.get_cached_menu_directory(
-                menu_id, week_number, year_number
-            )
-            # Validate that menu data file exists
-            menu_data_file = os.path.join(week_path, "data.json")
-            if os.path.exists(menu_data_file):
-                available_weeks.append(week_number)
-            else:
-                logger.warning(
-                    f"Directory but no data file available for menu {menu_id}, week {week}."
-                )
+        # Get all cached weeks (including archived ones) in each menu
+        available_weeks = menu_caching.get_available_weeks(menu_id, year_number)
         menus_data["available_menus"][menu_id] = {"available_weeks": available_weeks}
     logger.info("Done iterating over menus. Returning response...")
     response = generate_api_response("success", menus_data)
     return jsonify(response)
 
 
+@app.route("/api/status")
+def status_api():
+    """Status API. Returns when the menus were last updated and reports of the latest downloader runs
+    (how long each phase took, how much was downloaded and what happened to every menu).
+    """
+    logger.info("Got a request to the status API. Generating response...")
+    status_content = (
+        read_json_from_file(status_data_filepath)
+        if os.path.exists(status_data_filepath)
+        else {}
+    )
+    response = generate_api_response(
+        "success",
+        {
+            "menus_last_updated_at": status_content.get("menus_last_updated_at"),
+            "runs": status_content.get("runs", []),
+        },
+    )
+    return jsonify(response)
+
+
+@app.route("/api/replication/manifest")
+def replication_manifest_api():
+    """Replication manifest API. Returns the hashes of the cached weeks that changed after the
+    generation passed in ?since= (see replication.py)."""
+    logger.info("Got a request to the replication manifest API. Generating response...")
+    after_generation = 0
+    if "since" in request.args:
+        since_valid_int, after_generation = validate_integer(request.args["since"])
+        if not since_valid_int or after_generation < 0:
+            logger.info(f"Invalid replication generation ({request.args['since']}).")
+            return (
+                generate_api_error_response(
+                    "Invalid generation (must be a valid non-negative integer)",
+                    HTTPStatus.BAD_REQUEST,
+                ),
+                HTTPStatus.BAD_REQUEST,
+            )
+    manifest_changes = replication.get_manifest_changes(after_generation)
+    if manifest_changes is None:
+        return (
+            generate_api_error_response(
+                "This server does not publish a replication manifest.",
+                HTTPStatus.NOT_FOUND,
+            ),
+            HTTPStatus.NOT_FOUND,
+        )
+    return jsonify(generate_api_response("success", manifest_changes))
+
+
+@app.route(
+    "/api/replication/weeks/<string:menu_id>/<int:year_number>/<int:week_number>"
+)
+def replication_week_api(menu_id, year_number, week_number):
+    """Replication week API. Returns the menu data of a cached week exactly as it is stored,
+    so that followers can verify it against the hash in the replication manifest."""
+    logger.info(
+        f"Got a request to the replication week API for {menu_id}, week {week_number} of {year_number}."
+    )
+    try:
+        # Only serve weeks of valid menu IDs (the menu ID is used in a file path)
+        replication.parse_week_key(
+            replication.get_week_key(menu_id, year_number, week_number)
+        )
+        menu_data = replication.read_raw_week(menu_id, year_number, week_number)
+    except ValueError:
+        menu_data = None
+    if menu_data is None:
+        return (
+            generate_api_error_response(
+                "The week is not cached.",
+                HTTPStatus.NOT_FOUND,
+            ),
+            HTTPStatus.NOT_FOUND,
+        )
+    return current_app.response_class(menu_data, mimetype=current_app.json.mimetype)
+
+
 @app.app_errorhandler(werkzeug.exceptions.NotFound)
 def not_found_error_handler(e):
     """Handles 404 errors on the page."""
@@ -3,7 +3,7 @@
 Some shared code and constants between the server and the retriever.
 
 """
-import os, logging, json, datetime, pytz
+import os, logging, datetime, pytz, threading, json_codec
 from typing import Optional, Tuple
 
 # Set up logging by creating a logger
@@ -15,10 +15,24 @@ EATERY_KISTA_NOD_MENU_ID = "/kista-nod"  # The Eatery Kista nod menu ID
 # Grab paths
 SCRIPT_FILEPATH = os.path.realpath(__file__)
 SCRIPT_DIRECTORY = os.path.dirname(SCRIPT_FILEPATH)
-CACHED_MENUS_DIRECTORY = os.path.join(SCRIPT_DIRECTORY, "cached")
+# The data directory holds cached menus, status and statistics. It defaults to the script directory,
+# but can be overridden using an environment variable (used by the load tester to point the server to a
+# synthetic cache without touching the real one).
+DATA_DIRECTORY = os.environ.get("EATERY_CACHER_DATA_DIRECTORY", SCRIPT_DIRECTORY)
+CACHED_MENUS_DIRECTORY = os.path.join(DATA_DIRECTORY, "cached")
 CONFIG_FILEPATH = os.path.join(SCRIPT_DIRECTORY, "config.ini")
-status_data_filepath = os.path.join(SCRIPT_DIRECTORY, "status.json")
-statistics_data_file_path = os.path.join(SCRIPT_DIRECTORY, "statistics.json")
+status_data_filepath = os.path.join(DATA_DIRECTORY, "status.json")
+statistics_data_file_path = os.path.join(DATA_DIRECTORY, "statistics.json")
+MENU_SNAPSHOT_FILEPATH = os.path.join(DATA_DIRECTORY, "menu_snapshot.bin")
+NOTIFICATIONS_DIRECTORY = os.path.join(DATA_DIRECTORY, "notifications")
+EVENTS_FILEPATH = os.path.join(DATA_DIRECTORY, "events.jsonl")
+EVENTS_INDEX_FILEPATH = os.path.join(DATA_DIRECTORY, "events.idx")
+RAW_PAYLOADS_DIRECTORY = os.path.join(DATA_DIRECTORY, "raw_payloads")
+RATE_LIMITS_FILEPATH = os.path.join(DATA_DIRECTORY, "rate_limits.bin")
+REPLICATION_MANIFEST_FILEPATH = os.path.join(
+    DATA_DIRECTORY, "replication_manifest.json"
+)
+REPLICATION_STATE_FILEPATH = os.path.join(DATA_DIRECTORY, "replication_state.json")
 
 
 def read_json_from_file(file_path: str) -> dict:
@@ -26,19 +40,24 @@ def read_json_from_file(file_path: str) -> dict:
 
     :param file_path: The path of the file to load"""
     logger.debug(f"Reading JSON from {file_path}...")
-    return json.loads(open(file_path, "r").read())
+    with open(file_path, "rb") as data_file:
+        return json_codec.loads(data_file.read())
 
 
 def write_json_to_file(data_to_write: dict, file_path: str) -> None:
     """Function for writing JSON to a file. The file can be new or old.
+    The JSON is written in a compact format (see json_codec).
 
     :param data_to_write: The data to write as a dict (must be JSON-serializable)
 
     :param file_path: The file path to write to."""
     logger.debug(f"Writing data {data_to_write} as JSON to {file_path}...")
-    # Open the file and write the new data
-    with open(file_path, "w") as data_file:
-        data_file.write(json.dumps(data_to_write, indent=True))
+    # Write the new data to a temporary file and then move it into place, so that
+    # readers (like other server workers) never see a half-written file.
+    temporary_file_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_file_path, "wb") as data_file:
+        data_file.write(json_codec.dumps(data_to_write))
+    os.replace(temporary_file_path, file_path)
 
 
 def get_now() -> datetime.datetime:
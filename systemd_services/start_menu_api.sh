@@ -5,4 +5,4 @@
 #Feel free to change it to your install position.
 echo "Running menu API..."
 cd /home/ubuntu/eatery_menu/EateryCacher || exit 1
-gunicorn create_server:app -b "0.0.0.0:80" #Run the server (using gunicorn)
\ No newline at end of file
+gunicorn create_server:app -k gevent --worker-connections 1000 -b "0.0.0.0:80" #Run the server (using gunicorn with gevent workers, so that menu change streams do not occupy a worker each)
\ No newline at end of file
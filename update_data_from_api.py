@@ -10,7 +10,8 @@ from shared_code import (
     get_now,
 )
 from fake_useragent import FakeUserAgent
-import logging, os, time, requests, json, datetime, pytz, menu_caching
+import logging, os, time, requests, json, datetime, pytz, menu_caching, menu_snapshot
+import raw_payload_archive, run_reports, export_static_api, replication, json_codec
 from menuparser import MenuParser
 
 # Set up logging by creating a logger
@@ -37,6 +38,9 @@ if "save_menu_ids" in downloader_settings:
             'The save_menu_ids settings has been deprecated. Please use "save_menus" instead. See the example configuration file for more information.'
         )
 menus_to_load = json.loads(downloader_settings["save_menus"])
+keep_run_reports = max(
+    int(downloader_settings.get("keep_run_reports", 20)), 0
+)  # How many reports of previous runs to keep in the status file (0 keeps none)
 logger.debug(f"Menus to load: {menus_to_load}")
 logger.info("Settings loaded.")
 
@@ -82,26 +86,40 @@ else:
 
 # (if we get here, we are good too go with an update)
 logger.info("An update should be performed. Downloading data from Eatery...")
+# Record how long each phase of the run takes (see run_reports.py)
+run_report = run_reports.RunReport()
 
 # Create a fake user-agent (yes, this is a bit fishy, but this is done to get past any possible user agent filters, since at least we're using the data for good purpose!)
-try:
-    fake_user_agent = FakeUserAgent()
-    # Create request headers with the fake user agent
-    user_agent = fake_user_agent.random
-except Exception as e:
-    logger.warning(
-        f"Fake user agent failed with exception {e}! Using bypass.", exc_info=True
-    )
-    user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:104.0) Gecko/20100101 Firefox/104.0"
+with run_report.phase("user_agent_setup"):
+    try:
+        fake_user_agent = FakeUserAgent()
+        # Create request headers with the fake user agent
+        user_agent = fake_user_agent.random
+    except Exception as e:
+        logger.warning(
+            f"Fake user agent failed with exception {e}! Using bypass.", exc_info=True
+        )
+        user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:104.0) Gecko/20100101 Firefox/104.0"
 headers = {"User-Agent": user_agent}
 logger.debug(f"Generated request headers: {headers}")
 logger.info("Sending request...")
-eatery_eateries_request = requests.get(
-    "https://api.eatery.se/wp-json/eatery/v1/eateries", headers=headers
-)
-eatery_menues_request = requests.get(
-    "https://api.eatery.se/wp-json/eatery/v1/menues", headers=headers
-)
+try:
+    with run_report.phase("fetch_eateries") as phase:
+        eatery_eateries_request = requests.get(
+            "https://api.eatery.se/wp-json/eatery/v1/eateries", headers=headers
+        )
+        phase["status_code"] = eatery_eateries_request.status_code
+        phase["bytes"] = len(eatery_eateries_request.content)
+    with run_report.phase("fetch_menus") as phase:
+        eatery_menues_request = requests.get(
+            "https://api.eatery.se/wp-json/eatery/v1/menues", headers=headers
+        )
+        phase["status_code"] = eatery_menues_request.status_code
+        phase["bytes"] = len(eatery_menues_request.content)
+except Exception as e:
+    logger.critical(f"Failed to send requests to Eatery's API: {e}", exc_info=True)
+    run_report.finish("request_error", status_data_filepath, keep_run_reports)
+    exit(1)  # ...exit with status code 1 (indicating an error)
 logger.info("Requests to Eatery sent. Validating...")
 
 # Validate the request
@@ -110,19 +128,22 @@ if (
 ):  # If we get a 200 status code
     logger.info("Status code is 200! Attempting to load JSON...")
     try:
-        eatery_eateries_request_json = eatery_eateries_request.json()
-        eatery_menues_request_json = eatery_menues_request.json()
+        with run_report.phase("json_decode"):
+            eatery_eateries_request_json = eatery_eateries_request.json()
+            eatery_menues_request_json = eatery_menues_request.json()
         logger.info("Loaded JSON from response with success.")
     except Exception as e:
         logger.critical(
             "Failed to load JSON from Eatery API! The returned JSON is invalid.",
             exc_info=True,
         )
+        run_report.finish("invalid_json", status_data_filepath, keep_run_reports)
         exit(1)  # ...exit with status code 1 (indicating an error)
 else:
     logger.critical(
         f"Received an unexpected status code from Eatery's API, {eatery_menues_request.status_code}."
     )
+    run_report.finish("http_error", status_data_filepath, keep_run_reports)
     exit(1)  # ...exit with status code 1 (indicating an error)
 
 # (if we get here, we have valid JSON data from the Eatery API)
@@ -146,32 +167,128 @@ for menu_name in menus_to_load:
         if (
             str(menu_id) in eatery_menues_request_json
         ):  # If the menu content is available
-            logger.info(f"Menu {menu_id} is available. Sending to parser...")
-            # Send the menu over to the parser
-            menu_parser = MenuParser()
-            menu_output = menu_parser.parse(eatery_menues_request_json[str(menu_id)])
-            logger.info(f"Got output {menu_output} for menu ID {menu_id}.")
-            # Add the menu data to the cached data content
-            menu_data = {
-                "menu": menu_output,
-                "menu_id": menu_id,
-                "last_retrieved_at": get_now().timestamp(),
-            }
-            menu_caching.save_cached_menu(menu_name.strip("/"), menu_data)
+            # Measure the size of the menu's part of the payload (the payload holds all menus)
+            payload_bytes = len(
+                json_codec.dumps(eatery_menues_request_json[str(menu_id)])
+            )
+            logger.info(
+                f"Menu {menu_id} is available ({payload_bytes} bytes). Archiving raw payload..."
+            )
+            # Archive the raw payload so that it can be parsed again if the parser improves
+            with run_report.phase("archive_raw_payload", menu=menu_name):
+                try:
+                    raw_payload_archive.archive_raw_payload(
+                        menu_name,
+                        menu_id,
+                        eatery_menues_request_json[str(menu_id)],
+                        get_now(),
+                    )
+                except Exception as e:
+                    logger.warning(
+                        f"Failed to archive raw payload for menu {menu_id}: {e}",
+                        exc_info=True,
+                    )
+            logger.info("Sending to parser...")
+            try:
+                # Send the menu over to the parser
+                with run_report.phase("parse", menu=menu_name):
+                    menu_parser = MenuParser()
+                    menu_output = menu_parser.parse(
+                        eatery_menues_request_json[str(menu_id)]
+                    )
+                logger.info(f"Got output {menu_output} for menu ID {menu_id}.")
+                # Add the menu data to the cached data content
+                menu_data = {
+                    "menu": menu_output,
+                    "menu_id": menu_id,
+                    "last_retrieved_at": get_now().timestamp(),
+                }
+                with run_report.phase("save", menu=menu_name):
+                    menu_caching.save_cached_menu(menu_name.strip("/"), menu_data)
+            except Exception as e:
+                # Record the failure and carry on with the other menus
+                logger.critical(
+                    f"Failed to parse or save menu {menu_id}: {e}", exc_info=True
+                )
+                run_report.set_menu_result(
+                    menu_name,
+                    "error",
+                    menu_id=menu_id,
+                    payload_bytes=payload_bytes,
+                    error=str(e),
+                )
+                continue
             logger.debug("Cached menu content was saved.")
+            run_report.set_menu_result(
+                menu_name,
+                "saved",
+                menu_id=menu_id,
+                payload_bytes=payload_bytes,
+                week_number=menu_output["week_number"],
+            )
         else:  # If the content for the menu ID is not available
             logger.warning(
                 f"Menu {menu_id} is not available from Eatery! It will not be included in the current save."
             )
+            run_report.set_menu_result(menu_name, "menu_not_available", menu_id=menu_id)
     else:
         logger.warning(
             f"Menu for {menu_name} is not available from Eatery! It will not be included in the current save."
         )
+        run_report.set_menu_result(menu_name, "eatery_not_available")
 
-logger.info("Menu iteration completed. Adding last updated date and saving to file...")
-status_content["menu_last_updated_at"] = datetime.datetime.now(
+logger.info("Menu iteration completed. Publishing menu snapshot for the server...")
+with run_report.phase("publish_snapshot") as phase:
+    try:
+        menu_snapshot.publish_snapshot()
+    except Exception as e:
+        # The server reads from the cached menus if the snapshot is outdated, so carry on
+        logger.critical(f"Failed to publish the menu snapshot: {e}", exc_info=True)
+        phase["error"] = str(e)
+# Export the API as static files if enabled (see export_static_api.py)
+(
+    export_enabled,
+    export_directory,
+    keep_export_generations,
+) = export_static_api.get_export_settings()
+if export_enabled:
+    logger.info("Exporting the API as static files...")
+    with run_report.phase("export_static_api") as phase:
+        try:
+            phase.update(
+                export_static_api.export(
+                    export_directory, keep_generations=keep_export_generations
+                )
+            )
+        except Exception as e:
+            logger.critical(f"Failed to export the API: {e}", exc_info=True)
+            phase["error"] = str(e)
+# Publish the replication manifest for follower nodes if enabled (see replication.py)
+publish_replication_manifest, _, _ = replication.get_replication_settings()
+if publish_replication_manifest:
+    logger.info("Publishing the replication manifest...")
+    with run_report.phase("publish_replication_manifest") as phase:
+        try:
+            phase.update(replication.publish_manifest())
+        except Exception as e:
+            logger.critical(
+                f"Failed to publish the replication manifest: {e}", exc_info=True
+            )
+            phase["error"] = str(e)
+logger.info("Adding last updated date and saving to file...")
+status_content["menus_last_updated_at"] = datetime.datetime.now(
     tz=pytz.timezone("Europe/Stockholm")
 ).timestamp()
 # Save the menu to the file
 write_json_to_file(status_content, status_data_filepath)
+# Runs where a menu failed are reported as such, so that they stand out in /api/status
+menus_failed = any(
+    menu_result["outcome"] == "error"
+    for menu_result in run_report.report["menus"].values()
+)
+run_report.finish(
+    "menu_error" if menus_failed else "success",
+    status_data_filepath,
+    keep_run_reports,
+)
 logger.info("Data updated to file. All done!")